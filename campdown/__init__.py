@@ -1,6 +1,94 @@
 
 """Campdown
 Usage:
+    campdown enqueue <url>... --queue=PATH
+             [--output=PATH]
+             [--quiet]
+    campdown work --queue=PATH
+             [--worker=NAME]
+             [--lease=SECONDS]
+             [--sleep=NUMBER]
+             [--quiet]
+             [--short]
+             [--no-art]
+             [--no-id3]
+             [--no-missing]
+             [--parse-workers=NUMBER]
+             [--hedge]
+             [--store=PATH]
+             [--jobs=NUMBER]
+             [--adaptive]
+             [--background-write]
+             [--http2]
+             [--connect-timeout=SECONDS]
+             [--read-timeout=SECONDS]
+             [--deadline=DURATION]
+             [--item-deadline=DURATION]
+             [--profile=PATH]
+             [--profile-memory]
+             [--trace=PATH]
+             [--record=PATH | --replay=PATH]
+             [--latency-scale=FACTOR]
+    campdown serve
+             [--output=PATH]
+             [--port=NUMBER]
+             [--workers=NUMBER]
+             [--subscriptions=PATH]
+             [--sleep=NUMBER]
+             [--quiet]
+             [--short]
+             [--no-art]
+             [--no-id3]
+             [--no-missing]
+             [--parse-workers=NUMBER]
+             [--hedge]
+             [--store=PATH]
+             [--jobs=NUMBER]
+             [--adaptive]
+             [--background-write]
+             [--http2]
+             [--connect-timeout=SECONDS]
+             [--read-timeout=SECONDS]
+             [--item-deadline=DURATION]
+    campdown verify <directory>
+             [--processes=NUMBER]
+             [--quiet]
+    campdown retag <source>
+             [--output=PATH]
+             [--processes=NUMBER]
+             [--sleep=NUMBER]
+             [--quiet]
+             [--short]
+             [--no-missing]
+             [--parse-workers=NUMBER]
+             [--http2]
+             [--connect-timeout=SECONDS]
+             [--read-timeout=SECONDS]
+    campdown resume <checkpoint>
+             [--output=PATH]
+             [--sleep=NUMBER]
+             [--quiet]
+             [--no-id3]
+             [--buffer=KILOBYTES]
+             [--background-write]
+             [--segments=NUMBER]
+             [--segment-threshold=MEGABYTES]
+             [--store=PATH]
+             [--jobs=NUMBER]
+             [--adaptive]
+             [--preflight]
+             [--http2]
+             [--connect-timeout=SECONDS]
+             [--read-timeout=SECONDS]
+             [--deadline=DURATION]
+             [--item-deadline=DURATION]
+             [--profile=PATH]
+             [--profile-memory]
+             [--trace=PATH]
+             [--record=PATH | --replay=PATH]
+             [--latency-scale=FACTOR]
+             [--checkpoint=PATH]
+             [--processes=NUMBER]
     campdown <url>
              [--output=PATH]
              [--sleep=NUMBER]
@@ -9,6 +97,29 @@ Usage:
              [--no-art]
              [--no-id3]
              [--no-missing]
+             [--parse-workers=NUMBER]
+             [--buffer=KILOBYTES]
+             [--background-write]
+             [--segments=NUMBER]
+             [--segment-threshold=MEGABYTES]
+             [--hedge]
+             [--store=PATH]
+             [--jobs=NUMBER]
+             [--adaptive]
+             [--preflight]
+             [--http2]
+             [--connect-timeout=SECONDS]
+             [--read-timeout=SECONDS]
+             [--deadline=DURATION]
+             [--item-deadline=DURATION]
+             [--profile=PATH]
+             [--profile-memory]
+             [--trace=PATH]
+             [--record=PATH | --replay=PATH]
+             [--latency-scale=FACTOR]
+             [--checkpoint=PATH]
+             [--processes=NUMBER]
+             [--plan | --stdout]
     campdown (-h | --help)
     campdown (-v | --version)
 
@@ -26,51 +137,322 @@ Options:
     --no-id3                        Sets if ID3 tagging should be ignored.
     --no-missing                    Sets if album downloads abort on missing tracks.
 
+    --parse-workers=NUMBER          Parse pages in this many worker processes.
+    --buffer=KILOBYTES              Write buffer size of output files
+                                    [default: 1024].
+    --background-write              Write files from a background thread so
+                                    slow disks don't stall the network.
+    --segments=NUMBER               Fetch large files in this many parallel
+                                    byte ranges [default: 1].
+    --segment-threshold=MEGABYTES   Minimum size of files fetched in
+                                    segments [default: 32].
+    --http2                         Use HTTP/2 where supported. Requires the
+                                    http2 extra (httpx and h2).
+    --hedge                         Repeat page requests which are slower
+                                    than 95% of recent ones and use the
+                                    first response. At most 10% of page
+                                    requests are repeated.
+
+    --connect-timeout=SECONDS       Seconds to wait for a connection to be
+                                    established [default: 10].
+    --read-timeout=SECONDS          Seconds to wait for data on an open
+                                    connection [default: 30].
+    --deadline=DURATION             Time budget of the entire run such as
+                                    "90m" or "2h". No new downloads are
+                                    started once it is used up.
+    --item-deadline=DURATION        Time budget of each single track.
+    --checkpoint=PATH               File unfinished work is written to when a
+                                    deadline is reached. Defaults to
+                                    campdown-checkpoint.jsonl in the output
+                                    folder.
+
+    --store=PATH                    Content addressed store of downloaded
+                                    audio. Tracks found on several releases
+                                    are downloaded once and placed into each
+                                    folder as hardlinks, or as reflinks or
+                                    copies if they are tagged.
+    --jobs=NUMBER                   Download this many files at once. Large
+                                    files are started first [default: 1].
+    --adaptive                      Adapt the amount of concurrent transfers
+                                    between 1 and --jobs to the measured
+                                    throughput. Backs off when the server
+                                    throttles or transfers fail.
+    --preflight                     Look up the size of every file before
+                                    downloading, estimate the duration and
+                                    refuse to start if the output folder
+                                    lacks the space.
+
+    --profile=PATH                  Profile the page fetches, parsing, media
+                                    transfers, tagging and artwork of the
+                                    run separately and write a .pstats file
+                                    per phase to this folder.
+    --profile-memory                Trace allocations while profiling and
+                                    report the largest allocation sites.
+    --trace=PATH                    Write a timeline of every request, retry,
+                                    transfer and phase of the run to this
+                                    file in the Chrome Trace Event format.
+    --record=PATH                   Record every request and response of the
+                                    run along with its timing into this
+                                    archive.
+    --replay=PATH                   Serve all requests from an archive written
+                                    with --record instead of the network.
+    --latency-scale=FACTOR          Multiplier of the recorded latencies and
+                                    transfer times while replaying. 0 replays
+                                    as fast as possible [default: 1].
+
+    --plan                          Only resolve the URL and print a JSON line
+                                    per track instead of downloading anything.
+    --stdout                        Stream tagged tracks to stdout instead of
+                                    writing files. Artwork is not downloaded.
+
+    --queue=PATH                    SQLite job queue shared between workers.
+    --worker=NAME                   Unique worker name. Defaults to the host
+                                    name and process ID.
+    --lease=SECONDS                 Seconds a leased job is kept without a
+                                    heartbeat [default: 300].
+
+    --processes=NUMBER              Amount of worker processes. Verify and
+                                    retag default to the amount of CPUs.
+                                    Downloads are split between processes by
+                                    output path and run in a single process
+                                    by default.
+
+    --port=NUMBER                   Port of the local HTTP API [default: 8420].
+    --workers=NUMBER                Amount of jobs worked on at once
+                                    [default: 2].
+    --subscriptions=PATH            File subscribed pages are kept in.
+                                    Defaults to campdown-subscriptions.json
+                                    in the output folder.
+
 Description:
     Command line Bandcamp downloader. Takes in Bandcamp page URLs and fetches
     tracks, albums as well as their metadata and covers while retaining clean
     and concise formatting of output information.
 
+    The enqueue command splits URLs into album and track jobs placed in a
+    shared queue. Any number of work commands on different nodes then lease
+    distinct jobs from that queue. Output paths are stored as absolute paths
+    so every node has to mount the library at the same location.
+
+    Runs stopped by a deadline write a checkpoint of the unfinished tracks
+    and pages. The resume command continues from that checkpoint or from any
+    plan written with --plan.
+
+    The serve command keeps running and downloads URLs submitted through a
+    local HTTP API on 127.0.0.1. Jobs are submitted with POST /jobs, listed
+    with GET /jobs and cancelled with DELETE /jobs/<id>. Pages added with
+    POST /subscriptions are downloaded again in their interval.
+
+    The verify command walks the MPEG frames of every MP3 file in a folder
+    without any network access and lists truncated or corrupt files, one path
+    and problem per line separated by a tab.
+
+    The retag command rewrites the ID3 tags of files already downloaded
+    without downloading them again. The source is either a plan or a URL
+    whose pages are fetched to resolve the current metadata. Files are
+    retagged in a pool of worker processes. Files which are missing or can't
+    be retagged are listed like with the verify command.
+
 Requirements:
     Python 3.4+, requests, mutagen, docopt
 """
 
+import io
 import sys
 import os
+import errno
+import json
+import contextlib
+import collections
 
-from docopt import docopt
-
-from .helpers import *
+# Heavier dependencies (docopt, requests and mutagen) are imported where they
+# are first used so that "--help", "--version" and "--no-id3" runs stay fast.
 from .track import Track
 from .album import Album
 from .discography import Discography
-
-import requests
+from .api import resolve, iter_tracks, iter_plan, download
+from .deadline import Deadline, parse_duration
+from .helpers import safe_print
+from .sinks import FileSink, StreamSink
+from .parsing import Parser
+from .store import ObjectStore
+from .profiling import Profiler, Tracer, set_profiler, set_tracer
+from .transport import get_transport, set_transport, RequestsTransport, HTTP2Transport, HedgingTransport, AdaptiveTransport, http2_available
+from .recording import RecordingTransport, ReplayTransport
 
 
 def cli():
     # Acts as the CLI for the project and main entry point for the command.
+    from docopt import docopt
+
     args = docopt(__doc__, version="campdown 1.48")
 
+    if args["verify"]:
+        return verify_cli(args)
+
     try:
         output_dir = args["--output"]
 
     except(IndexError):
         output_dir = ""
 
+    timeout = (float(args["--connect-timeout"]), float(args["--read-timeout"]))
+
+    if args["--replay"]:
+        set_transport(ReplayTransport(args["--replay"], scale=float(args["--latency-scale"]), timeout=timeout))
+
+    elif args["--http2"]:
+        if not http2_available():
+            print("HTTP/2 requires httpx and h2. Install them with: pip install campdown[http2]")
+            sys.exit(1)
+
+        set_transport(HTTP2Transport(timeout=timeout))
+
+    else:
+        set_transport(RequestsTransport(timeout=timeout))
+
+    if args["--record"]:
+        set_transport(RecordingTransport(get_transport(), args["--record"]))
+
+    # Pages are hedged on top of the recording so every request is recorded.
+    recorded = get_transport()
+
+    if args["--adaptive"]:
+        set_transport(AdaptiveTransport(get_transport(), int(args["--jobs"])))
+
+    adaptive = get_transport()
+
+    if args["--hedge"]:
+        set_transport(HedgingTransport(get_transport()))
+
+    if args["--profile"]:
+        set_profiler(Profiler(args["--profile"], memory=args["--profile-memory"]))
+
+    if args["--trace"]:
+        set_tracer(Tracer(args["--trace"]))
+
+    try:
+        main(args, output_dir)
+
+    finally:
+        if args["--profile"]:
+            written = set_profiler(None).close()
+
+            if not args["--quiet"]:
+                print("\nWrote {} profile reports to {}".format(len(written), os.path.abspath(args["--profile"])),
+                      file=(sys.stderr if args["--plan"] or args["--stdout"] else sys.stdout))
+
+        if args["--trace"]:
+            events = set_tracer(None).close()
+
+            if not args["--quiet"]:
+                print("\nWrote {} trace events to {}".format(events, os.path.abspath(args["--trace"])),
+                      file=(sys.stderr if args["--plan"] or args["--stdout"] else sys.stdout))
+
+        if args["--hedge"] and not args["--quiet"]:
+            stats = get_transport().stats()
+
+            # Keep the report away from plans and tracks written to stdout.
+            print(
+                "\nHedged {} of {} page requests. {} hedges arrived first.".format(
+                    stats["hedged"], stats["requests"], stats["won"]),
+                file=(sys.stderr if args["--plan"] or args["--stdout"] else sys.stdout)
+            )
+
+        # Transfers made by worker processes are reported by the workers.
+        if args["--adaptive"] and not args["--quiet"] and adaptive.stats()["transfers"]:
+            stats = adaptive.stats()
+            stream = sys.stderr if args["--plan"] or args["--stdout"] else sys.stdout
+
+            print(
+                "\nAdaptive concurrency ended at {} of {} transfers after {} increases and {} decreases. "
+                "{} throttled, {} timed out and {} incomplete transfers.".format(
+                    stats["limit"], stats["maximum"], stats["increases"], stats["decreases"],
+                    stats["signals"].get("throttled", 0), stats["signals"].get("timeout", 0),
+                    stats["signals"].get("incomplete", 0)),
+                file=stream
+            )
+
+            for seconds, previous, limit, reason in stats["decisions"]:
+                print("{:>8.1f}s {} -> {} ({})".format(seconds, previous, limit, reason), file=stream)
+
+        if args["--record"] or args["--replay"]:
+            stats = recorded.stats()
+            recorded.close()
+
+            if not args["--quiet"]:
+                if args["--record"]:
+                    message = "\nRecorded {} exchanges with {:.1f} MB of data to {}".format(
+                        stats["exchanges"], stats["bytes"] / 1048576, args["--record"])
+
+                else:
+                    message = "\nReplayed {} requests from {}. {} requests were not recorded.".format(
+                        stats["served"], args["--replay"], stats["missing"])
+
+                print(message, file=(sys.stderr if args["--plan"] or args["--stdout"] else sys.stdout))
+
+
+def main(args, output_dir):
+    # Runs the command selected on the command line.
+    try:
+        deadline = parse_duration(args["--deadline"]) if args["--deadline"] else None
+        item_deadline = parse_duration(args["--item-deadline"]) if args["--item-deadline"] else None
+
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    if args["enqueue"] or args["work"]:
+        return queue_cli(args, output_dir, deadline, item_deadline)
+
+    if args["serve"]:
+        return serve_cli(args, output_dir, item_deadline)
+
+    if args["retag"]:
+        return retag_cli(args, output_dir)
+
     downloader = Downloader(
-        args["<url>"],
+        args["<checkpoint>"] if args["resume"] else args["<url>"][0],
         out=output_dir,
         verbose=(not args["--quiet"]),
         short=(args["--short"]),
         sleep=(int(args["--sleep"]) if args["--sleep"] else 30),
         art_enabled=(not args["--no-art"]),
         id3_enabled=(not args["--no-id3"]),
-        abort_missing=(args["--no-missing"])
+        abort_missing=(args["--no-missing"]),
+        sink=(StreamSink(sys.stdout.buffer, args["--background-write"]) if args["--stdout"] else None),
+        parse_workers=(int(args["--parse-workers"]) if args["--parse-workers"] else 0),
+        buffer_size=(int(args["--buffer"]) * 1024),
+        background=args["--background-write"],
+        segments=int(args["--segments"]),
+        segment_threshold=(int(args["--segment-threshold"]) * 1048576),
+        deadline=deadline,
+        item_deadline=item_deadline,
+        checkpoint=args["--checkpoint"],
+        store=(ObjectStore(args["--store"]) if args["--store"] else None),
+        jobs=int(args["--jobs"]),
+        processes=(int(args["--processes"]) if args["--processes"] else 1),
+        preflight=args["--preflight"]
     )
 
     try:
-        downloader.run()
+        if args["resume"]:
+            downloader.resume()
+
+        elif args["--plan"]:
+            # Keep status messages away from the plan written to stdout.
+            plan_stream = sys.stdout
+
+            with contextlib.redirect_stdout(sys.stderr):
+                downloader.plan(plan_stream)
+
+        elif args["--stdout"]:
+            # Keep status messages away from the tracks written to stdout.
+            with contextlib.redirect_stdout(sys.stderr):
+                downloader.run()
+
+        else:
+            downloader.run()
 
     except (KeyboardInterrupt):
         if not args["--quiet"]:
@@ -78,6 +460,219 @@ def cli():
 
         sys.exit(2)
 
+    except OSError as e:
+        # Report a full disk instead of a traceback.
+        if e.errno != errno.ENOSPC:
+            raise
+
+        print("\n{}.".format(e.strerror))
+
+        sys.exit(1)
+
+
+def verify_cli(args):
+    # Handles the verify command of the CLI.
+    import time
+    from .verify import verify
+
+    start = time.monotonic()
+    scanned = 0
+    broken = []
+
+    try:
+        for path, problem in verify(
+            args["<directory>"],
+            processes=(int(args["--processes"]) if args["--processes"] else None)
+        ):
+            scanned += 1
+
+            if problem:
+                broken.append((path, problem))
+
+    except (KeyboardInterrupt):
+        if not args["--quiet"]:
+            print("\nInterrupt caught. Exiting program...", file=sys.stderr)
+
+        sys.exit(2)
+
+    # Print the files to fetch again to stdout so they can be piped.
+    for path, problem in sorted(broken):
+        safe_print("{}\t{}".format(path, problem))
+
+    if not args["--quiet"]:
+        print("Verified {} files in {:.1f} seconds. {} need to be fetched again.".format(
+            scanned, time.monotonic() - start, len(broken)), file=sys.stderr)
+
+    if broken:
+        sys.exit(1)
+
+
+def retag_cli(args, output_dir):
+    # Handles the retag command of the CLI.
+    import time
+    from .retag import retag
+
+    start = time.monotonic()
+    counts = collections.Counter()
+    problems = []
+
+    parser = Parser(int(args["--parse-workers"]) if args["--parse-workers"] else 0)
+
+    settings = {
+        "verbose": False,
+        "silent": args["--quiet"],
+        "short": args["--short"],
+        "sleep": (int(args["--sleep"]) if args["--sleep"] else 30),
+        "art_enabled": False,
+        "abort_missing": args["--no-missing"],
+        "parser": parser
+    }
+
+    def records():
+        # Plans are retagged as they are. URLs are resolved again.
+        if os.path.isfile(args["<source>"]):
+            with open(args["<source>"], encoding="utf-8") as f:
+                for item in iter_plan(f, **settings):
+                    yield item if isinstance(item, dict) else item.record()
+
+        else:
+            output = os.path.join(os.path.abspath(output_dir or os.getcwd()), "")
+
+            for track in iter_tracks(args["<source>"], output, **settings):
+                yield track.record()
+
+    try:
+        for path, outcome, error in retag(
+            records(),
+            processes=(int(args["--processes"]) if args["--processes"] else None)
+        ):
+            counts[outcome] += 1
+
+            if outcome in ("missing", "failed"):
+                problems.append((path, error or outcome))
+
+    except (KeyboardInterrupt):
+        if not args["--quiet"]:
+            print("\nInterrupt caught. Exiting program...", file=sys.stderr)
+
+        sys.exit(2)
+
+    finally:
+        parser.close()
+
+    # Print the files which weren't retagged to stdout so they can be piped.
+    for path, problem in sorted(problems):
+        safe_print("{}\t{}".format(path, problem))
+
+    if not args["--quiet"]:
+        print("Retagged {} files in {:.1f} seconds ({} in place, {} rewritten). {} were unchanged, {} missing and {} failed.".format(
+            counts["in place"] + counts["rewritten"], time.monotonic() - start, counts["in place"],
+            counts["rewritten"], counts["unchanged"], counts["missing"], counts["failed"]), file=sys.stderr)
+
+    if problems:
+        sys.exit(1)
+
+
+def queue_cli(args, output_dir, deadline=None, item_deadline=None):
+    # Handles the enqueue and work commands of the CLI.
+    from .jobs import JobQueue, enqueue, work
+
+    queue = JobQueue(args["--queue"], lease=int(args["--lease"] or 300))
+
+    try:
+        if args["enqueue"]:
+            added = enqueue(
+                queue,
+                args["<url>"],
+                os.path.join(os.path.abspath(output_dir or os.getcwd()), ""),
+                verbose=(not args["--quiet"])
+            )
+
+            if not args["--quiet"]:
+                print("\nAdded {} jobs to the queue.".format(added))
+
+        else:
+            parser = Parser(int(args["--parse-workers"]) if args["--parse-workers"] else 0)
+
+            try:
+                finished = work(
+                    queue,
+                    worker=args["--worker"],
+                    verbose=(not args["--quiet"]),
+                    short=(args["--short"]),
+                    sleep=(int(args["--sleep"]) if args["--sleep"] else 30),
+                    art_enabled=(not args["--no-art"]),
+                    id3_enabled=(not args["--no-id3"]),
+                    abort_missing=(args["--no-missing"]),
+                    parser=parser,
+                    sink=FileSink(background=args["--background-write"]),
+                    deadline=Deadline(deadline),
+                    item_deadline=item_deadline,
+                    store=(ObjectStore(args["--store"]) if args["--store"] else None),
+                    jobs=int(args["--jobs"])
+                )
+
+            finally:
+                parser.close()
+
+            if not args["--quiet"]:
+                print("\nFinished {} jobs. Worker complete.".format(finished))
+
+                counts = queue.counts()
+
+                if counts.get("pending") or counts.get("leased"):
+                    print("{} jobs are left in the queue.".format(
+                        counts.get("pending", 0) + counts.get("leased", 0)))
+
+    except (KeyboardInterrupt):
+        if not args["--quiet"]:
+            print("\nInterrupt caught. Exiting program...")
+
+        sys.exit(2)
+
+    finally:
+        queue.close()
+
+
+def serve_cli(args, output_dir, item_deadline=None):
+    # Handles the serve command of the CLI.
+    from .service import Service, serve
+
+    output = os.path.abspath(output_dir or os.getcwd())
+    os.makedirs(output, exist_ok=True)
+
+    parser = Parser(int(args["--parse-workers"]) if args["--parse-workers"] else 0)
+
+    service = Service(
+        output,
+        workers=int(args["--workers"]),
+        subscriptions=args["--subscriptions"],
+        verbose=(not args["--quiet"]),
+        short=(args["--short"]),
+        sleep=(int(args["--sleep"]) if args["--sleep"] else 30),
+        art_enabled=(not args["--no-art"]),
+        id3_enabled=(not args["--no-id3"]),
+        abort_missing=(args["--no-missing"]),
+        background=args["--background-write"],
+        parser=parser,
+        item_deadline=item_deadline,
+        store=(ObjectStore(args["--store"]) if args["--store"] else None),
+        jobs=int(args["--jobs"])
+    )
+
+    if not args["--quiet"]:
+        print("Serving on http://127.0.0.1:{}/ writing to {}".format(args["--port"], output))
+
+    try:
+        serve(service, port=int(args["--port"]))
+
+    except (KeyboardInterrupt):
+        if not args["--quiet"]:
+            print("\nInterrupt caught. Stopping service...")
+
+    finally:
+        parser.close()
+
 
 class Downloader:
     """
@@ -95,9 +690,35 @@ class Downloader:
         art_enabled (bool): if True the Bandcamp page's artwork will be
             downloaded and saved alongside each of the found tracks.
         id3_enabled (bool): if True tracks downloaded will receive new ID3 tags.
+        abort_missing (bool): skips albums which are missing tracks.
+        sink (FileSink, StreamSink): output sink to write tracks to. Defaults
+            to writing files to the output folder.
+        parse_workers (number): amount of worker processes pages are parsed
+            in. Zero parses pages in the current process.
+        buffer_size (number): write buffer size of output files in bytes.
+        background (bool): if True output files are written by a background
+            thread.
+        segments (number): amount of byte ranges large files are fetched in
+            parallel with. Servers must accept ranged requests.
+        segment_threshold (number): size in bytes from which files are
+            fetched in segments.
+        deadline (number): seconds the entire run may take. No new downloads
+            are started once they are used up.
+        item_deadline (number): seconds each track may take at most.
+        checkpoint (str): path unfinished work is written to as JSON lines
+            when a deadline is reached. Defaults to a file in the output
+            folder.
+        store (ObjectStore): content addressed store audio payloads are
+            shared through between releases.
+        jobs (number): amount of files downloaded at once.
+        processes (number): amount of worker processes tracks are downloaded
+            in. Tracks are resolved in the main process.
+        preflight (bool): if True all tracks are resolved and sized before
+            any download starts and runs which don't fit onto the output
+            filesystem are refused.
     """
 
-    def __init__(self, url, out=None, verbose=False, silent=False, short=False, sleep=30, id3_enabled=True, art_enabled=True, abort_missing=False):
+    def __init__(self, url, out=None, verbose=False, silent=False, short=False, sleep=30, id3_enabled=True, art_enabled=True, abort_missing=False, sink=None, parse_workers=0, buffer_size=1048576, background=False, segments=1, segment_threshold=33554432, deadline=None, item_deadline=None, checkpoint=None, store=None, jobs=1, processes=1, preflight=False):
         self.url = url
         self.output = out
         self.verbose = verbose
@@ -107,10 +728,22 @@ class Downloader:
         self.id3_enabled = id3_enabled
         self.art_enabled = art_enabled
         self.abort_missing = abort_missing
+        self.sink = sink or FileSink(buffer_size, background)
+        self.parser = Parser(parse_workers)
+        self.buffer_size = buffer_size
+        self.background = background
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.deadline = deadline
+        self.item_deadline = item_deadline
+        self.checkpoint = checkpoint
+        self.store = store
+        self.jobs = jobs
+        self.processes = processes
+        self.preflight = preflight
 
-        # Variables used during retrieving of information.
+        # Request of the supplied URL once it has been retrieved.
         self.request = None
-        self.content = None
 
         # Get the script path in case no output path is specified.
         # self.work_path = os.path.join(
@@ -121,114 +754,349 @@ class Downloader:
         if self.output:
             # Make sure that the output folder has the right path syntax
             if not os.path.isabs(self.output):
-                if not os.path.exists(os.path.join(self.work_path, self.output)):
-                    os.makedirs(os.path.join(self.work_path, self.output))
-
                 self.output = os.path.join(self.work_path, self.output)
 
         else:
             # If no path is specified use the absolute path of the main file.
             self.output = self.work_path
 
-    def run(self):
+    def tracks(self):
         """
-        Begins downloading the content from the prepared settings.
+        Lazily resolves the tracks behind the supplied URL using the settings
+        of this downloader.
+
+        Returns:
+            Generator of prepared track instances as returned by iter_tracks.
         """
 
-        if not valid_url(self.url):
-            if not self.silent:
-                print("The supplied URL is not a valid URL.")
+        return iter_tracks(
+            self.url,
+            self.output,
+            request=self.request,
+            verbose=self.verbose,
+            silent=self.silent,
+            short=self.short,
+            sleep=self.sleep,
+            art_enabled=self.art_enabled,
+            id3_enabled=self.id3_enabled,
+            abort_missing=self.abort_missing,
+            parser=self.parser
+        )
 
-            return False
+    def plan(self, stream):
+        """
+        Resolves the supplied URL by running only the prepare and fetch phases
+        and writes one JSON line per track to the given stream. No media is
+        downloaded and no directories are created.
 
-        # Get the content from the supplied Bandcamp URL.
-        self.request = safe_get(self.url)
-        self.content = self.request.content.decode("utf-8")
+        Args:
+            stream (file): text stream to write the JSON lines to.
 
-        if self.request.status_code != 200:
-            if not self.silent:
-                print("An error occurred while trying to access your supplied URL. Status code: {}".format(
-                    self.request.status_code))
+        Returns:
+            Number of planned tracks.
+        """
 
-            return
+        count = 0
 
-        # Get the type of the page supplied to the downloader.
-        pagetype = page_type(self.content)
+        try:
+            for track in self.tracks():
+                stream.write(json.dumps(track.record()) + "\n")
+                stream.flush()
 
-        if pagetype == "track":
-            if self.verbose:
-                print("\nDetected Bandcamp track.")
+                count += 1
 
-            track = Track(
-                self.url,
-                self.output,
-                request=self.request,
-                verbose=self.verbose,
-                silent=self.silent,
-                short=self.short,
-                sleep=self.sleep,
-                art_enabled=self.art_enabled,
-                id3_enabled=self.id3_enabled
-            )
+        finally:
+            self.parser.close()
 
-            if track.prepare():  # Prepare the track by filling out content.
-                track.download()  # Begin the download process.
+        return count
 
-                if self.verbose:
-                    print("\nFinished track download. Downloader complete.")
+    def download(self, tracks, deadline):
+        """
+        Downloads tracks with the settings of this downloader.
 
-            else:
-                if self.verbose:
-                    print(
-                        "\nThe track you are trying to download is not publicly available. Consider purchasing it if you want it.")
-
-        elif pagetype == "album":
-            if self.verbose:
-                print("\nDetected Bandcamp album.")
-
-            album = Album(
-                self.url,
-                self.output,
-                request=self.request,
-                verbose=self.verbose,
-                silent=self.silent,
-                short=self.short,
-                sleep=self.sleep,
-                art_enabled=self.art_enabled,
-                id3_enabled=self.id3_enabled,
-                abort_missing=self.abort_missing
-            )
+        Args:
+            tracks (iterable): prepared tracks or track records.
+            deadline (Deadline): deadline of the run.
 
-            if album.prepare():  # Prepare the album with information from the supplied URL.
-                album.download() if album.fetch() else False  # Start the download process if fetches succeeded.
+        Returns:
+            Tuple of the download summary and the JSON lines of the tracks
+            left unfinished by a deadline.
+        """
 
-            if self.verbose:
-                print("\nFinished album download. Downloader complete.")
+        checkpoint = io.StringIO()
 
-        elif pagetype == "discography":
-            if self.verbose:
-                print("\nDetected Bandcamp discography page.")
+        # Tracks written as files can be downloaded in several processes.
+        if self.processes > 1 and self.sink.files:
+            try:
+                return self.fan_out(tracks, deadline, checkpoint), checkpoint.getvalue()
 
-            page = Discography(
-                self.url,
-                self.output,
-                request=self.request,
+            finally:
+                self.parser.close()
+
+        try:
+            summary = download(
+                tracks,
                 verbose=self.verbose,
                 silent=self.silent,
-                short=self.short,
                 sleep=self.sleep,
-                art_enabled=self.art_enabled,
                 id3_enabled=self.id3_enabled,
-                abort_missing=self.abort_missing
+                sink=self.sink,
+                segments=self.segments,
+                segment_threshold=self.segment_threshold,
+                deadline=deadline,
+                item_deadline=self.item_deadline,
+                checkpoint=checkpoint,
+                store=self.store,
+                jobs=self.jobs
             )
 
-            page.prepare()  # Make discography gather all information it requires.
-            page.fetch()  # Begin telling prepared items to fetch their own information.
-            page.download()  # Start the download process.
+        finally:
+            self.parser.close()
 
-            if self.verbose:
-                print("\nFinished discography download. Downloader complete.")
+        if self.store and self.verbose:
+            print("\nStored {} new payloads and placed {} files from the store.".format(
+                self.store.stored, self.store.reused))
 
-        else:
+            if self.store.copied:
+                print("{} files were copied as the filesystem doesn't support reflinks.".format(self.store.copied))
+
+        return summary, checkpoint.getvalue()
+
+    def fan_out(self, tracks, deadline, checkpoint):
+        """
+        Downloads tracks in worker processes with the settings of this
+        downloader.
+
+        Args:
+            tracks (iterable): prepared tracks or track records.
+            deadline (Deadline): deadline of the run.
+            checkpoint (file): text stream the records of unfinished tracks
+                are written to.
+
+        Returns:
+            The download summary of all worker processes.
+        """
+
+        from .fanout import FanOut, transport_settings, find_transport
+
+        summary = FanOut(self.processes, verbose=self.verbose).run(
+            tracks,
+            {
+                "transport": transport_settings(get_transport()),
+                "adaptive": find_transport(get_transport(), AdaptiveTransport) is not None,
+                "silent": self.silent,
+                "sleep": self.sleep,
+                "id3_enabled": self.id3_enabled,
+                "buffer_size": self.buffer_size,
+                "background": self.background,
+                "segments": self.segments,
+                "segment_threshold": self.segment_threshold,
+                "item_deadline": self.item_deadline,
+                "store": (self.store.path if self.store else None),
+                "jobs": self.jobs
+            },
+            deadline=deadline,
+            checkpoint=checkpoint
+        )
+
+        if self.store and self.verbose:
+            print("\nStored {} new payloads and placed {} files from the store.".format(
+                summary["stored"], summary["reused"]))
+
+            if summary["copied"]:
+                print("{} files were copied as the filesystem doesn't support reflinks.".format(summary["copied"]))
+
+        if self.verbose:
+            print("\n{} downloaded, {} skipped and {} failed in {} processes.".format(
+                summary["downloaded"], summary["skipped"], summary["failed"], self.processes))
+
+            # Each worker adapted the transfers of its own slots.
+            for index, stats in summary["adaptive"]:
+                print("Adaptive concurrency of worker {} ended at {} of {} transfers after {} increases and {} decreases.".format(
+                    index + 1, stats["limit"], stats["maximum"], stats["increases"], stats["decreases"]))
+
+        return summary
+
+    def check_space(self, tracks):
+        """
+        Sizes all tracks before they are downloaded, reports the amount of
+        data and the estimated duration and checks that the files fit onto
+        the output filesystem.
+
+        Args:
+            tracks (iterable): prepared tracks or track records.
+
+        Returns:
+            List of the tracks with their sizes.
+
+        Raises:
+            OSError: with ENOSPC if the output filesystem lacks the space.
+        """
+
+        from .preflight import preflight, format_duration, RESERVE
+
+        tracks = list(tracks)
+
+        report = preflight(tracks, self.output, jobs=self.jobs * self.processes,
+                           store=(self.store.path if self.store else None),
+                           linked=(not self.id3_enabled))
+
+        if self.verbose:
+            print("\nPre-flight: {} files with {:.1f} MB to download. {} are already present and {} of unknown size.".format(
+                report["files"], report["bytes"] / 1048576, report["present"], report["unknown"]))
+
+            if report["eta"] is not None:
+                print("Estimated duration {} at {:.1f} MB/s per transfer with {} transfers.".format(
+                    format_duration(report["eta"]), report["throughput"] / 1048576,
+                    max(1, min(self.jobs * self.processes, report["files"]))))
+
+            print("{:.1f} MB are free on the filesystem of {}.".format(report["free"] / 1048576, report["folder"]))
+
+        if report["needed"] > report["free"]:
+            raise OSError(errno.ENOSPC, "Not enough space for the download. {:.1f} MB are needed on the filesystem of {} but only {:.1f} MB are free".format(
+                report["needed"] / 1048576, report["folder"], report["free"] / 1048576))
+
+        if not self.silent and report["free"] - report["needed"] < report["total"] * RESERVE:
+            print("Warning: less than {:.0%} of the filesystem of {} will be left free by the download.".format(
+                RESERVE, report["folder"]))
+
+        return tracks
+
+    def save_checkpoint(self, summary, lines, resumed=None):
+        """
+        Writes the work left unfinished by a deadline to the checkpoint and
+        reports it.
+
+        Args:
+            summary (dict): download summary of the run.
+            lines (str): JSON lines describing the unfinished work.
+            resumed (str): path of the checkpoint the run was resumed from.
+        """
+
+        path = self.checkpoint or os.path.join(self.output, "campdown-checkpoint.jsonl")
+
+        if not lines:
+            # Nothing is left of the checkpoint this run was resumed from.
+            if resumed and os.path.abspath(resumed) == os.path.abspath(path):
+                os.remove(path)
+
+            return
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(lines)
+
+        if not self.silent:
+            if summary["expired"]:
+                print("\nDeadline reached. No further downloads were started.")
+
+            print("\n{} downloaded, {} skipped, {} failed and {} unfinished.".format(
+                summary["downloaded"], summary["skipped"], summary["failed"], summary["unfinished"]))
+
+            safe_print("Remaining work was written to {}. Continue with: campdown resume \"{}\"".format(path, path))
+
+    def resume(self):
+        """
+        Continues a run from a checkpoint or plan file given as the URL. Track
+        records are downloaded directly while unresolved pages are resolved
+        again with their finished files being skipped.
+        """
+
+        deadline = Deadline(self.deadline)
+
+        with open(self.url, encoding="utf-8") as f:
+            pending = collections.deque(line for line in f if line.strip())
+
+        def records():
+            # Lines are only dropped once all of their tracks were handled.
+            while pending:
+                for item in iter_plan(
+                    [pending[0]],
+                    verbose=self.verbose,
+                    silent=self.silent,
+                    short=self.short,
+                    sleep=self.sleep,
+                    art_enabled=self.art_enabled,
+                    id3_enabled=self.id3_enabled,
+                    abort_missing=self.abort_missing,
+                    parser=self.parser
+                ):
+                    yield item
+
+                pending.popleft()
+
+        items = records()
+
+        if self.preflight and self.sink.files:
+            # Every line is resolved up front so the lines are left to the
+            # queue of sized tracks.
+            queued = collections.deque(self.check_space(items))
+
+            def sized():
+                while queued:
+                    yield queued.popleft()
+
+            items = sized()
+
+        summary, lines = self.download(items, deadline)
+
+        if summary["expired"] and self.preflight and self.sink.files:
+            lines += "".join(json.dumps(item if isinstance(item, dict) else item.record()) + "\n" for item in queued)
+
+        if summary["expired"] and pending:
+            # Track records which were cut short are part of the lines already.
+            if "source" not in json.loads(pending[0]):
+                pending.popleft()
+
+            lines += "".join(line if line.endswith("\n") else line + "\n" for line in pending)
+
+        self.save_checkpoint(summary, lines, resumed=self.url)
+
+        if self.verbose:
+            print("\nFinished resuming {}. Downloader complete.".format(self.url))
+
+    def run(self):
+        """
+        Begins downloading the content from the prepared settings.
+        """
+
+        deadline = Deadline(self.deadline)
+
+        pagetype, self.request = resolve(self.url, silent=self.silent)
+
+        if not pagetype:
+            return False
+
+        if pagetype not in ("track", "album", "discography"):
             if not self.silent:
                 print("Invalid page type. Exiting.")
+
+            return False
+
+        if self.verbose:
+            if pagetype == "discography":
+                print("\nDetected Bandcamp discography page.")
+
+            else:
+                print("\nDetected Bandcamp {}.".format(pagetype))
+
+        # Create the output folder if it doesn't already exist.
+        self.sink.makedirs(self.output)
+
+        tracks = self.tracks()
+
+        # Tracks are downloaded as soon as each of them has been resolved
+        # unless they are sized first.
+        if self.preflight and self.sink.files:
+            tracks = self.check_space(tracks)
+
+        summary, lines = self.download(tracks, deadline)
+
+        if summary["expired"]:
+            # Pages which weren't resolved yet are covered by resolving the URL
+            # again. Finished files are skipped at that point.
+            lines += json.dumps({"source": self.url, "output": self.output}) + "\n"
+
+        self.save_checkpoint(summary, lines)
+
+        if self.verbose:
+            print("\nFinished {} download. Downloader complete.".format(pagetype))
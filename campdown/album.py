@@ -3,8 +3,9 @@ import html
 
 from .helpers import *
 from .track import Track
-
-import requests
+from .parsing import inline
+from .sinks import FileSink
+from .profiling import phase
 
 
 class Album:
@@ -27,9 +28,12 @@ class Album:
         art_enabled (bool): if True the Bandcamp page's artwork will be
             downloaded and saved alongside each of the found tracks.
         id3_enabled (bool): if True tracks downloaded will receive new ID3 tags.
+        abort_missing (bool): sets if a missing track aborts the album.
+        parser (Parser): parser used for the album's track pages. Defaults to
+            parsing in the current process.
     """
 
-    def __init__(self, url, output, request=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False):
+    def __init__(self, url, output, request=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, parser=None):
         # Requests and other information can optionally be filled to remove unneccessary
         # operations such as making a request to a URL that has already been fetched
         # by another component.
@@ -47,6 +51,9 @@ class Album:
 
         self.queue = []  # Queue array to store album tracks in.
 
+        # Set if iterating the album's tracks was aborted due to a missing track.
+        self.aborted = False
+
         # Store the album request object for later reference.
         self.request = request
         self.content = None
@@ -73,6 +80,9 @@ class Album:
         # Sets if a missing album track aborts the entire album download.
         self.abort_missing = abort_missing
 
+        # Parser used to parse the track pages.
+        self.parser = parser or inline
+
     def prepare(self):
         """
         Prepares the album class by gathering information about the album and
@@ -158,29 +168,62 @@ class Album:
 
         return True
 
-    def fetch(self):
+    def iter_tracks(self):
         """
-        Gathers required information for the tracks in this album and prepares
-        them to be used by the download method. Requests are made to each of the
-        tracks' Bandcamp pages. Requires the prepare method to be run beforehand.
-
-        Returns:
-            True if all fetches were successful. False if missing flag was set
-            and a track was unable to be fetched.
+        Gathers required information for the tracks in this album and yields
+        each track as soon as its Bandcamp page has been parsed. Requests are
+        made to each of the tracks' Bandcamp pages while iterating. Requires
+        the prepare method to be run beforehand.
+
+        Yields:
+            Prepared track instances in album order. Iteration stops early if
+            the missing flag is set and a track was unable to be fetched.
         """
 
+        self.aborted = False
+
         # Split the string and convert it into an array.
         tracks = self.content.split(
-            '<table class="track_list track_table" id="track_table">', 1)[1].split('</table>')[0].split("<tr")
+            '<table class="track_list track_table" id="track_table">', 1)[1].split('</table>', 1)[0].split("<tr")
 
-        # Iterate over the tracks found and begin traversing the given
-        # track's title information and insert the track data in the queue.
+        # Iterate over the tracks found and yield the track data.
         if self.verbose:
             safe_print('\n{} - {}'.format(self.artist, self.title))
 
+        # Prepare the tracks in order while their pages are parsed.
+        for track, ready in self.parser.prepare(self.candidates(tracks)):
+            if ready:
+                if self.verbose:
+                    safe_print("{}. {}".format(track.index, track.url))
+
+                yield track
+
+            else:
+                if self.verbose:
+                    safe_print(strike("{}. {}".format(track.index, track.url)))
+
+                if self.abort_missing:
+                    if self.verbose:
+                        safe_print("Abort missing: A track fetch failed - skipping album download.")
+
+                    self.aborted = True
+
+                    return
+
+    def candidates(self, tracks):
+        """
+        Creates the track instances of the album from its track list rows.
+
+        Args:
+            tracks (list): rows of the album's track list table.
+
+        Yields:
+            Track instances which have not been prepared yet.
+        """
+
         track_index = 0
 
-        for i, track in enumerate(tracks):
+        for track in tracks:
             # Define a search marker.
             search_marker = '<a href="/track/'
 
@@ -195,11 +238,7 @@ class Album:
             position += len(search_marker)
 
             # Find the track's name.
-            track_name = ""
-
-            while track[position] != '"':
-                track_name += track[position]
-                position += 1
+            track_name = track[position:track.find('"', position)]
 
             if track_name == "":
                 continue
@@ -207,42 +246,37 @@ class Album:
             track_index += 1
 
             # Create a new track instance with the given URL.
-            track = Track(
+            yield Track(
                 "{}/track/{}".format(self.base_url, track_name),
                 self.output,
                 album=self.title,
                 album_artist=self.artist,
                 index=track_index,
+                cover_url=(self.art_url if self.art_enabled else None),
                 verbose=self.verbose,
                 silent=self.silent,
                 short=self.short,
                 sleep=self.sleep,
-                id3_enabled=self.id3_enabled
+                id3_enabled=self.id3_enabled,
+                parser=self.parser
             )
 
-            # Retrieve track data and store it in the instance.
-            if track.prepare():
-                if self.verbose:
-                    safe_print("{}. {}".format(track_index, track.url))
-
-                # Insert the acquired data into the queue.
-                self.queue.insert(track_index, track)
-
-            else:
-                if self.verbose:
-                    safe_print(strike("{}. {}".format(i, track.url)))
-
-                if self.abort_missing:
-                    if self.verbose:
-                        safe_print("Abort missing: A track fetch failed - skipping album download.")
+    def fetch(self):
+        """
+        Gathers required information for the tracks in this album and prepares
+        them to be used by the download method. Requests are made to each of the
+        tracks' Bandcamp pages. Requires the prepare method to be run beforehand.
 
-                    return False
+        Returns:
+            True if all fetches were successful. False if missing flag was set
+            and a track was unable to be fetched.
+        """
 
-        # If everything fetched: Create a new album folder if it doesn't already exist.
-        if not os.path.exists(self.output):
-            os.makedirs(self.output)
+        # Insert the acquired data into the queue.
+        for track in self.iter_tracks():
+            self.queue.append(track)
 
-        return True
+        return not self.aborted
 
     def download(self):
         """
@@ -253,12 +287,22 @@ class Album:
         if self.verbose:
             safe_print('\nWriting album to {}'.format(self.output))
 
+        # Share one sink between all tracks so the folder is only listed once.
+        sink = FileSink()
+
+        # Create a new album folder if it doesn't already exist.
+        sink.makedirs(self.output)
+
         for i in range(0, len(self.queue)):
+            if not self.queue[i].sink:
+                self.queue[i].sink = sink
+
             self.queue[i].download()
 
         if self.art_enabled:
-            s = download_file(self.art_url, self.output,
-                              "cover" + self.art_url[-4:])
+            with phase("art", url=self.art_url, album=self.title, track="cover"):
+                s = download_file(self.art_url, self.output,
+                                  "cover" + self.art_url[-4:], sink=sink)
 
             if self.verbose:
                 if s == 1:
@@ -0,0 +1,438 @@
+
+from .helpers import *
+from .track import Track
+from .album import Album
+from .discography import Discography
+from .sinks import FileSink
+from .deadline import Deadline
+from .profiling import phase
+
+
+def resolve(url, request=None, silent=False):
+    """
+    Requests a Bandcamp URL and identifies the type of page it points to.
+
+    Args:
+        url (str): Bandcamp URL to analyse.
+        request (request): if supplied this request's content will be
+            analysed instead of making a new request to the URL.
+        silent (bool): sets if error messages should be hidden.
+
+    Returns:
+        Tuple of the page type as returned by page_type and the request. The
+        page type is None if the URL could not be accessed.
+    """
+
+    if not valid_url(url):
+        if not silent:
+            print("The supplied URL is not a valid URL.")
+
+        return None, None
+
+    if not request:
+        # Get the content from the supplied Bandcamp URL.
+        request = safe_get(url)
+
+    if request.status_code != 200:
+        if not silent:
+            print("An error occurred while trying to access your supplied URL. Status code: {}".format(
+                request.status_code))
+
+        return None, request
+
+    return page_type(request.content.decode("utf-8")), request
+
+
+def release(item):
+    """
+    Drops the page content an item keeps after being prepared so that long
+    iterations only hold on to the information required for downloading.
+
+    Args:
+        item (Track, Album): prepared item to release the page content of.
+    """
+
+    item.request = None
+    item.content = None
+
+
+def iter_album(album):
+    """
+    Yields the prepared tracks of an album as each of their pages is parsed.
+    If the album aborts on missing tracks its tracks are only yielded once the
+    entire album has been resolved.
+
+    Args:
+        album (Album): album instance which has not been prepared yet.
+
+    Yields:
+        Prepared track instances.
+    """
+
+    if not album.prepare():
+        return
+
+    if album.abort_missing:
+        tracks = list(album.iter_tracks())
+
+        if album.aborted:
+            return
+
+    else:
+        tracks = album.iter_tracks()
+
+    for track in tracks:
+        release(track)
+
+        yield track
+
+    release(album)
+
+
+def pop_tracks(queue):
+    """
+    Removes the tracks from the front of a queue one at a time.
+
+    Args:
+        queue (list): queue of items to take tracks from.
+
+    Yields:
+        Track instances in queue order.
+    """
+
+    while queue and type(queue[0]) is Track:
+        yield queue.pop(0)
+
+
+def iter_tracks(url, output=None, request=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, parser=None):
+    """
+    Resolves a Bandcamp track, album or discography URL and lazily yields each
+    of the tracks it contains as soon as the track's page has been parsed. Only
+    the pages required for the next track are requested which keeps memory use
+    constant even for very large discographies.
+
+    Args:
+        url (str): Bandcamp URL to analyse and resolve.
+        output (str): absolute folder path the tracks should be written to.
+            Defaults to the current working directory.
+        request (request): if supplied this request's content will be
+            analysed instead of making a new request to the URL.
+        verbose (bool): sets if status messages and general information
+            should be printed.
+        silent (bool): sets if error messages should be hidden.
+        short (bool): omits arist and album fields from track filenames.
+        sleep (number): timeout duration between failed requests in seconds.
+        art_enabled (bool): if True artwork is planned alongside the tracks.
+        id3_enabled (bool): if True tracks will receive new ID3 tags.
+        abort_missing (bool): skips albums which are missing tracks.
+        parser (Parser): parser used for all pages. Defaults to parsing in
+            the current process.
+
+    Yields:
+        Prepared track instances which can be passed on to download.
+    """
+
+    if output is None:
+        output = os.path.join(os.getcwd(), "")
+
+    pagetype, request = resolve(url, request=request, silent=silent)
+
+    if not pagetype:
+        return
+
+    options = {
+        "verbose": verbose,
+        "silent": silent,
+        "short": short,
+        "sleep": sleep,
+        "art_enabled": art_enabled,
+        "id3_enabled": id3_enabled,
+        "parser": parser
+    }
+
+    if pagetype == "track":
+        track = Track(url, output, request=request, **options)
+
+        if track.prepare():
+            release(track)
+
+            yield track
+
+        elif verbose:
+            print("\nThe track you are trying to download is not publicly available. Consider purchasing it if you want it.")
+
+    elif pagetype == "album":
+        album = Album(url, output, request=request, abort_missing=abort_missing, **options)
+
+        for track in iter_album(album):
+            yield track
+
+    elif pagetype == "discography":
+        page = Discography(url, output, request=request, abort_missing=abort_missing, **options)
+
+        if not page.prepare():
+            return
+
+        release(page)
+
+        # Single tracks are collected until all releases have been listed.
+        tracks = []
+
+        # Resolve albums one at a time as soon as their page of the
+        # discography arrived and drop them once consumed.
+        for item in page.releases():
+            if type(item) is Album:
+                for track in iter_album(item):
+                    yield track
+
+            else:
+                tracks.append(item)
+
+        # Single tracks are prepared while the following pages are requested.
+        for track, ready in page.parser.prepare(pop_tracks(tracks)):
+            if ready:
+                release(track)
+
+                yield track
+
+    elif not silent:
+        print("Invalid page type. Exiting.")
+
+
+def iter_plan(stream, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, parser=None):
+    """
+    Reads a plan or checkpoint written as JSON lines. Track records are passed
+    on as they are. Source records name a URL whose tracks had not all been
+    resolved yet and are resolved again, with finished files being skipped.
+
+    Args:
+        stream (file): text stream to read the JSON lines from.
+        verbose (bool): sets if status messages should be printed.
+        silent (bool): sets if error messages should be hidden.
+        short (bool): omits arist and album fields from track filenames.
+        sleep (number): timeout duration between failed requests in seconds.
+        art_enabled (bool): if True artwork of resolved sources is included.
+        id3_enabled (bool): if True tracks will receive new ID3 tags.
+        abort_missing (bool): skips albums which are missing tracks.
+        parser (Parser): parser used for the pages of sources.
+
+    Yields:
+        Track records and prepared track instances which can be passed on to
+        download.
+    """
+
+    import json
+
+    for line in stream:
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+
+        if "source" not in record:
+            yield record
+            continue
+
+        for track in iter_tracks(
+            record["source"],
+            record.get("output"),
+            verbose=verbose,
+            silent=silent,
+            short=short,
+            sleep=sleep,
+            art_enabled=art_enabled,
+            id3_enabled=id3_enabled,
+            abort_missing=abort_missing,
+            parser=parser
+        ):
+            yield track
+
+
+def download_cover(track, deadline=None):
+    """
+    Downloads the album cover a track shares with its album into the track's
+    folder.
+
+    Args:
+        track (Track): track whose cover_url and output are used.
+        deadline (Deadline): optional deadline the cover has to be downloaded
+            by.
+
+    Returns:
+        The download_file status of the cover.
+    """
+
+    # Covers may be downloaded before any track of the album.
+    track.sink.makedirs(track.output)
+
+    with phase("art", url=track.cover_url, album=track.album, track="cover"):
+        s = download_file(track.cover_url, track.output,
+                          "cover" + track.cover_url[-4:], sink=track.sink, deadline=deadline)
+
+    if track.verbose:
+        if s == 1:
+            safe_print('\nSaved album art to {}{}{}'.format(
+                track.output, "cover", track.cover_url[-4:]))
+
+        elif s == 2:
+            print('\nArtwork already found.')
+
+        else:
+            print('\nFailed to download the artwork. Error code {}'.format(s))
+
+    return s
+
+
+def tally(summary, status, item, track, unfinished):
+    """
+    Counts the outcome of a track download in a download summary.
+
+    Args:
+        summary (dict): summary as returned by download.
+        status (number): download_file status of the track.
+        item (Deadline): deadline the track was downloaded with.
+        track (Track): the downloaded track.
+        unfinished (function): called with the track if it was cut short by
+            its deadline.
+    """
+
+    if status == 1:
+        summary["downloaded"] += 1
+
+    elif status == 2:
+        summary["skipped"] += 1
+
+    elif item.expired():
+        unfinished(track)
+
+    else:
+        summary["failed"] += 1
+
+
+def download(tracks, verbose=False, silent=False, sleep=30, id3_enabled=True, sink=None, segments=None, segment_threshold=None, deadline=None, item_deadline=None, checkpoint=None, store=None, jobs=1, summary=None):
+    """
+    Downloads every track of an iterable. Tracks are consumed one at a time so
+    generators such as iter_tracks can be filtered or sharded freely. Album
+    covers are downloaded once for each album folder.
+
+    With more than one job tracks are downloaded concurrently by a Scheduler,
+    which reads them in bounded windows and starts the largest files of each
+    window first.
+
+    Once the run deadline is reached no further tracks are taken from the
+    iterable. Tracks cut short by a deadline are written to the checkpoint as
+    track records so they can be downloaded later on.
+
+    Args:
+        tracks (iterable): prepared Track instances or track records as
+            returned by Track.record.
+        verbose (bool): sets if status messages should be printed. Only used
+            for records since tracks carry their own settings.
+        silent (bool): sets if error messages should be hidden. Only used for
+            records since tracks carry their own settings.
+        sleep (number): timeout duration between failed requests in seconds.
+            Only used for records.
+        id3_enabled (bool): if True tracks restored from records will receive
+            new ID3 tags.
+        sink (FileSink, StreamSink): output sink to write all tracks to.
+            Defaults to each track's own sink.
+        segments (number): amount of byte ranges large files are fetched in
+            parallel with. Defaults to each track's own setting.
+        segment_threshold (number): size in bytes from which files are
+            fetched in segments. Defaults to each track's own setting.
+        deadline (Deadline): deadline of the entire run.
+        item_deadline (number): seconds each track may take at most.
+        checkpoint (file): optional text stream the records of unfinished
+            tracks are written to as JSON lines.
+        store (ObjectStore): content addressed store audio payloads are
+            shared through. Only used for tracks written as files.
+        jobs (number): amount of files downloaded at once. Streams are always
+            written one track at a time.
+        summary (dict): optional dictionary to count the results in. Can be
+            read from another thread to follow the progress of the run.
+
+    Returns:
+        Dictionary counting downloaded, skipped and failed tracks as well as
+        the tracks left unfinished by a deadline. "expired" is True if the run
+        deadline stopped the run early. Concurrent runs add the achieved
+        "utilization" of their download slots.
+    """
+
+    import json
+
+    if summary is None:
+        summary = {}
+
+    summary.update({"downloaded": 0, "skipped": 0, "failed": 0, "unfinished": 0, "expired": False})
+
+    if deadline is None:
+        deadline = Deadline()
+
+    def unfinished(track):
+        summary["unfinished"] += 1
+
+        if checkpoint is not None:
+            checkpoint.write(json.dumps(track.record()) + "\n")
+            checkpoint.flush()
+
+    # Sink shared by tracks without one so folders are only listed once.
+    shared = sink or FileSink()
+
+    def prepared():
+        for track in tracks:
+            if isinstance(track, dict):
+                track = Track.from_record(
+                    track,
+                    verbose=verbose,
+                    silent=silent,
+                    sleep=sleep,
+                    id3_enabled=id3_enabled
+                )
+
+            if sink or not track.sink:
+                track.sink = shared
+
+            if segments is not None:
+                track.segments = segments
+
+            if segment_threshold is not None:
+                track.segment_threshold = segment_threshold
+
+            if store is not None:
+                track.store = store
+
+            yield track
+
+    if jobs > 1 and shared.files:
+        from .scheduler import Scheduler
+
+        Scheduler(jobs, verbose=verbose).run(prepared(), summary, unfinished, deadline, item_deadline)
+
+        return summary
+
+    # Album folders whose cover has already been handled.
+    covers = set()
+
+    for track in prepared():
+        # Leave the remaining tracks unresolved once the run is out of time.
+        if deadline.expired():
+            summary["expired"] = True
+            unfinished(track)
+            break
+
+        item = Deadline(item_deadline, parent=deadline)
+
+        status = track.download(deadline=item)
+
+        tally(summary, status, item, track, unfinished)
+
+        # Covers can only be placed next to tracks written as files.
+        if not track.sink.files:
+            continue
+
+        if track.cover_url and track.output not in covers:
+            covers.add(track.output)
+
+            download_cover(track, deadline)
+
+    return summary
@@ -0,0 +1,143 @@
+
+import re
+import time
+
+
+def parse_duration(value):
+    """
+    Parses a duration such as "90", "45s", "30m", "2h" or "1h30m".
+
+    Args:
+        value (str): duration string. Plain numbers are seconds.
+
+    Returns:
+        Duration in seconds as a float.
+
+    Raises:
+        ValueError: if the string is not a valid duration.
+    """
+
+    value = str(value).strip().lower()
+
+    try:
+        return float(value)
+
+    except ValueError:
+        pass
+
+    units = {"h": 3600, "m": 60, "s": 1}
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)\s*([hms])", value)
+
+    # Every character of the string has to belong to a number and unit pair.
+    if not parts or re.sub(r"(\d+(?:\.\d+)?)\s*([hms])", "", value).strip():
+        raise ValueError("Invalid duration: {}".format(value))
+
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class Deadline:
+    """
+    Time budget for a run or a single item. Deadlines without a duration
+    never expire so they can be passed around unconditionally.
+
+    Args:
+        seconds (number): length of the budget in seconds. None for no limit.
+        parent (Deadline): optional enclosing deadline. This deadline never
+            lasts longer than its parent and is cancelled along with it.
+    """
+
+    def __init__(self, seconds=None, parent=None):
+        self.expires = None
+        self.parent = parent
+
+        # Set once the deadline was cancelled before its time.
+        self.cancelled = False
+
+        if seconds is not None:
+            self.expires = time.monotonic() + seconds
+
+        if parent is not None and parent.expires is not None:
+            if self.expires is None or parent.expires < self.expires:
+                self.expires = parent.expires
+
+    def cancel(self):
+        """
+        Expires the deadline right away along with every deadline derived
+        from it. Work bound by the deadline stops as if it ran out of time.
+        """
+
+        self.cancelled = True
+
+    def is_cancelled(self):
+        """
+        Checks if this deadline or one of its parents was cancelled.
+        """
+
+        deadline = self
+
+        while deadline is not None:
+            if deadline.cancelled:
+                return True
+
+            deadline = deadline.parent
+
+        return False
+
+    def remaining(self):
+        """
+        Returns the seconds left in the budget. None if it never expires.
+        """
+
+        if self.is_cancelled():
+            return 0.0
+
+        if self.expires is None:
+            return None
+
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self, margin=0):
+        """
+        Checks if the budget has been used up.
+
+        Args:
+            margin (number): seconds which have to be left for the budget to
+                count as not expired. Used before waiting between retries.
+
+        Returns:
+            True if less than the margin is left of the budget.
+        """
+
+        if self.is_cancelled():
+            return True
+
+        return self.expires is not None and time.monotonic() + margin >= self.expires
+
+    def timeout(self, timeout):
+        """
+        Shortens a request timeout so the request can't outlast the deadline.
+
+        Args:
+            timeout (number, tuple): timeout in seconds or a tuple of the
+                connect and read timeout. None uses the remaining time.
+
+        Returns:
+            Timeout of the same form limited to the remaining time.
+        """
+
+        remaining = self.remaining()
+
+        if remaining is None:
+            return timeout
+
+        # Never pass a zero timeout as it would disable the timeout entirely.
+        remaining = max(remaining, 0.001)
+
+        if timeout is None:
+            return remaining
+
+        if isinstance(timeout, tuple):
+            return tuple(min(part, remaining) for part in timeout)
+
+        return min(timeout, remaining)
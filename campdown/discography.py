@@ -4,6 +4,7 @@ import html
 from .helpers import *
 from .track import Track
 from .album import Album
+from .parsing import parse_discography, parse_pagination, inline
 
 
 class Discography:
@@ -26,9 +27,14 @@ class Discography:
         art_enabled (bool): if True the Bandcamp page's artwork will be
             downloaded and saved alongside each of the found albums/tracks.
         id3_enabled (bool): if True tracks downloaded will receive new ID3 tags.
+        abort_missing (bool): sets if a missing track aborts its album.
+        parser (Parser): parser used for the pages of the discography.
+            Defaults to parsing in the current process.
+        page_workers (number): amount of continuation pages of a paginated
+            discography which are requested at once.
     """
 
-    def __init__(self, url, output, request=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False):
+    def __init__(self, url, output, request=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, parser=None, page_workers=4):
         # Requests and other information can optionally be filled to remove unneccessary
         # operations such as making a request to a URL that has already been fetched
         # by another component.
@@ -42,6 +48,14 @@ class Discography:
         # Queue array to store album tracks in.
         self.queue = []
 
+        # URLs of the releases found so far. Used to drop duplicates listed
+        # on several pages.
+        self.seen = set()
+
+        # Continuation pages of the discography by page number.
+        self.pages = {}
+        self.page_workers = page_workers
+
         # Store the album request object for later reference.
         self.request = request
         self.content = None
@@ -70,6 +84,9 @@ class Discography:
         # Sets if a missing album track aborts the entire album download.
         self.abort_missing = abort_missing
 
+        # Parser used to parse the pages.
+        self.parser = parser or inline
+
     def prepare(self):
         """
         Prepares the discography class by gathering information about albums and
@@ -105,93 +122,64 @@ class Discography:
         self.base_url = "{}//{}".format(str(self.url).split("/")[
             0], str(self.url).split("/")[2])
 
-        print(self.base_url)
-
         meta = html.unescape(string_between(self.content, '<meta name="Description" content="', ">")).strip()
         self.artist = meta.split(".\n", 1)[0]
 
         if self.artist:
             self.output = os.path.join(self.output, self.artist, "")
 
-            # Create a new artist folder if it doesn't already exist.
-            if not os.path.exists(self.output):
-                os.makedirs(self.output)
-
-            safe_print(
-                '\nSet "{}" as the working directory.'.format(self.output))
+            if self.verbose:
+                safe_print(
+                    '\nSet "{}" as the working directory.'.format(self.output))
 
         # Make the artist name safe for file writing.
         self.artist = safe_filename(self.artist)
 
-        # Define search markers to find the index of for track URLs.
-        track_search_markers = [
-            '<a href="/track/',
-            '<a href="{}/track/'.format(self.base_url),
-            '<a href="https://\w+.bandcamp.com/track/'
-        ]
-
-        # Run a search through our track markers and handle regex options and duplicates.
-        track_filtered_markers = []
-        for marker in track_search_markers:
-            results = re.findall(marker, self.content)
-
-            for result in results:
-                if result not in track_filtered_markers:
-                    track_filtered_markers.append(result)
-
-        # Create a list of indices for track links.
-        tracks = []
-        for marker in track_filtered_markers:
-            tracks.extend(find_string_indices(self.content, marker))
-
-        # Define search markers to find the index of for album URLs.
-        album_search_markers = [
-            '<a href="/album/',
-            '<a href="{}/album/'.format(self.base_url),
-            '<a href="https://\w+.bandcamp.com/album/'
-        ]
-
-        # Run a search through our album markers and handle regex options and duplicates.
-        album_filtered_markers = []
-        for marker in album_search_markers:
-            results = re.findall(marker, self.content)
-
-            for result in results:
-                if result not in album_filtered_markers:
-                    album_filtered_markers.append(result)
-
-        # Create a list of indices for album links.
-        albums = []
-        for marker in album_filtered_markers:
-            albums.extend(find_string_indices(self.content, marker))
+        # Find the album and track links of the page.
+        albums, tracks = self.parser.run(parse_discography, self.content, self.base_url)
+
+        # Continuation pages are only requested once the releases are iterated.
+        self.pages = parse_pagination(self.content, self.url)
 
         if self.verbose:
             print('\nListing found discography content')
 
-        for i, position in enumerate(albums):
-            album_url = ""
+        self.queue.extend(self.items(albums, tracks))
 
-            # Begin iteration over characters until the string begins.
-            while self.content[position] != '"':
-                position += 1
+        if self.verbose:
+            if self.pages:
+                print("\nFound {} further pages of the discography.".format(len(self.pages)))
+
+            print("\nBeginning downloads. Albums additionally require fetching tracks.")
 
-            # Begin iteration over characters until the string closes.
-            while self.content[position + 1] != '"' and self.content[position + 1] != '?':
-                album_url += self.content[position + 1]
-                position += 1
+        return True
+
+    def items(self, albums, tracks):
+        """
+        Creates album and track instances for newly found release URLs.
 
-            if album_url == "":
+        Args:
+            albums (list): album URLs in page order.
+            tracks (list): track URLs in page order.
+
+        Returns:
+            List of the new Album and Track instances. Albums come first.
+        """
+
+        items = []
+
+        for album_url in albums:
+            if album_url in self.seen:
                 continue
 
-            if "http://" not in album_url and "https://" not in album_url:
-                album_url = self.base_url + album_url
+            self.seen.add(album_url)
 
             # Print the prepared track.
             if self.verbose:
                 safe_print(album_url)
 
             # Create a new track instance with the given URL.
-            album = Album(
+            items.append(Album(
                 album_url,
                 self.output,
                 verbose=self.verbose,
@@ -200,48 +188,101 @@ class Discography:
                 sleep=self.sleep,
                 art_enabled=self.art_enabled,
                 id3_enabled=self.id3_enabled,
-                abort_missing=self.abort_missing
-            )
-
-            self.queue.insert(len(self.queue), album)
-
-        for i, position in enumerate(tracks):
-            track_url = ""
+                abort_missing=self.abort_missing,
+                parser=self.parser
+            ))
 
-            # Begin iteration over characters until the string begins.
-            while self.content[position] != '"':
-                position += 1
-
-            # Begin iteration over characters until the string closes.
-            while self.content[position + 1] != '"' and self.content[position + 1] != '?':
-                track_url += self.content[position + 1]
-                position += 1
-
-            if track_url == "":
+        for track_url in tracks:
+            if track_url in self.seen:
                 continue
 
-            if not "http://" in track_url and not "https://" in track_url:
-                track_url = self.base_url + track_url
+            self.seen.add(track_url)
 
             # Print the prepared track.
             if self.verbose:
                 safe_print(track_url)
 
             # Create a new track instance with the given URL.
-            track = Track(
+            items.append(Track(
                 track_url,
                 self.output,
                 verbose=self.verbose,
+                silent=self.silent,
+                short=self.short,
+                sleep=self.sleep,
                 art_enabled=self.art_enabled,
-                id3_enabled=self.id3_enabled
-            )
+                id3_enabled=self.id3_enabled,
+                parser=self.parser
+            ))
 
-            self.queue.insert(len(self.queue), track)
+        return items
 
-        if self.verbose:
-            print("\nBeginning downloads. Albums additionally require fetching tracks.")
+    def continued(self):
+        """
+        Requests the continuation pages of a paginated discography several at
+        a time. Pages linked from continuation pages are requested as well.
+        Requires the prepare method to have been run beforehand.
 
-        return True
+        Yields:
+            Album and Track instances of each page in page order as soon as
+            the page and all pages before it have arrived.
+        """
+
+        if not self.pages:
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.page_workers, thread_name_prefix="page") as pool:
+            futures = {}
+            scheduled = set()
+
+            def schedule(pages):
+                for number, url in sorted(pages.items()):
+                    if number not in scheduled:
+                        scheduled.add(number)
+                        self.pages[number] = url
+                        futures[number] = pool.submit(safe_get, url)
+
+            schedule(dict(self.pages))
+
+            while futures:
+                # Handle pages in order while later pages are still arriving.
+                number = min(futures)
+                request = futures.pop(number).result()
+
+                if request.status_code != 200:
+                    if not self.silent:
+                        print("An error occurred while trying to access page {} of the discography. Status code: {}".format(
+                            number, request.status_code))
+
+                    continue
+
+                content = request.content.decode("utf-8")
+
+                # Pagination may only link a few pages around the current one.
+                schedule(parse_pagination(content, self.url))
+
+                albums, tracks = self.parser.run(parse_discography, content, self.base_url)
+
+                for item in self.items(albums, tracks):
+                    yield item
+
+    def releases(self):
+        """
+        Removes the releases of the discography from the queue one at a time
+        and continues with the releases of any continuation pages. Requires
+        the prepare method to have been run beforehand.
+
+        Yields:
+            Album and Track instances in page order.
+        """
+
+        while self.queue:
+            yield self.queue.pop(0)
+
+        for item in self.continued():
+            yield item
 
     def fetch(self):
         """
@@ -251,6 +292,9 @@ class Discography:
         beforehand.
         """
 
+        # Add the releases of any continuation pages to the queue first.
+        self.queue.extend(self.continued())
+
         for i in range(0, len(self.queue)):
             if type(self.queue[i]) is Track:
                 # If we received a metadata return, delete the track data.
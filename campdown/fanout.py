@@ -0,0 +1,405 @@
+import io
+import json
+import os
+import sys
+import queue
+import threading
+
+from .deadline import Deadline
+
+# Summary counters which are added up over the worker processes.
+COUNTERS = ("downloaded", "skipped", "failed", "unfinished")
+
+
+def transport_settings(transport):
+    """
+    Describes a transport so that each worker process can open its own.
+
+    Args:
+        transport: transport of the main process. Hedging, recording and
+            adaptive transports are described by the transport they wrap.
+
+    Returns:
+        Tuple of the kind of transport and its arguments.
+    """
+
+    from .transport import HTTP2Transport
+    from .recording import ReplayTransport
+
+    while hasattr(transport, "transport"):
+        transport = transport.transport
+
+    if isinstance(transport, ReplayTransport):
+        return ("replay", transport.path, transport.scale, transport.timeout)
+
+    if isinstance(transport, HTTP2Transport):
+        return ("http2", transport.timeout)
+
+    return ("requests", transport.timeout)
+
+
+def find_transport(transport, kind):
+    """
+    Finds a transport of a kind in a chain of wrapping transports.
+
+    Args:
+        transport: outermost transport of the chain.
+        kind (type): class of the transport to find.
+
+    Returns:
+        The first transport of the kind or None if there is none.
+    """
+
+    while transport is not None:
+        if isinstance(transport, kind):
+            return transport
+
+        transport = getattr(transport, "transport", None)
+
+    return None
+
+
+def open_transport(settings):
+    """
+    Opens a transport described by transport_settings.
+
+    Args:
+        settings (tuple): description of the transport.
+
+    Returns:
+        The new transport.
+    """
+
+    from .transport import RequestsTransport, HTTP2Transport
+    from .recording import ReplayTransport
+
+    if settings[0] == "replay":
+        return ReplayTransport(settings[1], scale=settings[2], timeout=settings[3])
+
+    if settings[0] == "http2":
+        return HTTP2Transport(timeout=settings[1])
+
+    return RequestsTransport(timeout=settings[1])
+
+
+def worker(index, inbox, outbox, settings):
+    """
+    Downloads the track records sent to a worker process until None is
+    received. The progress of the worker is sent back to the main process
+    while it changes.
+
+    Args:
+        index (number): index of the worker.
+        inbox (Queue): queue the worker receives track records from.
+        outbox (Queue): queue progress and results are sent to.
+        settings (dict): download settings of the run.
+    """
+
+    from .api import download
+    from .sinks import FileSink
+    from .store import ObjectStore
+    from .transport import get_transport, set_transport, AdaptiveTransport
+
+    set_transport(open_transport(settings["transport"]))
+
+    # Each worker adapts the transfers of its own download slots.
+    adaptive = None
+
+    if settings["adaptive"]:
+        adaptive = AdaptiveTransport(get_transport(), settings["jobs"])
+        set_transport(adaptive)
+
+    store = ObjectStore(settings["store"]) if settings["store"] else None
+
+    summary = {}
+    checkpoint = io.StringIO()
+    finished = threading.Event()
+
+    def report():
+        # Sends the progress of the worker each time it changed.
+        last = None
+
+        while not finished.wait(settings["interval"]):
+            current = dict(summary)
+
+            if current and current != last:
+                outbox.put(("progress", index, current))
+                last = current
+
+    reporter = threading.Thread(target=report, name="progress", daemon=True)
+    reporter.start()
+
+    # Set once None was received.
+    received = threading.Event()
+
+    def records():
+        for record in iter(inbox.get, None):
+            yield record
+
+        received.set()
+
+    try:
+        download(
+            records(),
+            verbose=False,
+            silent=settings["silent"],
+            sleep=settings["sleep"],
+            id3_enabled=settings["id3_enabled"],
+            sink=FileSink(settings["buffer_size"], settings["background"]),
+            segments=settings["segments"],
+            segment_threshold=settings["segment_threshold"],
+            deadline=Deadline(settings["deadline"]),
+            item_deadline=settings["item_deadline"],
+            checkpoint=checkpoint,
+            store=store,
+            jobs=settings["jobs"],
+            summary=summary
+        )
+
+        # Records which were queued when the deadline was reached are left
+        # for the checkpoint.
+        if summary["expired"] and not received.is_set():
+            for record in iter(inbox.get, None):
+                summary["unfinished"] += 1
+                checkpoint.write(json.dumps(record) + "\n")
+
+    except (KeyboardInterrupt):
+        # The main process was interrupted as well and reports what is done.
+        pass
+
+    finally:
+        finished.set()
+        reporter.join()
+
+        get_transport().close()
+
+    outbox.put(("done", index, summary, checkpoint.getvalue(),
+                (store.stored, store.reused, store.copied) if store else (0, 0, 0),
+                adaptive.stats() if adaptive else None))
+
+
+class FanOut:
+    """
+    Downloads tracks in several worker processes. Each worker has its own
+    connection pool and downloads its share of the tracks with the download
+    function, so pages, progress and tagging no longer share a single core.
+
+    Tracks are resolved in the main process and handed out to the worker with
+    the least outstanding tracks. A path is always given to the same worker
+    and only one worker downloads the cover of each album folder, so no two
+    workers ever write the same file.
+
+    Args:
+        processes (number): amount of worker processes.
+        verbose (bool): sets if the combined progress should be printed.
+        interval (number): seconds between progress reports of the workers.
+    """
+
+    def __init__(self, processes, verbose=False, interval=1.0):
+        self.processes = processes
+        self.verbose = verbose
+        self.interval = interval
+
+        # Worker index by normalized track path and by album folder of covers.
+        self.owners = {}
+        self.covers = {}
+
+        # Amount of tracks sent to each worker and their latest progress.
+        self.assigned = [0] * processes
+        self.progress = [{} for i in range(processes)]
+
+        # Results of the workers which are done.
+        self.results = {}
+
+        # Guards the progress between the main thread and the collector.
+        self.lock = threading.Lock()
+
+    def handled(self, index):
+        # Amount of tracks a worker has reported as handled.
+        return sum(self.progress[index].get(counter, 0) for counter in COUNTERS)
+
+    def assign(self, record):
+        """
+        Picks the worker a track record is downloaded by.
+
+        Args:
+            record (dict): track record to assign.
+
+        Returns:
+            Tuple of the worker index and the record to send it. Covers of
+            folders owned by another worker are removed from the record.
+        """
+
+        path = os.path.normcase(os.path.abspath(record["path"]))
+
+        index = self.owners.get(path)
+
+        if index is None:
+            with self.lock:
+                index = min(range(self.processes), key=lambda i: self.assigned[i] - self.handled(i))
+
+            self.owners[path] = index
+
+        if record.get("cover"):
+            folder = os.path.dirname(path)
+            owner = self.covers.setdefault(folder, index)
+
+            if owner != index:
+                record = dict(record, art_url=None, art_path=None, cover=False)
+
+        self.assigned[index] += 1
+
+        return index, record
+
+    def collect(self, outbox, workers):
+        """
+        Gathers the progress and results of the workers until all of them are
+        done or have exited.
+
+        Args:
+            outbox (Queue): queue the workers report to.
+            workers (list): processes of the workers.
+        """
+
+        pending = set(range(len(workers)))
+        shown = None
+
+        while pending:
+            try:
+                message = outbox.get(timeout=self.interval)
+
+            except queue.Empty:
+                # Workers which crashed never report their results.
+                for index in list(pending):
+                    if workers[index].exitcode not in (None, 0):
+                        pending.discard(index)
+
+                        print("\nWorker process {} exited unexpectedly.".format(index + 1), file=sys.stderr)
+
+                continue
+
+            with self.lock:
+                self.progress[message[1]] = message[2]
+
+                if message[0] == "done":
+                    self.results[message[1]] = message[2:]
+                    pending.discard(message[1])
+
+                totals = [sum(progress.get(counter, 0) for progress in self.progress) for counter in COUNTERS[:3]]
+
+            if self.verbose and totals != shown:
+                shown = totals
+
+                print("Progress: {} downloaded, {} skipped and {} failed of {} tracks in {} processes.".format(
+                    totals[0], totals[1], totals[2], sum(self.assigned), self.processes))
+
+    def run(self, tracks, settings, deadline=None, checkpoint=None):
+        """
+        Downloads the tracks in the worker processes.
+
+        Args:
+            tracks (iterable): prepared tracks or track records.
+            settings (dict): download settings passed on to the workers.
+            deadline (Deadline): deadline of the run.
+            checkpoint (file): optional text stream the records of unfinished
+                tracks are written to as JSON lines.
+
+        Returns:
+            Dictionary counting the results like download. Also holds the
+            amount of payloads "stored" in, "reused" from and "copied" out
+            of the store and
+            the "adaptive" concurrency stats of each worker which reported
+            them.
+        """
+
+        import multiprocessing
+
+        if deadline is None:
+            deadline = Deadline()
+
+        summary = {"downloaded": 0, "skipped": 0, "failed": 0, "unfinished": 0, "expired": False,
+                   "stored": 0, "reused": 0, "copied": 0, "adaptive": []}
+
+        # Spawned workers don't inherit the threads and connections of the
+        # main process.
+        context = multiprocessing.get_context("spawn")
+
+        outbox = context.Queue()
+        inboxes = [context.Queue() for i in range(self.processes)]
+
+        workers = [
+            context.Process(
+                target=worker,
+                args=(index, inboxes[index], outbox, dict(settings, deadline=deadline.remaining(),
+                                                          interval=self.interval)),
+                name="worker {}".format(index + 1),
+                daemon=True
+            )
+            for index in range(self.processes)
+        ]
+
+        for process in workers:
+            process.start()
+
+        collector = threading.Thread(target=self.collect, args=(outbox, workers), name="collector")
+        collector.start()
+
+        try:
+            for track in tracks:
+                record = track if isinstance(track, dict) else track.record()
+
+                # Leave the remaining tracks unresolved once the run is out of time.
+                if deadline.expired():
+                    summary["expired"] = True
+                    summary["unfinished"] += 1
+
+                    if checkpoint is not None:
+                        checkpoint.write(json.dumps(record) + "\n")
+
+                    break
+
+                index, record = self.assign(record)
+                inboxes[index].put(record)
+
+        except (KeyboardInterrupt):
+            for process in workers:
+                process.terminate()
+
+            raise
+
+        finally:
+            for inbox in inboxes:
+                inbox.put(None)
+
+            collector.join()
+
+            for process in workers:
+                process.join()
+
+        for index in range(self.processes):
+            if index not in self.results:
+                # Tracks of a crashed worker which weren't reported count as failed.
+                summary["failed"] += self.assigned[index] - self.handled(index)
+
+                for counter in COUNTERS:
+                    summary[counter] += self.progress[index].get(counter, 0)
+
+                continue
+
+            result, lines, (stored, reused, copied), adaptive = self.results[index]
+
+            for counter in COUNTERS:
+                summary[counter] += result[counter]
+
+            summary["expired"] = summary["expired"] or result["expired"]
+            summary["stored"] += stored
+            summary["reused"] += reused
+            summary["copied"] += copied
+
+            if adaptive:
+                summary["adaptive"].append((index, adaptive))
+
+            if checkpoint is not None:
+                checkpoint.write(lines)
+
+        return summary
@@ -5,7 +5,7 @@ import re
 import platform
 import time
 
-import requests
+from .profiling import phase, span
 
 
 def strike(string):
@@ -23,22 +23,89 @@ def strike(string):
         return "X " + string
 
 
-def safe_get(url):
-    headers = requests.utils.default_headers()
+def safe_get(url, deadline=None):
+    """
+    Request a page through the current transport. The request is bound by the
+    transport's connect and read timeouts so a stalled server can't block the
+    caller forever.
+
+    Args:
+        url (str): URL of the page to request.
+        deadline (Deadline): optional deadline the request may not outlast.
+
+    Returns:
+        Response of the request. Failed connections return a response with
+        the status code 0.
+    """
+
+    from .transport import get_transport, FailedResponse
+
+    transport = get_transport()
+    timeout = None
 
-    headers.update = {
-        "User-Agent": "campdown/1.48 (+https://github.com/catlinman/campdown)",
-        "Accept-Encoding": ", ".join(("gzip", "deflate")),
-        "Accept": "*/*",
-        "Connection": "keep-alive",
-    }
+    if deadline is not None:
+        timeout = deadline.timeout(transport.timeout)
+
+    try:
+        # Make a request to the track URL.
+        with phase("fetch", url=url):
+            r = transport.get(url, timeout=timeout)
 
-    # Make a request to the track URL.
-    r = requests.get(url, headers=headers)
+    except transport.errors as e:
+        r = FailedResponse(url, e)
 
     return r
 
 
+def probe_size(url, timeout=None):
+    """
+    Looks up the size of a remote file with a HEAD request without
+    downloading it. Servers which don't answer HEAD requests with a length
+    are asked for the first byte of the file instead.
+
+    Args:
+        url (str): URL of the file.
+        timeout (number, tuple): connect and read timeout of the request.
+            Defaults to the transport timeout.
+
+    Returns:
+        Size of the file in bytes or None if it could not be determined.
+    """
+
+    from .transport import get_transport
+
+    transport = get_transport()
+
+    try:
+        response = transport.head(url, timeout=timeout)
+
+    except transport.errors:
+        return None
+
+    length = response.headers.get("content-length")
+
+    if response.status_code == 200 and length is not None:
+        return int(length)
+
+    if response.status_code in (404, 410):
+        return None
+
+    # The total size is given after the slash of the content range.
+    try:
+        response = transport.get(url, stream=True, timeout=timeout, headers={"Range": "bytes=0-0"})
+
+    except transport.errors:
+        return None
+
+    content_range = response.headers.get("content-range", "")
+    response.close()
+
+    if response.status_code != 206 or not content_range.split("/")[-1].isdigit():
+        return None
+
+    return int(content_range.split("/")[-1])
+
+
 def safe_print(string):
     """
     Print to the console while avoiding encoding errors
@@ -92,7 +159,7 @@ def string_between(string, start, end):
         new string between start and end.
     """
     try:
-        return str(string).split(str(start), 1)[1].split(str(end))[0]
+        return str(string).split(str(start), 1)[1].split(str(end), 1)[0]
 
     except IndexError:
         return ""
@@ -226,11 +293,16 @@ def find_string_indices(content, search):
     Returns:
         List containing all found indicies after the search string.
     """
-    return [  # Use list comprehension for syntactic diabetes.
-        # Add the length of the search to the index like before.
-        i for i in range(len(content))
-        if content.startswith(search, i)
-    ]
+    indices = []
+
+    # Let str.find jump between occurrences instead of testing every index.
+    i = content.find(search)
+
+    while i != -1:
+        indices.append(i)
+        i = content.find(search, i + 1)
+
+    return indices
 
 
 def calculate_confidence(inspected, expected, percentage):
@@ -262,7 +334,188 @@ def calculate_confidence(inspected, expected, percentage):
     return -(expected - (inspected + (expected * percentage)))
 
 
-def download_file(url, output, name, force=False, verbose=False, silent=False, sleep=30, timeout=3, max_retries=2):
+def print_progress(dl, remote_length):
+    """
+    Print a download progress bar that overwrites the current console line.
+
+    Args:
+        dl (number): amount of bytes downloaded so far.
+        remote_length (number): total amount of bytes to download.
+    """
+
+    # Calculate the the download completion percentage.
+    done = int(50 * dl / remote_length)
+
+    # Display a bar based on the current download progress.
+    sys.stdout.write(
+        "\r[{}{}{}] {}MB / {}MB ".format(
+            "=" * done,
+            ">",
+            " " * (50 - done),
+            (int(((dl) * 100) / pow(1024, 2)) / 100),
+            int((remote_length * 100) / pow(1024, 2)) / 100
+        )
+    )
+
+    # Flush the output buffer so we can overwrite the same line.
+    sys.stdout.flush()
+
+
+def retryable_status(status):
+    """
+    Checks if a request answered with a status is worth retrying.
+
+    Args:
+        status (number): HTTP status code of the answer.
+
+    Returns:
+        True for throttling (429) and server errors (5xx).
+    """
+
+    return status == 429 or status >= 500
+
+
+def download_segments(url, output, name, remote_length, sink, segments, verbose=False, silent=False, sleep=30, timeout=None, max_retries=2, chunk_size=65536, deadline=None):
+    """
+    Downloads a file as several byte ranges fetched in parallel. Each range is
+    written at its offset into a file preallocated by the sink. A failed range
+    is retried from the last byte it received without affecting the others.
+    Ranges answered with 429 or a server error are retried the same way.
+
+    Args:
+        url (str): URL to make the requests to.
+        output (str): absolute folder path to write to.
+        name (str): filename with extension to write the content to.
+        remote_length (number): total length of the file in bytes.
+        sink (FileSink): output sink supporting writes at offsets.
+        segments (number): amount of ranges to split the file into.
+        verbose (bool): prints status messages as well as download progress.
+        silent (bool): if error messages should be ignored and not printed.
+        sleep (number): Seconds to sleep between failed requests.
+        timeout (number, tuple): connect and read timeout of each request.
+            Defaults to the transport timeout.
+        max_retries (number): The amount of retries each range gets.
+        chunk_size (number): amount of bytes read from a response at once.
+        deadline (Deadline): deadline all ranges have to be completed by.
+
+    Returns:
+        1 if the download and write is successful
+        0 if a range could not be downloaded
+        None if the server does not honor ranged requests
+    """
+
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    from .transport import get_transport
+    from .deadline import Deadline
+
+    transport = get_transport()
+
+    if deadline is None:
+        deadline = Deadline()
+
+    # Split the file into ranges of equal size. The last one may be shorter.
+    size = -(-remote_length // segments)
+    ranges = [(start, min(start + size, remote_length) - 1) for start in range(0, remote_length, size)]
+
+    # Amount of bytes received by all ranges together.
+    progress = [0]
+    lock = threading.Lock()
+
+    # Set if the server answered a ranged request with the entire file.
+    unsupported = threading.Event()
+
+    def fetch(f, start, end):
+        offset = start
+        retries = 0
+
+        while offset <= end and not unsupported.is_set():
+            with span("range", url=url, file=name, start=offset, end=end):
+                try:
+                    response = transport.get(
+                        url,
+                        stream=True,
+                        timeout=deadline.timeout(timeout or transport.timeout),
+                        headers={"Range": "bytes={}-{}".format(offset, end)}
+                    )
+
+                    if response.status_code != 206:
+                        response.close()
+
+                        if response.status_code == 200:
+                            unsupported.set()
+
+                        # Throttled ranges and server errors are retried like
+                        # interrupted transfers.
+                        if not retryable_status(response.status_code):
+                            return False
+
+                    else:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            # Never write past the end of the range.
+                            chunk = chunk[:end + 1 - offset]
+
+                            f.write_at(chunk, offset)
+                            offset += len(chunk)
+
+                            with lock:
+                                progress[0] += len(chunk)
+
+                            if offset > end or deadline.expired():
+                                break
+
+                        response.close()
+
+                except transport.errors:
+                    pass
+
+            if offset <= end:
+                if retries >= max_retries or deadline.expired(sleep):
+                    return False
+
+                if not silent:
+                    print("\nRange {}-{} interrupted. Attempting {} of {} retries.".format(
+                        start, end, retries + 1, max_retries))
+
+                with span("sleep", file=name, seconds=sleep):
+                    time.sleep(sleep)
+
+                retries += 1
+
+        return offset > end
+
+    with sink.open(output, name, None, remote_length) as f:
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="range") as pool:
+            futures = [pool.submit(fetch, f, start, end) for start, end in ranges]
+
+            pending = futures
+
+            while pending:
+                pending = wait(pending, timeout=0.25)[1]
+
+                if verbose:
+                    print_progress(progress[0], remote_length)
+
+        success = all(future.result() for future in futures)
+
+    if verbose:
+        # Print a newline to skip the buffer flush.
+        print("")
+
+    if success:
+        return 1
+
+    # Remove the partial file as a ranged download can't be resumed by a stream.
+    sink.remove(output, name)
+
+    if unsupported.is_set():
+        return None
+
+    return 0
+
+
+def download_file(url, output, name, force=False, verbose=False, silent=False, sleep=30, timeout=None, max_retries=2, sink=None, header=None, chunk_size=65536, segments=1, segment_threshold=33554432, deadline=None):
     """
     Downloads and saves a file from the supplied URL and prints progress
     to the console. Can use ranged requests to make downloads from Bandcamp faster
@@ -277,8 +530,19 @@ def download_file(url, output, name, force=False, verbose=False, silent=False, s
         verbose (bool): prints status messages as well as download progress.
         silent (bool): if error messages should be ignored and not printed.
         sleep (number): Seconds to sleep between failed requests.
-        timeout (number): The maximum time before a request is timed out.
+        timeout (number, tuple): connect and read timeout of each request.
+            Defaults to the transport timeout.
         max_retries (number): The amount of request retries that should be attempted.
+        sink (FileSink, StreamSink): output sink to write to. Defaults to
+            writing a file to the output folder.
+        header (bytes): optional data the sink writes ahead of the content.
+        chunk_size (number): amount of bytes read from the response at once.
+        segments (number): amount of byte ranges to fetch large files in
+            parallel with. Only used if the server accepts ranged requests.
+        segment_threshold (number): size in bytes from which files are
+            fetched in segments.
+        deadline (Deadline): deadline the download has to be completed by.
+            Requests are cut short and no retries are made past it.
 
     Returns:
         0 if there was an error in this function
@@ -287,44 +551,91 @@ def download_file(url, output, name, force=False, verbose=False, silent=False, s
         r.status_code if a connection error occurred
     """
 
+    from .sinks import FileSink
+    from .transport import get_transport
+    from .deadline import Deadline
+
     if verbose:
         safe_print("\nDownloading: {}".format(name))
 
+    if not sink:
+        sink = FileSink()
+
+    # Make sure that the written filename is valid for the filesystem.
+    name = safe_filename(name)
+
     # Status variables.
     success = False
     retries = 0
 
-    headers = requests.utils.default_headers()
+    transport = get_transport()
+
+    if deadline is None:
+        deadline = Deadline()
 
-    headers.update = {
-        "User-Agent": "campdown/1.48 (+https://github.com/catlinman/campdown)",
-        "Accept-Encoding": ", ".join(("gzip", "deflate")),
-        "Accept": "*/*",
-        "Connection": "keep-alive",
-    }
+    # Requests never outlast the deadline.
+    def request():
+        with span("request", url=url, file=name):
+            return transport.get(url, stream=True, timeout=deadline.timeout(timeout or transport.timeout))
 
     # Initilize our response variable.
     response = None
 
+    # Status of the last answer which was retried.
+    status = None
+
     # Make a ranged request which will be used to stream data from.
-    while not response and retries < max_retries:
+    while response is None and retries < max_retries:
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+            response = request()
 
-        except(requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
+        except transport.errors:
             # Print a status message for this sort of timeout error.
-            print("503 Service Unavailable. Attempting {} of {} retries.".format(retries + 1, max_retries))
-            print("Waiting for {} seconds ...".format(sleep))
+            message = "503 Service Unavailable."
+
+        else:
+            if not retryable_status(response.status_code):
+                break
+
+            # Throttled requests and server errors are retried like failed connections.
+            status = response.status_code
+            message = "Request error {}.".format(status)
 
-            # Sleep for a large amount of time.
+            response.close()
+            response = None
+
+        if deadline.expired(sleep):
+            break
+
+        print("{} Attempting {} of {} retries.".format(message, retries + 1, max_retries))
+        print("Waiting for {} seconds ...".format(sleep))
+
+        # Sleep for a large amount of time.
+        with span("sleep", file=name, seconds=sleep):
             time.sleep(sleep)
-            retries += 1
 
-    # Verify that our response data exists and has a valid status code.
-    if response and response.status_code != 200:
+        retries += 1
+
+    # Fail out if no connection could be made at all.
+    if response is None:
+        if status is not None:
+            if not silent:
+                print("Request error {}".format(status))
+
+            return status
+
+        if not silent:
+            print("Connection timed out or interrupted.")
+
+        return 0
+
+    # Verify that our response data has a valid status code.
+    if response.status_code != 200:
         if not silent:
             print("Request error {}".format(response.status_code))
 
+        response.close()
+
         return response.status_code
 
     # Get the total length of our remote content. Used for verification and progress calculation.
@@ -335,14 +646,19 @@ def download_file(url, output, name, force=False, verbose=False, silent=False, s
         if not silent:
             print("Request does not contain an entry for the content length.")
 
+        response.close()
+
         return 0
 
     # Convert our raw length to an integer value for further processing.
     remote_length = int(remote_length)
 
-    if not force and os.path.isfile(os.path.join(output, name)):
+    # Look up the size of a previous download if the sink keeps one.
+    local_length = None if force else sink.size(output, name)
+
+    if local_length is not None:
         # If we have less data than our confidence percentage we re-download our file.
-        if calculate_confidence(os.path.getsize(os.path.join(output, name)), remote_length, 0.01) < 0:
+        if calculate_confidence(local_length, remote_length, 0.01) < 0:
             if verbose:
                 print("File already found but the file size does not match up. Re-downloading.")
 
@@ -350,74 +666,130 @@ def download_file(url, output, name, force=False, verbose=False, silent=False, s
             if verbose:
                 print("File already found. Skipping download.")
 
+            # Release the connection without reading the body.
+            response.close()
+
             return 2
 
+    # Fetch large files as several ranges at once if the server allows it.
+    if segments > 1 and remote_length >= segment_threshold and sink.ranged and not header \
+            and response.headers.get("accept-ranges", "").lower() == "bytes":
+        response.close()
+
+        status = download_segments(
+            url,
+            output,
+            name,
+            remote_length,
+            sink,
+            segments,
+            verbose=verbose,
+            silent=silent,
+            sleep=sleep,
+            timeout=timeout,
+            max_retries=max_retries,
+            chunk_size=chunk_size,
+            deadline=deadline
+        )
+
+        if status is not None:
+            return status
+
+        # The server ignored the ranges. Fall back to a single stream.
+        response = None
+
     # Reset retries for the new process of iterating content.
     retries = 0
 
     while not success and retries < max_retries:
-        # Open a file stream which will be used to save the output string
-        with open(os.path.join(output, safe_filename(name)), "wb") as f:
-            # Storage variables used while evaluating the already downloaded data.
-            dl = 0
-            cleaned_length = int((remote_length * 100) / pow(1024, 2)) / 100
-            block_size = 2048
+        # Set if data of the current attempt was handed to the sink.
+        streamed = False
 
+        # A consumed response can't be read again so request the file anew.
+        if response is None:
             try:
-                for chunk in response.iter_content(chunk_size=block_size):
-                    # Add the length of the chunk to the download size and
-                    # write the chunk to the file.
-                    dl += len(chunk)
-                    f.write(chunk)
-
-                    if verbose:
-                        # Calculate the the download completion percentage.
-                        done = int(50 * dl / remote_length)
-
-                        # Display a bar based on the current download progress.
-                        sys.stdout.write(
-                            "\r[{}{}{}] {}MB / {}MB ".format(
-                                "=" * done,
-                                ">",
-                                " " * (50 - done),
-                                (int(((dl) * 100) / pow(1024, 2)) / 100),
-                                cleaned_length
-                            )
-                        )
-
-                        # Flush the output buffer so we can overwrite the same line.
-                        sys.stdout.flush()
-
-                # Verify our download size for completion. Since the file sizes will
-                # not entirely match up because of possible ID3 tag differences or
-                # additional headers, pass a margin/percentage confidence check instead.
-                if calculate_confidence(os.path.getsize(f.name), remote_length, 0.01) < 0:
-                    # Print a newline to skip the buffer flush.
-                    print("")
-
-                    # Print a status message to inform the user of incomplete data.
-                    print("The download didn't complete. Attempting {} of {} retries.".format(retries + 1, max_retries))
-                    print("Waiting for {} seconds ...".format(sleep))
-
-                    # Sleep for a large amount of time.
-                    time.sleep(sleep)
-                    retries += 1
+                response = request()
 
-                else:
-                    # Request and download was successful.
-                    success = True
+            except transport.errors:
+                message = "503 Service Unavailable."
 
-            except(requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError, requests.exceptions.StreamConsumedError):
-                # Print a newline to skip the buffer flush.
-                print("")
+            else:
+                if retryable_status(response.status_code):
+                    message = "Request error {}.".format(response.status_code)
 
-                # Print a status message for this sort of timeout error.
-                print("503 Service Unavailable. Attempting {} of {} retries.".format(retries + 1, max_retries))
-                print("Waiting for {} seconds ...".format(sleep))
+                    response.close()
+                    response = None
 
-                # Sleep for a large amount of time.
-                time.sleep(sleep)
-                retries += 1
+                elif response.status_code != 200:
+                    if not silent:
+                        print("Request error {}".format(response.status_code))
+
+                    response.close()
+
+                    return response.status_code
+
+        if response is not None:
+            with span("stream", url=url, file=name, length=remote_length, attempt=retries + 1):
+                # Open a file stream which will be used to save the output string
+                with sink.open(output, name, header, remote_length) as f:
+                    # Storage variables used while evaluating the already downloaded data.
+                    dl = 0
+
+                    try:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            # Add the length of the chunk to the download size and
+                            # write the chunk to the file.
+                            dl += len(chunk)
+                            f.write(chunk)
+                            streamed = True
+
+                            if verbose:
+                                print_progress(dl, remote_length)
+
+                            # Give up on the transfer once the deadline passed.
+                            if deadline.expired():
+                                break
+
+                        # Verify our download size for completion. Since the file sizes will
+                        # not entirely match up because of possible ID3 tag differences or
+                        # additional headers, pass a margin/percentage confidence check instead.
+                        if calculate_confidence(dl, remote_length, 0.01) >= 0:
+                            # Request and download was successful.
+                            success = True
+
+                        else:
+                            # Print a newline to skip the buffer flush.
+                            print("")
+
+                            # Print a status message to inform the user of incomplete data.
+                            message = "The download didn't complete."
+
+                    except transport.errors:
+                        # Print a newline to skip the buffer flush.
+                        print("")
+
+                        # Print a status message for this sort of timeout error.
+                        message = "503 Service Unavailable."
+
+            # Release the connection of the consumed or failed response.
+            response.close()
+            response = None
+
+        if success:
+            break
+
+        # Data already passed on by the sink can't be taken back.
+        if (streamed and not sink.retryable) or deadline.expired(sleep):
+            break
+
+        print("{} Attempting {} of {} retries.".format(message, retries + 1, max_retries))
+        print("Waiting for {} seconds ...".format(sleep))
+
+        # Sleep for a large amount of time outside of the open file.
+        with span("sleep", file=name, seconds=sleep):
+            time.sleep(sleep)
+
+        retries += 1
 
     if success:
         if verbose:
@@ -434,6 +806,6 @@ def download_file(url, output, name, force=False, verbose=False, silent=False, s
             print("Connection timed out or interrupted.")
 
         # Remove the possibly partial file and return the correct error code.
-        os.remove(os.path.join(output, safe_filename(name)))
+        sink.remove(output, name)
 
         return 0
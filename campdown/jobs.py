@@ -0,0 +1,431 @@
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+from .helpers import safe_print
+from .album import Album
+from .discography import Discography
+from .api import resolve, iter_tracks, download
+from .deadline import Deadline
+
+
+class JobQueue:
+    """
+    Job queue shared between several Campdown workers. Jobs are single albums
+    or tracks stored in an SQLite database which can be placed on a mount
+    shared by all nodes. A worker leases a job for a limited time and has to
+    renew its lease with heartbeats. Jobs whose lease expired are handed out
+    again so a crashed worker never blocks an item.
+
+    Args:
+        path (str): path of the SQLite database. Created if it doesn't exist.
+        lease (number): seconds a lease is valid for without a heartbeat.
+        max_attempts (number): amount of leases a job gets before it is
+            marked as failed.
+    """
+
+    def __init__(self, path, lease=300, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        # Autocommit mode so transactions can be controlled explicitly.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+
+        # Serializes use of the connection between a worker and its heartbeat.
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    UNIQUE (url, output)
+                )
+            """)
+
+    def put(self, kind, url, output):
+        """
+        Adds a job to the queue. Jobs already in the queue are ignored.
+
+        Args:
+            kind (str): "album" or "track".
+            url (str): Bandcamp URL of the item.
+            output (str): absolute folder path the item is written to.
+
+        Returns:
+            True if the job was added. False if it already existed.
+        """
+
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (kind, url, output) VALUES (?, ?, ?)",
+                (kind, url, output)
+            )
+
+        return cursor.rowcount == 1
+
+    def take(self, worker):
+        """
+        Leases the next pending job. Expired leases are returned to the
+        queue first.
+
+        Args:
+            worker (str): unique name of the worker leasing the job.
+
+        Returns:
+            Dictionary of the leased job or None if no job is pending.
+        """
+
+        now = time.time()
+
+        with self.lock:
+            # Take a write lock right away so no other worker leases the same job.
+            self.connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'failed', error = 'lease expired too often' "
+                    "WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+                    (now, self.max_attempts)
+                )
+
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'pending', worker = NULL, expires = NULL "
+                    "WHERE state = 'leased' AND expires < ?",
+                    (now,)
+                )
+
+                row = self.connection.execute(
+                    "SELECT id, kind, url, output, attempts FROM jobs "
+                    "WHERE state = 'pending' ORDER BY id LIMIT 1"
+                ).fetchone()
+
+                if row:
+                    self.connection.execute(
+                        "UPDATE jobs SET state = 'leased', worker = ?, expires = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (worker, now + self.lease, row[0])
+                    )
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        if not row:
+            return None
+
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "url": row[2],
+            "output": row[3],
+            "attempts": row[4] + 1
+        }
+
+    def heartbeat(self, job, worker):
+        """
+        Renews the lease of a job.
+
+        Args:
+            job (dict): job as returned by take.
+            worker (str): name of the worker holding the lease.
+
+        Returns:
+            True if the lease was renewed. False if it was lost.
+        """
+
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease, job["id"], worker)
+            )
+
+        return cursor.rowcount == 1
+
+    def finish(self, job, worker, error=None):
+        """
+        Marks a leased job as done. Failed jobs are returned to the queue
+        until they ran out of attempts.
+
+        Args:
+            job (dict): job as returned by take.
+            worker (str): name of the worker holding the lease.
+            error (str): optional error message if the job failed.
+        """
+
+        if not error:
+            state = "done"
+
+        elif job["attempts"] >= self.max_attempts:
+            state = "failed"
+
+        else:
+            state = "pending"
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, expires = NULL, error = ? "
+                "WHERE id = ? AND worker = ?",
+                (state, error, job["id"], worker)
+            )
+
+    def release(self, job, worker):
+        """
+        Returns a leased job to the queue without counting the attempt. Used
+        for jobs which were interrupted by a deadline rather than failing.
+
+        Args:
+            job (dict): job as returned by take.
+            worker (str): name of the worker holding the lease.
+        """
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET state = 'pending', worker = NULL, expires = NULL, attempts = attempts - 1 "
+                "WHERE id = ? AND worker = ?",
+                (job["id"], worker)
+            )
+
+    def counts(self):
+        """
+        Counts the jobs in each state.
+
+        Returns:
+            Dictionary mapping job states to their amount of jobs.
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+
+        return dict(rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class Heartbeat(threading.Thread):
+    """
+    Background thread renewing the lease of a job while it is being worked on.
+    Once the lease is lost its deadline is cancelled, so the work stops before
+    the worker which took over the job writes the same files.
+
+    Args:
+        queue (JobQueue): queue the job was leased from.
+        job (dict): job as returned by JobQueue.take.
+        worker (str): name of the worker holding the lease.
+        deadline (Deadline): optional deadline the work on the job is bound by.
+    """
+
+    def __init__(self, queue, job, worker, deadline=None):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+
+        # Deadline of the work on the job. Cancelled when the lease is lost.
+        self.deadline = Deadline(parent=deadline)
+
+        # Set if the lease was taken over by another worker.
+        self.lost = False
+
+        self.stopped = threading.Event()
+
+    def run(self):
+        # Renew the lease well before it runs out.
+        while not self.stopped.wait(self.queue.lease / 3):
+            if not self.queue.heartbeat(self.job, self.worker):
+                self.lost = True
+                self.deadline.cancel()
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def enqueue(queue, urls, output, verbose=False, silent=False):
+    """
+    Resolves Bandcamp URLs into album and track jobs and adds them to a queue.
+    Discography pages are split into their albums and tracks without
+    requesting the pages of the items themselves.
+
+    Args:
+        queue (JobQueue): queue to add the jobs to.
+        urls (list): Bandcamp URLs to resolve.
+        output (str): absolute folder path to write the items to.
+        verbose (bool): sets if status messages should be printed.
+        silent (bool): sets if error messages should be hidden.
+
+    Returns:
+        Amount of jobs added to the queue.
+    """
+
+    added = 0
+
+    for url in urls:
+        pagetype, request = resolve(url, silent=silent)
+
+        if pagetype in ("track", "album"):
+            items = [(pagetype, url, output)]
+
+        elif pagetype == "discography":
+            page = Discography(url, output, request=request, silent=silent)
+
+            if not page.prepare():
+                continue
+
+            items = [
+                ("album" if type(item) is Album else "track", item.url, item.output)
+                for item in page.releases()
+            ]
+
+        else:
+            if pagetype and not silent:
+                print("Invalid page type for {}. Skipping.".format(url))
+
+            continue
+
+        for kind, item_url, item_output in items:
+            if queue.put(kind, item_url, item_output):
+                added += 1
+
+                if verbose:
+                    safe_print("Queued {} {}".format(kind, item_url))
+
+    return added
+
+
+def work(queue, worker=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, sink=None, parser=None, deadline=None, item_deadline=None, store=None, jobs=1):
+    """
+    Leases jobs from a queue and downloads them until no jobs are left.
+    Several workers on different nodes can work on the same queue without
+    downloading the same item twice. Once the deadline is reached no further
+    jobs are leased and an interrupted job is returned to the queue.
+
+    Args:
+        queue (JobQueue): queue to lease jobs from.
+        worker (str): unique name of this worker. Defaults to the host name
+            and process ID.
+        verbose (bool): sets if status messages should be printed.
+        silent (bool): sets if error messages should be hidden.
+        short (bool): omits arist and album fields from track filenames.
+        sleep (number): timeout duration between failed requests in seconds.
+        art_enabled (bool): if True artwork is downloaded as well.
+        id3_enabled (bool): if True tracks will receive new ID3 tags.
+        abort_missing (bool): skips albums which are missing tracks.
+        sink (FileSink): output sink to write tracks to.
+        parser (Parser): parser used for all pages.
+        deadline (Deadline): deadline of the entire run.
+        item_deadline (number): seconds each track may take at most.
+        store (ObjectStore): content addressed store audio payloads are
+            shared through between releases.
+        jobs (number): amount of files downloaded at once.
+
+    Returns:
+        Amount of jobs finished by this worker.
+    """
+
+    if not worker:
+        worker = "{}-{}".format(socket.gethostname(), os.getpid())
+
+    if deadline is None:
+        deadline = Deadline()
+
+    finished = 0
+
+    while not deadline.expired():
+        job = queue.take(worker)
+
+        if not job:
+            # Wait for jobs leased by other workers as their leases might expire.
+            if queue.counts().get("leased"):
+                remaining = deadline.remaining()
+
+                time.sleep(min(queue.lease, 30, 30 if remaining is None else remaining))
+                continue
+
+            break
+
+        if verbose:
+            safe_print("\n{} leased {} {}".format(worker, job["kind"], job["url"]))
+
+        heartbeat = Heartbeat(queue, job, worker, deadline)
+        heartbeat.start()
+
+        error = None
+        interrupted = False
+
+        try:
+            summary = download(
+                iter_tracks(
+                    job["url"],
+                    job["output"],
+                    verbose=verbose,
+                    silent=silent,
+                    short=short,
+                    sleep=sleep,
+                    art_enabled=art_enabled,
+                    id3_enabled=id3_enabled,
+                    abort_missing=abort_missing,
+                    parser=parser
+                ),
+                sink=sink,
+                deadline=heartbeat.deadline,
+                item_deadline=item_deadline,
+                store=store,
+                jobs=jobs
+            )
+
+            # Leave the job to the next run if it was cut short by a deadline.
+            interrupted = summary["expired"] or summary["unfinished"]
+
+            if summary["failed"]:
+                error = "{} tracks failed to download".format(summary["failed"])
+
+            elif not summary["downloaded"] and not summary["skipped"]:
+                error = "no tracks could be resolved"
+
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+
+        finally:
+            heartbeat.stop()
+
+        if heartbeat.lost:
+            if not silent:
+                print("Lost the lease of {} to another worker.".format(job["url"]))
+
+            continue
+
+        if interrupted:
+            queue.release(job, worker)
+
+            if verbose:
+                safe_print("Deadline reached. Returned {} to the queue.".format(job["url"]))
+
+            continue
+
+        queue.finish(job, worker, error)
+
+        if error and not silent:
+            print("Job {} failed: {}".format(job["url"], error))
+
+        finished += 1
+
+    return finished
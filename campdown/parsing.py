@@ -0,0 +1,291 @@
+
+import html
+import json
+import re
+import collections
+
+from .helpers import string_between, page_type
+from .profiling import phase, span
+
+
+def parse_track(content):
+    """
+    Parses the content of a Bandcamp track page. Only plain values are
+    returned so the result can be passed between processes cheaply.
+
+    Args:
+        content (str): decoded content of the track page.
+
+    Returns:
+        Dictionary containing the page type, title, artist, album, date,
+        artwork URL, MP3 URL and Bandcamp ID of the track. Values which could not be found
+        are empty strings or None for URLs.
+    """
+
+    # Get the metadata for the track.
+    meta = html.unescape(string_between(content, '<meta name="title" content="', '">')).strip()
+
+    info = {
+        "type": page_type(content),
+        "title": meta.split(", by ", 1)[0],
+        "artist": meta.split(", by ", 1)[1] if ", by " in meta else "",
+        "album": "",
+        "date": "",
+        "art_url": None,
+        "mp3_url": None,
+        "track_id": None
+    }
+
+    if info["artist"] == "Various Artists":
+        info["artist"] = ""
+
+    if not info["artist"]:
+        info["artist"] = html.unescape(string_between(string_between(
+            content, "var BandData = {", "}"), 'name : "', '",'))
+
+    if not info["artist"]:
+        info["artist"] = html.unescape(string_between(string_between(
+            content, "var BandData = {", "}"), 'name: "', '",'))
+
+    # Add the album to which this single track might belong to.
+    info["album"] = html.unescape(string_between(
+        content, '<span itemprop="name">', "</span>"))
+
+    # Get the date this track was released on.
+    info["date"] = html.unescape(string_between(
+        content, '<meta itemprop="datePublished" content="', '">'))[0:4]
+
+    # Get the track art URL.
+    info["art_url"] = string_between(
+        content, '<a class="popupImage" href="', '">')
+
+    # Get the Bandcamp track MP3 URL.
+    raw_info = "{{{data}}}".format(data=html.unescape(string_between(
+        content, "data-tralbum=\"{", "}\"")).replace("'", "\"")
+    )
+
+    data = json.loads(raw_info)
+
+    try:
+        mp3_url = data["trackinfo"][0]["file"]["mp3-128"]
+
+    except (KeyError, IndexError, TypeError):
+        mp3_url = None
+
+    try:
+        track_id = data["trackinfo"][0].get("track_id") or data["trackinfo"][0].get("id")
+
+    except (KeyError, IndexError, TypeError, AttributeError):
+        track_id = None
+
+    if track_id:
+        info["track_id"] = str(track_id)
+
+    if mp3_url:
+        # Add in http for those times when Bandcamp is rude.
+        if mp3_url[:2] == "//":
+            mp3_url = "http:" + mp3_url
+
+        info["mp3_url"] = mp3_url
+
+    return info
+
+
+def parse_discography(content, base_url):
+    """
+    Finds the album and track links of a Bandcamp discography page.
+
+    Args:
+        content (str): decoded content of the discography page.
+        base_url (str): base URL of the page used to complete relative links.
+
+    Returns:
+        Tuple of the album URL list and the track URL list in page order.
+    """
+
+    links = {"album": [], "track": []}
+
+    # Links already found. Grid items are often listed in both forms.
+    seen = set()
+
+    def add(url, kind):
+        # Skip links without a name.
+        if url.endswith("/{}/".format(kind)):
+            return
+
+        if "http://" not in url and "https://" not in url:
+            url = base_url + url
+
+        if url not in seen:
+            seen.add(url)
+            links[kind].append(url)
+
+    # Links are either relative, point at the base URL or any Bandcamp domain.
+    pattern = re.compile(
+        r'<a href="((?:{}|https://\w+.bandcamp.com)?/(album|track)/[^"?]*)'.format(re.escape(base_url)))
+
+    for match in pattern.finditer(content):
+        add(match.group(1), match.group(2))
+
+    # Large grids only render their first items as links. The remaining items
+    # are embedded as JSON and rendered by the page's scripts.
+    for match in re.finditer(r'data-client-items="([^"]*)"', content):
+        try:
+            items = json.loads(html.unescape(match.group(1)))
+
+        except ValueError:
+            continue
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+
+            kind = item.get("type")
+            url = item.get("page_url")
+
+            if kind in links and url:
+                add(url.split("?", 1)[0], kind)
+
+    return links["album"], links["track"]
+
+
+def parse_pagination(content, url):
+    """
+    Finds the continuation pages linked by the pagination of a discography
+    page.
+
+    Args:
+        content (str): decoded content of the discography page.
+        url (str): URL of the page the content belongs to.
+
+    Returns:
+        Dictionary mapping page numbers to the URLs of the pages.
+    """
+
+    base = url.split("?", 1)[0]
+    pages = {}
+
+    for match in re.finditer(r'href="[^"]*[?&](?:amp;)?page=(\d+)[^"]*"', content):
+        number = int(match.group(1))
+
+        if number > 1:
+            pages[number] = "{}?page={}".format(base, number)
+
+    return pages
+
+
+class Parser:
+    """
+    Runs parse functions either in the current process or in a pool of worker
+    processes. While a worker parses a page the main process is free to
+    request the next one which keeps the CPU bound parsing of large pages from
+    stalling network transfers.
+
+    Args:
+        workers (number): amount of worker processes to parse pages in. Zero
+            parses pages in the current process.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self.pool = None
+
+        if workers:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, function, *args):
+        """
+        Schedules a parse function to be run.
+
+        Args:
+            function (function): module level function to run.
+            *args: arguments to pass to the function.
+
+        Returns:
+            Future holding the return value of the function.
+        """
+
+        if self.pool:
+            return self.pool.submit(function, *args)
+
+        from concurrent.futures import Future
+
+        future = Future()
+
+        try:
+            with phase("parse", function=function.__name__):
+                future.set_result(function(*args))
+
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+    def run(self, function, *args):
+        """
+        Runs a parse function and waits for its result.
+
+        Args:
+            function (function): module level function to run.
+            *args: arguments to pass to the function.
+
+        Returns:
+            Return value of the function.
+        """
+
+        return self.submit(function, *args).result()
+
+    def prepare(self, tracks):
+        """
+        Prepares tracks in order while parsing up to one page per worker in
+        the background. The next track pages are requested while earlier
+        pages are still being parsed.
+
+        Args:
+            tracks (iterable): track instances which have not been prepared.
+
+        Yields:
+            Tuples of each track and True if its preparation was successful.
+        """
+
+        pending = collections.deque()
+
+        def finish(track, future):
+            # Waits for the page of the track and applies it.
+            with span("prepare", url=track.url, album=track.album, index=track.index):
+                return future is not None and track.apply(future.result())
+
+        for track in tracks:
+            # The page is requested in the same span Track.prepare uses. The
+            # rest of the preparation is a second span once it is parsed.
+            with span("prepare", url=track.url, album=track.album, index=track.index):
+                if track.load():
+                    pending.append((track, self.submit(parse_track, track.content)))
+
+                else:
+                    pending.append((track, None))
+
+            while len(pending) > self.workers:
+                track, future = pending.popleft()
+
+                yield track, finish(track, future)
+
+        while pending:
+            track, future = pending.popleft()
+
+            yield track, finish(track, future)
+
+    def close(self):
+        """
+        Shuts down the worker processes if there are any.
+        """
+
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+
+# Parser used if none is supplied. Parses pages in the current process.
+inline = Parser()
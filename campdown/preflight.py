@@ -0,0 +1,220 @@
+import os
+import time
+import shutil
+
+from .helpers import probe_size, calculate_confidence
+
+# Amount of bytes read from the largest file to measure the throughput.
+SAMPLE_SIZE = 1048576
+
+# Share of the filesystem which should be left free after a run.
+RESERVE = 0.05
+
+
+def existing_parent(path):
+    """
+    Finds the closest existing folder of a path which may not exist yet.
+
+    Args:
+        path (str): path to start from.
+
+    Returns:
+        Absolute path of the path itself or of its closest existing parent.
+    """
+
+    path = os.path.abspath(path)
+
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+
+    return path
+
+
+def sample_throughput(url, size=SAMPLE_SIZE):
+    """
+    Measures the throughput of a single transfer by reading the first bytes
+    of a file.
+
+    Args:
+        url (str): URL of the file.
+        size (number): amount of bytes to read at most.
+
+    Returns:
+        Throughput in bytes per second or None if nothing was received.
+    """
+
+    from .transport import get_transport
+
+    transport = get_transport()
+
+    received = 0
+    start = time.monotonic()
+
+    try:
+        response = transport.get(url, stream=True, headers={"Range": "bytes=0-{}".format(size - 1)})
+
+        if response.status_code in (200, 206):
+            for chunk in response.iter_content(chunk_size=65536):
+                received += len(chunk)
+
+                # Servers ignoring the range send the entire file.
+                if received >= size:
+                    break
+
+        response.close()
+
+    except transport.errors:
+        return None
+
+    elapsed = time.monotonic() - start
+
+    if not received or not elapsed:
+        return None
+
+    return received / elapsed
+
+
+def format_duration(seconds):
+    """
+    Formats a duration for status messages such as "1h 05m" or "3m 20s".
+
+    Args:
+        seconds (number): duration in seconds.
+
+    Returns:
+        Formatted duration string.
+    """
+
+    seconds = int(round(seconds))
+
+    if seconds >= 3600:
+        return "{}h {:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+
+    if seconds >= 60:
+        return "{}m {:02d}s".format(seconds // 60, seconds % 60)
+
+    return "{}s".format(seconds)
+
+
+def preflight(tracks, output, jobs=1, workers=16, store=None, linked=False):
+    """
+    Looks up the size of every audio file and artwork of resolved tracks
+    with parallel HEAD requests before anything is downloaded. Files which
+    already exist with the same size are left out as they will be skipped.
+    The throughput is measured by reading the start of the largest file.
+
+    The sizes found are kept with the tracks so they aren't looked up again
+    when the downloads are scheduled.
+
+    With a store every audio file is counted a second time on the filesystem
+    of the store, as tagged files are copies of the stored payload wherever
+    they can't be reflinked. Untagged files are hardlinked to the store and
+    only counted once if they are on its filesystem.
+
+    Args:
+        tracks (list): prepared tracks or track records.
+        output (str): folder the files are written to. Only used to look up
+            the free space if there is nothing to download.
+        jobs (number): amount of files downloaded at once.
+        workers (number): amount of HEAD requests made at once.
+        store (str): optional folder of the content addressed store.
+        linked (bool): if True files are hardlinked to the store as they
+            aren't tagged.
+
+    Returns:
+        Dictionary with the amount of "files" to download, their "bytes",
+        the amount of files of "unknown" size and already "present", the
+        measured "throughput" per transfer in bytes per second and the
+        estimated duration "eta" in seconds. Throughput and duration are
+        None if they couldn't be measured. The bytes "needed" on the
+        filesystem with the least space left after the run are given along
+        with its "free" and "total" bytes and a "folder" on it.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Files by path so covers shared by an album are only counted once.
+    files = {}
+
+    for track in tracks:
+        if isinstance(track, dict):
+            record, size = track, track.get("size")
+
+        else:
+            record, size = track.record(), track.size
+
+        files.setdefault(record["path"], [record["mp3_url"], size, track])
+
+        if record.get("art_path") and record.get("art_url"):
+            files.setdefault(record["art_path"], [record["art_url"], None, None])
+
+    unknown = [entry for entry in files.values() if entry[1] is None and entry[0]]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        for entry, size in zip(unknown, pool.map(probe_size, [entry[0] for entry in unknown])):
+            entry[1] = size
+
+            # Keep the size for the scheduler.
+            if isinstance(entry[2], dict):
+                entry[2]["size"] = size
+
+            elif entry[2] is not None:
+                entry[2].size = size
+
+    report = {"files": 0, "bytes": 0, "unknown": 0, "present": 0}
+
+    largest = None
+
+    # Bytes needed and a folder by filesystem device.
+    devices = {}
+
+    def need(folder, size):
+        # Counts bytes needed on the filesystem of a folder.
+        folder = existing_parent(folder)
+        device = devices.setdefault(os.stat(folder).st_dev, [0, folder])
+        device[0] += size
+
+        return device
+
+    for path, (url, size, track) in files.items():
+        if size is None:
+            report["unknown"] += 1
+            continue
+
+        if os.path.isfile(path) and calculate_confidence(os.path.getsize(path), size, 0.01) >= 0:
+            report["present"] += 1
+            continue
+
+        report["files"] += 1
+        report["bytes"] += size
+
+        device = need(os.path.dirname(path), size)
+
+        # The payloads are written to the store as well unless they are
+        # hardlinked to it.
+        if store and track is not None:
+            if not (linked and os.stat(existing_parent(store)).st_dev == os.stat(device[1]).st_dev):
+                need(store, size)
+
+        if largest is None or size > largest[1]:
+            largest = (url, size)
+
+    report["throughput"] = sample_throughput(largest[0]) if largest else None
+
+    if report["throughput"]:
+        report["eta"] = report["bytes"] / (report["throughput"] * max(1, min(jobs, report["files"])))
+
+    else:
+        report["eta"] = None
+
+    if not devices:
+        devices[None] = [0, existing_parent(output)]
+
+    # Report the filesystem which is left with the least free space.
+    for needed, folder in devices.values():
+        usage = shutil.disk_usage(folder)
+
+        if "free" not in report or usage.free - needed < report["free"] - report["needed"]:
+            report.update({"needed": needed, "free": usage.free, "total": usage.total, "folder": folder})
+
+    return report
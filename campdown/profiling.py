@@ -0,0 +1,481 @@
+
+import os
+import json
+import time
+import threading
+
+# Phases of a run in the order they are reported.
+PHASES = ("fetch", "parse", "transfer", "tagging", "art")
+
+
+class Inactive:
+    """
+    Context manager used for phases while neither a profiler nor a tracer is
+    set. Does nothing so instrumented code pays a single function call when
+    profiling is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+inactive = Inactive()
+
+
+class Phase:
+    """
+    Context manager measuring a single phase of a run with the current
+    profiler and tracer.
+
+    Args:
+        profiler (Profiler): profiler to record the phase with. None if the
+            phase is only traced.
+        tracer (Tracer): tracer to record the phase with. None if the phase
+            is only profiled.
+        name (str): name of the phase.
+        args (dict): details of the phase shown in the trace.
+    """
+
+    def __init__(self, profiler, tracer, name, args):
+        self.profiler = profiler
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.started = None
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enter(self.name)
+
+        if self.tracer is not None:
+            self.started = time.perf_counter()
+
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if self.profiler is not None:
+            self.profiler.exit(self.name)
+
+        if self.tracer is not None:
+            if error is not None:
+                self.args["error"] = repr(error)
+
+            self.tracer.record(self.name, self.started, time.perf_counter(), self.args)
+
+        return False
+
+
+class Profiler:
+    """
+    Profiles the phases of a run (page fetches, parsing, media transfers, ID3
+    tagging and artwork) separately with cProfile. Each thread keeps its own
+    profile of each phase. Nested phases pause the enclosing one so time is
+    only counted towards the innermost phase. The profiles of all threads are
+    merged into one .pstats file per phase once the profiler is closed.
+
+    Pages parsed in worker processes (--parse-workers) are not visible to the
+    profiler. Python 3.12 and later allow a single active profile at a time,
+    so phases overlapping with a phase of another thread are only timed.
+
+    Args:
+        directory (str): folder the reports are written to. Created if it
+            doesn't exist.
+        memory (bool): if True allocations are traced with tracemalloc and
+            the largest allocation sites are reported.
+        top (number): amount of allocation sites to report.
+        frames (number): amount of stack frames stored with each traced
+            allocation.
+    """
+
+    def __init__(self, directory, memory=False, top=25, frames=1):
+        self.directory = os.path.abspath(directory)
+        self.memory = memory
+        self.top = top
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Profiles by phase name and thread identifier.
+        self.profiles = {}
+
+        # Amount of entries and seconds spent by phase name.
+        self.calls = {}
+        self.seconds = {}
+
+        # Guards the profiles and counters between threads.
+        self.lock = threading.Lock()
+
+        # Stack of the entered phases of each thread.
+        self.local = threading.local()
+
+        self.started = time.monotonic()
+        self.baseline = None
+
+        if memory:
+            import tracemalloc
+
+            tracemalloc.start(frames)
+            self.baseline = tracemalloc.take_snapshot()
+
+    def profile(self, name):
+        # Returns the profile of a phase for the current thread.
+        import cProfile
+
+        key = (name, threading.get_ident())
+
+        with self.lock:
+            if key not in self.profiles:
+                self.profiles[key] = cProfile.Profile()
+
+            return self.profiles[key]
+
+    def enter(self, name):
+        """
+        Starts profiling a phase in the current thread.
+
+        Args:
+            name (str): name of the phase.
+        """
+
+        stack = getattr(self.local, "stack", None)
+
+        if stack is None:
+            stack = self.local.stack = []
+
+        # Pause the enclosing phase so only the innermost one is counted.
+        if stack and stack[-1][1] is not None:
+            stack[-1][1].disable()
+
+        profile = self.profile(name)
+
+        try:
+            profile.enable()
+
+        except ValueError:
+            # Another thread's profile is active (Python 3.12+).
+            profile = None
+
+        stack.append((name, profile, time.perf_counter()))
+
+    def exit(self, name):
+        """
+        Stops profiling the innermost phase of the current thread.
+
+        Args:
+            name (str): name of the phase.
+        """
+
+        stack = self.local.stack
+        name, profile, started = stack.pop()
+        elapsed = time.perf_counter() - started
+
+        if profile is not None:
+            profile.disable()
+
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+        # Continue the enclosing phase.
+        if stack and stack[-1][1] is not None:
+            try:
+                stack[-1][1].enable()
+
+            except ValueError:
+                pass
+
+    def close(self):
+        """
+        Writes the reports to the profile folder and stops tracing
+        allocations.
+
+        Returns:
+            List of the paths written.
+        """
+
+        import pstats
+
+        written = []
+
+        # Snapshot the allocations before the statistics are merged.
+        if self.memory:
+            path = os.path.join(self.directory, "allocations.txt")
+
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.allocations())
+
+            written.append(path)
+
+        names = sorted(set(name for name, thread in self.profiles),
+                       key=lambda name: (PHASES.index(name) if name in PHASES else len(PHASES), name))
+
+        for name in names:
+            stats = None
+
+            for (profiled, thread), profile in self.profiles.items():
+                if profiled != name:
+                    continue
+
+                # Profiles which never ran hold no statistics.
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profile)
+
+                    else:
+                        stats.add(profile)
+
+                except TypeError:
+                    continue
+
+            if stats is not None:
+                path = os.path.join(self.directory, name + ".pstats")
+                stats.dump_stats(path)
+                written.append(path)
+
+        path = os.path.join(self.directory, "phases.txt")
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+        written.append(path)
+
+        return written
+
+    def report(self):
+        """
+        Summarizes the time spent in each phase.
+
+        Returns:
+            Table of the phases as a string.
+        """
+
+        lines = ["{:<10} {:>8} {:>10}".format("phase", "calls", "seconds")]
+
+        for name in sorted(self.calls, key=lambda name: -self.seconds[name]):
+            lines.append("{:<10} {:>8} {:>10.3f}".format(name, self.calls[name], self.seconds[name]))
+
+        lines.append("")
+        lines.append("Wall time {:.3f} seconds. Phases of concurrent threads overlap.".format(
+            time.monotonic() - self.started))
+
+        return "\n".join(lines) + "\n"
+
+    def allocations(self):
+        """
+        Lists the allocation sites which grew the most since the profiler was
+        created and stops tracing allocations.
+
+        Returns:
+            Report of the largest allocation sites as a string.
+        """
+
+        import cProfile
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+
+        tracemalloc.stop()
+
+        # Leave out the bookkeeping of the profiler and imported modules.
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ]
+        statistics = snapshot.filter_traces(filters).compare_to(self.baseline.filter_traces(filters), "lineno")
+
+        lines = ["Traced memory {:.1f} KiB, peak {:.1f} KiB.".format(current / 1024, peak / 1024), ""]
+
+        for statistic in statistics[:self.top]:
+            lines.append(str(statistic))
+
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Records phases and spans as a timeline in the Chrome Trace Event format.
+    The trace can be opened in chrome://tracing or ui.perfetto.dev and shows
+    each thread of the run as its own row. This makes idle gaps, requests
+    waiting on each other and slow hosts visible in concurrent runs.
+
+    Args:
+        path (str): file the trace is written to as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.pid = os.getpid()
+
+        # Completed events in the order they ended.
+        self.events = []
+
+        # Names of the threads which recorded events by their identifier.
+        self.threads = {}
+
+        # Guards the events and thread names between threads.
+        self.lock = threading.Lock()
+
+        # Timestamps are given in microseconds since the tracer was created.
+        self.origin = time.perf_counter()
+
+    def record(self, name, started, ended, args):
+        """
+        Adds a completed span to the trace.
+
+        Args:
+            name (str): name of the span.
+            started (number): perf_counter value the span started at.
+            ended (number): perf_counter value the span ended at.
+            args (dict): details of the span. The host of a "url" is added
+                so requests can be grouped by server.
+        """
+
+        if "url" in args and "host" not in args:
+            from urllib.parse import urlsplit
+
+            args["host"] = urlsplit(args["url"]).netloc
+
+        thread = threading.current_thread()
+
+        event = {
+            "name": name,
+            "cat": "phase" if name in PHASES else "span",
+            "ph": "X",
+            "ts": round((started - self.origin) * 1e6, 1),
+            "dur": round((ended - started) * 1e6, 1),
+            "pid": self.pid,
+            "tid": thread.ident,
+            "args": args
+        }
+
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def close(self):
+        """
+        Writes the trace file.
+
+        Returns:
+            Amount of events written.
+        """
+
+        with self.lock:
+            events = [
+                {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": ident, "args": {"name": name}}
+                for ident, name in self.threads.items()
+            ]
+
+            events.extend(sorted(self.events, key=lambda event: event["ts"]))
+
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+        return len(events) - len(self.threads)
+
+
+# Profiler the phases are recorded with. None while profiling is off.
+profiler = None
+
+# Tracer phases and spans are recorded with. None while tracing is off.
+tracer = None
+
+
+def phase(name, **args):
+    """
+    Marks a phase of a run for the current profiler and tracer.
+
+        with phase("transfer", url=url):
+            download_file(...)
+
+    Args:
+        name (str): name of the phase such as "fetch", "parse", "transfer",
+            "tagging" or "art".
+        **args: details of the phase shown in the trace.
+
+    Returns:
+        Context manager covering the phase.
+    """
+
+    if profiler is None and tracer is None:
+        return inactive
+
+    return Phase(profiler, tracer, name, args)
+
+
+def span(name, **args):
+    """
+    Marks a part of a run which only shows up in the trace, such as a single
+    request, a retry or the download of a track as a whole. Spans can
+    enclose phases and other spans.
+
+    Args:
+        name (str): name of the span.
+        **args: details of the span shown in the trace.
+
+    Returns:
+        Context manager covering the span.
+    """
+
+    if tracer is None:
+        return inactive
+
+    return Phase(None, tracer, name, args)
+
+
+def get_profiler():
+    """
+    Returns the profiler phases are recorded with or None if profiling is off.
+    """
+
+    return profiler
+
+
+def set_profiler(new_profiler):
+    """
+    Replaces the profiler phases are recorded with.
+
+    Args:
+        new_profiler (Profiler): profiler to use. None turns profiling off.
+
+    Returns:
+        The previous profiler.
+    """
+
+    global profiler
+
+    previous, profiler = profiler, new_profiler
+
+    return previous
+
+
+def get_tracer():
+    """
+    Returns the tracer phases and spans are recorded with or None if tracing
+    is off.
+    """
+
+    return tracer
+
+
+def set_tracer(new_tracer):
+    """
+    Replaces the tracer phases and spans are recorded with.
+
+    Args:
+        new_tracer (Tracer): tracer to use. None turns tracing off.
+
+    Returns:
+        The previous tracer.
+    """
+
+    global tracer
+
+    previous, tracer = tracer, new_tracer
+
+    return previous
@@ -0,0 +1,477 @@
+
+import json
+import time
+import hashlib
+import threading
+import collections
+
+from .transport import TIMEOUT
+
+# Content types which are worth compressing inside an archive. Audio and
+# artwork are stored as they are.
+COMPRESSED_TYPES = ("text/", "application/json", "application/javascript")
+
+
+class Headers(dict):
+    """
+    Response headers of a recorded exchange. Names are looked up regardless
+    of their case like with the headers of requests and httpx responses.
+    """
+
+    def __init__(self, headers=()):
+        dict.__init__(self, ((str(name).lower(), value) for name, value in dict(headers).items()))
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+
+class ReplayError(Exception):
+    """
+    Raised by the replay transport in place of a connection error which was
+    recorded.
+    """
+
+
+class RecordingResponse:
+    """
+    Wraps a streamed response and keeps a copy of the data read from it. The
+    exchange is added to the archive once the response is read entirely or
+    closed.
+
+    Args:
+        recorder (RecordingTransport): transport recording the exchange.
+        response (Response): response to wrap.
+        exchange (dict): description of the exchange without its body.
+    """
+
+    def __init__(self, recorder, response, exchange):
+        self.recorder = recorder
+        self.response = response
+        self.exchange = exchange
+
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = getattr(response, "url", exchange["url"])
+
+        self.body = bytearray()
+        self.started = None
+        self.finished = False
+
+    @property
+    def content(self):
+        content = self.response.content
+        self.body = bytearray(content)
+        self.finish(complete=True)
+
+        return content
+
+    def iter_content(self, chunk_size=65536):
+        self.started = time.monotonic()
+        complete = False
+
+        try:
+            for chunk in self.response.iter_content(chunk_size=chunk_size):
+                self.body += chunk
+                yield chunk
+
+            complete = True
+
+        except self.recorder.errors as e:
+            self.exchange["interrupted"] = repr(e)
+            raise
+
+        finally:
+            # Transfers abandoned by the reader are recorded as far as they got.
+            self.finish(complete)
+
+    def finish(self, complete):
+        # Adds the exchange with the data read so far to the archive.
+        if self.finished:
+            return
+
+        self.finished = True
+
+        self.exchange["duration"] = time.monotonic() - self.started if self.started else 0.0
+        self.exchange["complete"] = complete
+
+        self.recorder.add(self.exchange, bytes(self.body))
+
+    def close(self):
+        self.finish(complete=False)
+        self.response.close()
+
+
+class RecordingTransport:
+    """
+    Wraps another transport and records every exchange into an archive which
+    the replay transport serves later without any network access. Runs can
+    then be repeated with the same pages and timings to profile parsing and
+    the download pipeline deterministically.
+
+    The archive is a zip file holding one JSON line per exchange (the request,
+    the status, the response headers, the latency until the response arrived
+    and the time its body took to read) and every distinct body once, named by
+    its SHA-256 hash. Pages are compressed while audio and artwork are stored.
+
+    Args:
+        transport (RequestsTransport, HTTP2Transport): transport to wrap.
+        path (str): file to write the archive to. Replaced if it exists.
+    """
+
+    def __init__(self, transport, path):
+        import zipfile
+
+        self.transport = transport
+        self.path = path
+
+        self.errors = transport.errors
+        self.timeout = transport.timeout
+
+        self.archive = zipfile.ZipFile(path, "w")
+
+        # Recorded exchanges and the hashes of the bodies in the archive.
+        self.exchanges = []
+        self.bodies = set()
+
+        # Amount of body bytes written to the archive.
+        self.stored = 0
+
+        # Guards the archive between threads.
+        self.lock = threading.Lock()
+
+        self.origin = time.monotonic()
+
+    def request(self, method, url, stream, timeout, headers):
+        # Makes a request through the wrapped transport and describes it.
+        exchange = {
+            "method": method,
+            "url": url,
+            "range": (headers or {}).get("Range"),
+            "started": round(time.monotonic() - self.origin, 6)
+        }
+
+        start = time.monotonic()
+
+        try:
+            if method == "HEAD":
+                response = self.transport.head(url, timeout=timeout, headers=headers)
+
+            else:
+                response = self.transport.get(url, stream=stream, timeout=timeout, headers=headers)
+
+        except self.errors as e:
+            exchange["latency"] = time.monotonic() - start
+            exchange["error"] = repr(e)
+
+            self.add(exchange, None)
+
+            raise
+
+        exchange["latency"] = time.monotonic() - start
+        exchange["status"] = response.status_code
+        exchange["headers"] = dict(response.headers)
+
+        return exchange, response
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        exchange, response = self.request("GET", url, stream, timeout, headers)
+
+        if stream:
+            return RecordingResponse(self, response, exchange)
+
+        # The body of a page has been read along with the response.
+        exchange["duration"] = 0.0
+        exchange["complete"] = True
+
+        self.add(exchange, response.content)
+
+        return response
+
+    def head(self, url, timeout=None, headers=None):
+        exchange, response = self.request("HEAD", url, False, timeout, headers)
+
+        self.add(exchange, None)
+
+        return response
+
+    def add(self, exchange, body):
+        """
+        Adds an exchange and its body to the archive.
+
+        Args:
+            exchange (dict): description of the exchange.
+            body (bytes): data of the response. None if there is none.
+        """
+
+        import zipfile
+
+        headers = exchange.get("headers")
+
+        # Bodies are stored decoded so their encoding no longer applies.
+        if headers and body is not None and exchange.get("complete"):
+            if Headers(headers).get("content-encoding"):
+                headers = exchange["headers"] = dict(
+                    (name, value) for name, value in headers.items()
+                    if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+                )
+
+                headers["Content-Length"] = str(len(body))
+
+        if body is not None:
+            digest = hashlib.sha256(body).hexdigest()
+
+            exchange["body"] = digest
+            exchange["length"] = len(body)
+
+        with self.lock:
+            # Bodies received several times are stored once.
+            if body is not None and digest not in self.bodies:
+                kind = Headers(exchange.get("headers", {})).get("content-type", "")
+
+                compression = zipfile.ZIP_STORED
+
+                if kind.startswith(COMPRESSED_TYPES):
+                    compression = zipfile.ZIP_DEFLATED
+
+                self.archive.writestr("bodies/" + digest, body, compress_type=compression)
+
+                self.bodies.add(digest)
+                self.stored += len(body)
+
+            self.exchanges.append(exchange)
+
+    def stats(self):
+        """
+        Returns the amount of recorded exchanges and of stored body bytes.
+        """
+
+        with self.lock:
+            return {"exchanges": len(self.exchanges), "bytes": self.stored}
+
+    def close(self):
+        """
+        Writes the exchanges to the archive and closes it.
+        """
+
+        with self.lock:
+            self.archive.writestr("exchanges.jsonl", "".join(
+                json.dumps(exchange, default=str) + "\n" for exchange in self.exchanges))
+
+            self.archive.close()
+
+        self.transport.close()
+
+
+class ReplayResponse:
+    """
+    Response served from an archive. Streamed bodies are paced to take as
+    long as they took to record, multiplied by the latency scale.
+
+    Args:
+        exchange (dict): recorded exchange.
+        body (bytes): recorded data of the response.
+        scale (number): multiplier of the recorded transfer time.
+    """
+
+    def __init__(self, exchange, body, scale=1.0):
+        self.exchange = exchange
+        self.status_code = exchange["status"]
+        self.headers = Headers(exchange.get("headers", {}))
+        self.url = exchange["url"]
+        self.body = body or b""
+        self.scale = scale
+
+    @property
+    def content(self):
+        return self.body
+
+    def iter_content(self, chunk_size=65536):
+        duration = self.exchange.get("duration", 0.0) * self.scale
+        started = time.monotonic()
+
+        for offset in range(0, len(self.body), chunk_size):
+            chunk = self.body[offset:offset + chunk_size]
+
+            # Deliver the data at the recorded rate.
+            if duration:
+                delay = started + duration * (offset + len(chunk)) / len(self.body) - time.monotonic()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+            yield chunk
+
+        if self.exchange.get("interrupted"):
+            raise ReplayError(self.exchange["interrupted"])
+
+    def close(self):
+        pass
+
+
+class ReplayTransport:
+    """
+    Serves the exchanges of an archive written by the recording transport
+    instead of making requests. Each response is delayed by its recorded
+    latency and streamed bodies take their recorded transfer time, both
+    multiplied by the scale. A scale of 0 replays as fast as possible.
+
+    Exchanges of the same request are served in the order they were
+    recorded, repeating the last one once all have been served. Ranged
+    requests which were not recorded are served from a recorded complete
+    body. Requests which were never recorded receive a 404 response.
+
+    Args:
+        path (str): archive to serve the exchanges from.
+        scale (number): multiplier of the recorded latencies and transfer
+            times.
+        timeout (number, tuple): kept for callers limiting their requests.
+            Recorded latencies are not cut short by it.
+    """
+
+    errors = (ReplayError,)
+
+    def __init__(self, path, scale=1.0, timeout=TIMEOUT):
+        import zipfile
+
+        self.path = path
+        self.scale = scale
+        self.timeout = timeout
+
+        self.archive = zipfile.ZipFile(path)
+
+        # Recorded exchanges by method, URL and range.
+        self.exchanges = collections.defaultdict(collections.deque)
+
+        for line in self.archive.read("exchanges.jsonl").decode("utf-8").splitlines():
+            if line.strip():
+                exchange = json.loads(line)
+                self.exchanges[(exchange["method"], exchange["url"], exchange.get("range"))].append(exchange)
+
+        # Counters of served requests and of requests missing in the archive.
+        self.served = 0
+        self.missing = 0
+
+        # Guards the exchanges and the archive between threads.
+        self.lock = threading.Lock()
+
+    def next(self, method, url, byte_range=None):
+        # Returns the next recorded exchange of a request.
+        with self.lock:
+            queue = self.exchanges.get((method, url, byte_range))
+
+            if not queue:
+                return None
+
+            if len(queue) > 1:
+                return queue.popleft()
+
+            return queue[0]
+
+    def body(self, exchange):
+        # Reads the recorded body of an exchange from the archive.
+        if not exchange.get("body"):
+            return b""
+
+        with self.lock:
+            return self.archive.read("bodies/" + exchange["body"])
+
+    def wait(self, exchange):
+        # Delays a response by its recorded latency.
+        delay = exchange.get("latency", 0.0) * self.scale
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def slice(self, url, byte_range):
+        """
+        Serves a ranged request from a complete body of the same URL.
+
+        Args:
+            url (str): URL of the request.
+            byte_range (str): value of the Range header such as "bytes=0-99".
+
+        Returns:
+            Tuple of the exchange and the body of a 206 response or None if
+            no complete body of the URL was recorded.
+        """
+
+        exchange = self.next("GET", url)
+
+        if exchange is None or exchange.get("status") != 200 or not exchange.get("complete"):
+            return None
+
+        body = self.body(exchange)
+
+        start, end = byte_range.split("=", 1)[1].split("-")
+        start = int(start)
+        end = min(int(end) if end else len(body) - 1, len(body) - 1)
+
+        headers = dict(exchange.get("headers", {}))
+        headers.update({
+            "Content-Length": str(end + 1 - start),
+            "Content-Range": "bytes {}-{}/{}".format(start, end, len(body))
+        })
+
+        ranged = dict(exchange, status=206, headers=headers)
+
+        # The range takes its share of the recorded transfer time.
+        ranged["duration"] = exchange.get("duration", 0.0) * (end + 1 - start) / max(len(body), 1)
+
+        return ranged, body[start:end + 1]
+
+    def serve(self, method, url, headers):
+        # Finds and delays the recorded response of a request.
+        byte_range = (headers or {}).get("Range")
+
+        exchange = self.next(method, url, byte_range)
+        body = None
+
+        if exchange is None and byte_range and method == "GET":
+            sliced = self.slice(url, byte_range)
+
+            if sliced:
+                exchange, body = sliced
+
+        if exchange is None:
+            with self.lock:
+                self.missing += 1
+
+            exchange = {"method": method, "url": url, "status": 404, "headers": {"Content-Length": "0"}}
+
+        else:
+            with self.lock:
+                self.served += 1
+
+        self.wait(exchange)
+
+        if exchange.get("error"):
+            raise ReplayError(exchange["error"])
+
+        if body is None and method == "GET":
+            body = self.body(exchange)
+
+        return ReplayResponse(exchange, body, self.scale)
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        return self.serve("GET", url, headers)
+
+    def head(self, url, timeout=None, headers=None):
+        return self.serve("HEAD", url, headers)
+
+    def stats(self):
+        """
+        Returns the amount of served requests and of requests which were not
+        found in the archive.
+        """
+
+        with self.lock:
+            return {"served": self.served, "missing": self.missing}
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,127 @@
+import os
+
+# Frames written by Campdown which are replaced when a file is retagged.
+# Comments are only replaced if they were written by Campdown.
+FRAMES = ("TIT2", "TPE1", "TALB", "TRCK", "TDRC", "TPE2")
+
+
+def retag_file(record):
+    """
+    Rewrites the ID3 frames Campdown tags tracks with on an existing file. The
+    tag is saved in place if it fits into the padding of the file's current
+    tag. Otherwise the file is rewritten once with enough padding for later
+    edits to happen in place.
+
+    Args:
+        record (dict): track record as written with --plan. Its path names
+            the file to retag.
+
+    Returns:
+        Tuple of the path, the outcome ("in place", "rewritten", "unchanged",
+        "missing" or "failed") and an error description if it failed.
+    """
+
+    from mutagen import MutagenError
+    from mutagen.id3 import ID3, ID3NoHeaderError
+
+    from .track import fill_tags
+
+    path = record["path"]
+
+    if not os.path.isfile(path):
+        return path, "missing", None
+
+    try:
+        try:
+            tags = ID3(path)
+
+        except ID3NoHeaderError:
+            tags = ID3()
+
+        before = describe(tags)
+
+        for frame in FRAMES:
+            tags.delall(frame)
+
+        for key in [key for key, frame in tags.items() if key.startswith("COMM") and own_comment(frame)]:
+            del tags[key]
+
+        fill_tags(
+            tags,
+            record.get("title") or "",
+            record.get("artist") or "",
+            album=record.get("album"),
+            album_artist=record.get("album_artist"),
+            index=record.get("index"),
+            date=record.get("date"),
+            url=record.get("url")
+        )
+
+        if describe(tags) == before:
+            return path, "unchanged", None
+
+        # The file keeps its size as long as the padding stays the same.
+        resized = []
+
+        def padding(info):
+            chosen = info.get_default_padding()
+
+            if chosen != info.padding:
+                resized.append(chosen)
+
+            return chosen
+
+        tags.save(path, padding=padding)
+
+    except (MutagenError, OSError) as e:
+        return path, "failed", str(e)
+
+    return path, ("rewritten" if resized else "in place"), None
+
+
+def own_comment(frame):
+    # Tells apart the comment Campdown links the artist page in from the
+    # comments of users.
+    return frame.lang == "XXX" and frame.desc == "" and str(frame).startswith("Visit ")
+
+
+def describe(tags):
+    # Lists the frames a retag may change in a comparable form.
+    described = []
+
+    for frame in FRAMES + ("COMM",):
+        described.extend(
+            (frame, item.pprint()) for item in tags.getall(frame)
+            if frame != "COMM" or own_comment(item)
+        )
+
+    return sorted(described)
+
+
+def retag(records, processes=None):
+    """
+    Retags the files of track records in a pool of worker processes without
+    downloading any media. Useful to fix the tags of an existing library after
+    its metadata changed or after the tagging of Campdown was improved.
+
+    Args:
+        records (iterable): track records as written with --plan.
+        processes (number): amount of worker processes. Defaults to the
+            amount of CPUs. Zero retags in the current process.
+
+    Yields:
+        Tuples of the path, the outcome and the error description of each
+        file as returned by retag_file.
+    """
+
+    if processes == 0:
+        for record in records:
+            yield retag_file(record)
+
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for result in pool.map(retag_file, records, chunksize=32):
+            yield result
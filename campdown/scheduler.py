@@ -0,0 +1,272 @@
+
+import time
+import threading
+import itertools
+import collections
+
+from .helpers import safe_print, probe_size
+from .deadline import Deadline
+from .api import download_cover, tally
+
+
+class Scheduler:
+    """
+    Downloads tracks concurrently in a fixed amount of slots. Tracks are read
+    in windows of a bounded size so memory stays constant and downloads
+    start while later pages are still being resolved. Within each window
+    audio files are ordered longest first so a few large tracks rarely end
+    up running on their own. Small artwork downloads are interleaved with
+    them to fill the remaining slots instead of queueing up behind the
+    audio.
+
+    Expected sizes are taken from the tracks (such as the "size" field of
+    manifest records) or looked up with a HEAD request for each file of a
+    window before it is scheduled.
+
+    Args:
+        jobs (number): amount of downloads to run at once.
+        verbose (bool): sets if status messages should be printed.
+        window (number): amount of tracks read and ordered at once.
+            Defaults to 16 tracks per slot but at least 64.
+    """
+
+    def __init__(self, jobs=4, verbose=False, window=None):
+        self.jobs = jobs
+        self.verbose = verbose
+        self.window = window or max(64, jobs * 16)
+
+        # Guards the work list, the summary and the counters.
+        self.lock = threading.Lock()
+
+        # Seconds spent downloading summed over all slots of the current run.
+        self.busy = 0.0
+
+    def sizes(self, tracks):
+        """
+        Looks up the expected size of each track without a known size.
+
+        Args:
+            tracks (list): tracks to look up.
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        unknown = [track for track in tracks if track.size is None]
+
+        if not unknown:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="probe") as pool:
+            for track, size in zip(unknown, pool.map(probe_size, [track.mp3_url for track in unknown])):
+                track.size = size
+
+    def order(self, tracks, covers=None):
+        """
+        Builds the work list of a window of tracks.
+
+        Args:
+            tracks (list): tracks with expected sizes.
+            covers (set): album folders whose cover was already scheduled.
+                Folders of covers scheduled by this call are added to it.
+
+        Returns:
+            List of (kind, track) tuples where kind is "audio", "art" or
+            "cover". Audio is ordered by descending size with tracks of
+            unknown size last. One artwork download follows each audio file.
+        """
+
+        if covers is None:
+            covers = set()
+
+        audio = sorted(tracks, key=lambda track: -(track.size or 0))
+
+        art = []
+
+        for track in tracks:
+            if not track.sink.files:
+                continue
+
+            if track.art_enabled and track.art_url:
+                art.append(("art", track))
+
+            # Album covers are downloaded once for each folder.
+            if track.cover_url and track.output not in covers:
+                covers.add(track.output)
+                art.append(("cover", track))
+
+        work = []
+
+        for track in audio:
+            work.append(("audio", track))
+
+            if art:
+                work.append(art.pop(0))
+
+        return work + art
+
+    def run(self, tracks, summary, unfinished, deadline=None, item_deadline=None):
+        """
+        Downloads tracks and their artwork concurrently.
+
+        Args:
+            tracks (iterable): prepared tracks. Read one window at a time
+                whenever the slots are about to run out of work.
+            summary (dict): download summary to count the results in.
+            unfinished (function): called with each track left unfinished by
+                a deadline.
+            deadline (Deadline): deadline of the entire run.
+            item_deadline (number): seconds each track may take at most.
+
+        Returns:
+            The summary extended by the achieved slot utilization.
+
+        Raises:
+            Exception: the first error raised by a download or while reading
+                the tracks, once the running downloads finished. No further
+                downloads start after an error.
+        """
+
+        if deadline is None:
+            deadline = Deadline()
+
+        tracks = iter(tracks)
+
+        # Utilization is measured for each run on its own.
+        self.busy = 0.0
+
+        work = collections.deque()
+
+        # Album folders whose cover is scheduled, the amount of items
+        # scheduled so far and if all tracks were read.
+        covers = set()
+        loaded = {"total": 0, "exhausted": False}
+
+        # Only one slot reads from the tracks at a time.
+        loading = threading.Lock()
+
+        # Errors raised by the slots. The first one is raised again once all
+        # slots stopped, as it would be by sequential downloads.
+        errors = []
+
+        def load():
+            # Schedules the next window of tracks.
+            if deadline.expired():
+                # Leave the tracks which weren't read to a later run.
+                track = next(tracks, None)
+
+                with self.lock:
+                    loaded["exhausted"] = True
+
+                    if track is not None:
+                        summary["expired"] = True
+                        unfinished(track)
+
+                return
+
+            window = list(itertools.islice(tracks, self.window))
+
+            for track in window:
+                # Concurrent progress bars would overwrite each other.
+                track.verbose = False
+
+            self.sizes(window)
+
+            items = self.order(window, covers)
+
+            with self.lock:
+                work.extend(items)
+
+                loaded["total"] += len(items)
+                loaded["exhausted"] = len(window) < self.window
+
+        def worker():
+            while True:
+                # Read ahead before the slots run out of work.
+                if len(work) < self.jobs and not loaded["exhausted"]:
+                    with loading:
+                        try:
+                            if len(work) < self.jobs and not loaded["exhausted"] and not errors:
+                                load()
+
+                        except Exception as e:
+                            with self.lock:
+                                errors.append(e)
+
+                            return
+
+                with self.lock:
+                    if not work or errors:
+                        return
+
+                    kind, track = work.popleft()
+                    position = loaded["total"] - len(work)
+                    total = loaded["total"]
+
+                # Leave the remaining tracks to a later run once out of time.
+                if deadline.expired():
+                    with self.lock:
+                        summary["expired"] = True
+
+                        if kind == "audio":
+                            unfinished(track)
+
+                    continue
+
+                started = time.monotonic()
+
+                try:
+                    if kind == "audio":
+                        item = Deadline(item_deadline, parent=deadline)
+                        status = track.download(deadline=item, art=False)
+
+                    elif kind == "art":
+                        status = track.download_art(deadline)
+
+                    else:
+                        status = download_cover(track, deadline)
+
+                except Exception as e:
+                    # Stop handing out work so the error isn't repeated by every slot.
+                    with self.lock:
+                        errors.append(e)
+
+                    return
+
+                elapsed = time.monotonic() - started
+
+                with self.lock:
+                    self.busy += elapsed
+
+                    if kind == "audio":
+                        tally(summary, status, item, track, unfinished)
+
+                    if self.verbose:
+                        safe_print("[{}/{}] {} {} ({:.1f}s)".format(
+                            position, total, kind, track.clean_title(), elapsed))
+
+        started = time.monotonic()
+
+        # Named slots make the rows of a --trace timeline easy to tell apart.
+        threads = [
+            threading.Thread(target=worker, daemon=True, name="slot {}".format(i + 1))
+            for i in range(self.jobs)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        makespan = time.monotonic() - started
+
+        summary["utilization"] = self.busy / (self.jobs * makespan) if makespan else 1.0
+
+        if self.verbose:
+            print("\nRan {} downloads in {} slots for {:.1f} seconds. Slot utilization {:.0%}.".format(
+                loaded["total"], self.jobs, makespan, summary["utilization"]))
+
+        return summary
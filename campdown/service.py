@@ -0,0 +1,704 @@
+
+import os
+import json
+import time
+import queue
+import threading
+
+from .helpers import safe_print, valid_url
+from .api import iter_tracks, download
+from .deadline import Deadline, parse_duration
+
+# States of a job in the order they are passed through.
+STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class ConflictError(ValueError):
+    """
+    Raised when a job is submitted for a URL which is already queued or
+    running.
+    """
+
+
+def overlaps(folder, other):
+    """
+    Checks if two output folders can hold the same files.
+
+    Args:
+        folder (str): absolute folder path ending with a separator.
+        other (str): absolute folder path ending with a separator.
+
+    Returns:
+        True if one of the folders contains the other one.
+    """
+
+    folder = os.path.normcase(folder)
+    other = os.path.normcase(other)
+
+    return folder.startswith(other) or other.startswith(folder)
+
+
+class Service:
+    """
+    Long running Campdown instance working on jobs submitted through a local
+    HTTP API. Every job is a Bandcamp URL resolved and downloaded with the
+    same machinery as the command line. Workers share one parser and store
+    and the process keeps one transport, so connections and parse workers
+    stay warm between jobs. Each job gets its own sink so folder listings
+    never outlive the job which made them.
+
+    A URL can only be queued once at a time and jobs whose folders contain
+    one another run one after another, so no two jobs write the same files.
+    Job folders are always inside the output folder of the service.
+
+    Subscribed pages such as an artist's discography are queued again in
+    their interval. Files which were downloaded before are skipped so a
+    re-sync only fetches new releases.
+
+    Args:
+        output (str): absolute folder path jobs are written to by default.
+        workers (number): amount of jobs worked on at once.
+        subscriptions (str): JSON file the subscriptions are kept in.
+        verbose (bool): sets if job events should be printed.
+        short (bool): omits arist and album fields from track filenames.
+        sleep (number): timeout duration between failed requests in seconds.
+        art_enabled (bool): if True artwork is downloaded as well.
+        id3_enabled (bool): if True tracks will receive new ID3 tags.
+        abort_missing (bool): skips albums which are missing tracks.
+        background (bool): if True output files are written by a
+            background thread.
+        parser (Parser): parser shared by all jobs.
+        item_deadline (number): seconds each track may take at most.
+        store (ObjectStore): content addressed store shared by all jobs.
+        jobs (number): amount of files downloaded at once by each job.
+    """
+
+    def __init__(self, output, workers=2, subscriptions=None, verbose=False, short=False, sleep=30, art_enabled=True, id3_enabled=True, abort_missing=False, background=False, parser=None, item_deadline=None, store=None, jobs=1):
+        self.output = output
+        self.workers = workers
+        self.verbose = verbose
+        self.short = short
+        self.sleep = sleep
+        self.art_enabled = art_enabled
+        self.id3_enabled = id3_enabled
+        self.abort_missing = abort_missing
+        self.background = background
+        self.parser = parser
+        self.item_deadline = item_deadline
+        self.store = store
+        self.jobs = jobs
+
+        # Jobs by their identifier and the identifiers waiting for a worker.
+        self.table = {}
+        self.pending = queue.Queue()
+        self.next_id = 1
+
+        # Subscriptions by their identifier and the file they are kept in.
+        self.subscriptions = {}
+        self.subscriptions_path = subscriptions or os.path.join(output, "campdown-subscriptions.json")
+
+        # Guards the jobs and subscriptions between the workers and requests.
+        self.lock = threading.Lock()
+
+        # Notified whenever a job finishes so jobs waiting for its folder
+        # are looked at again.
+        self.finished = threading.Condition(self.lock)
+
+        # Set once the service shuts down.
+        self.stopped = threading.Event()
+
+        # Woken up when subscriptions change so they are checked right away.
+        self.changed = threading.Event()
+
+        self.started = time.time()
+        self.threads = []
+
+        self.load_subscriptions()
+
+    def folder(self, output):
+        """
+        Resolves the folder a job writes to.
+
+        Args:
+            output (str): folder path relative to the output folder of the
+                service. None for the output folder itself.
+
+        Returns:
+            Absolute folder path ending with a separator.
+
+        Raises:
+            ValueError: if the path is absolute or leaves the output folder.
+        """
+
+        if output is not None and not isinstance(output, str):
+            raise ValueError("Output folder must be a string: {}".format(output))
+
+        if output and os.path.isabs(output):
+            raise ValueError("Output folder must be relative: {}".format(output))
+
+        root = os.path.realpath(self.output)
+        folder = os.path.realpath(os.path.join(root, output or ""))
+
+        if os.path.commonpath([root, folder]) != root:
+            raise ValueError("Output folder is outside of {}: {}".format(self.output, output))
+
+        return os.path.join(folder, "")
+
+    def submit(self, url, output=None, subscription=None):
+        """
+        Queues a job.
+
+        Args:
+            url (str): Bandcamp URL to download.
+            output (str): folder path to write to relative to the output
+                folder of the service.
+            subscription (number): identifier of the subscription the job
+                was queued for.
+
+        Returns:
+            Dictionary describing the queued job.
+
+        Raises:
+            ValueError: if the URL is not a valid URL or the folder is not
+                inside the output folder.
+            ConflictError: if a job for the URL is already queued or running.
+        """
+
+        if not valid_url(url):
+            raise ValueError("Invalid URL: {}".format(url))
+
+        output = self.folder(output)
+
+        with self.lock:
+            for other in self.table.values():
+                if other["url"] == url and other["state"] in ("queued", "running"):
+                    raise ConflictError("Job {} is already {} for {}".format(other["id"], other["state"], url))
+
+            job = {
+                "id": self.next_id,
+                "url": url,
+                "output": output,
+                "state": "queued",
+                "subscription": subscription,
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "resolved": 0,
+                "current": None,
+                "summary": {},
+                "error": None,
+                "deadline": Deadline()
+            }
+
+            self.table[job["id"]] = job
+            self.next_id += 1
+
+        self.pending.put(job["id"])
+
+        if self.verbose:
+            safe_print("Queued job {} {}".format(job["id"], url))
+
+        return self.describe(job)
+
+    def describe(self, job):
+        """
+        Copies the public fields of a job so it can be encoded as JSON.
+
+        Args:
+            job (dict): job of the service.
+
+        Returns:
+            Dictionary describing the job.
+        """
+
+        with self.lock:
+            described = dict((key, value) for key, value in job.items() if key != "deadline")
+            described["summary"] = dict(job["summary"])
+
+        return described
+
+    def job(self, job_id):
+        """
+        Looks up a job.
+
+        Args:
+            job_id (number): identifier of the job.
+
+        Returns:
+            Dictionary describing the job or None if it doesn't exist.
+        """
+
+        job = self.table.get(job_id)
+
+        return self.describe(job) if job else None
+
+    def list(self):
+        """
+        Describes all jobs in the order they were submitted.
+        """
+
+        with self.lock:
+            jobs = sorted(self.table.values(), key=lambda job: job["id"])
+
+        return [self.describe(job) for job in jobs]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. A running job stops its current
+        transfer and removes the partial file.
+
+        Args:
+            job_id (number): identifier of the job.
+
+        Returns:
+            Dictionary describing the job or None if it doesn't exist.
+        """
+
+        job = self.table.get(job_id)
+
+        if not job:
+            return None
+
+        with self.lock:
+            if job["state"] in ("queued", "running"):
+                job["deadline"].cancel()
+
+                if job["state"] == "queued":
+                    job["state"] = "cancelled"
+                    job["finished"] = time.time()
+
+        return self.describe(job)
+
+    def status(self):
+        """
+        Summarizes the state of the service.
+
+        Returns:
+            Dictionary with the amount of jobs in each state, the amount of
+            workers and subscriptions and the uptime in seconds.
+        """
+
+        with self.lock:
+            counts = dict((state, 0) for state in STATES)
+
+            for job in self.table.values():
+                counts[job["state"]] += 1
+
+            return {
+                "jobs": counts,
+                "workers": self.workers,
+                "subscriptions": len(self.subscriptions),
+                "uptime": time.time() - self.started
+            }
+
+    def run_job(self, job):
+        """
+        Downloads a job with the shared settings of the service.
+
+        Args:
+            job (dict): job of the service.
+        """
+
+        def tracks():
+            # Follows the progress of the job while its tracks are resolved.
+            for track in iter_tracks(
+                job["url"],
+                job["output"],
+                short=self.short,
+                sleep=self.sleep,
+                art_enabled=self.art_enabled,
+                id3_enabled=self.id3_enabled,
+                abort_missing=self.abort_missing,
+                parser=self.parser
+            ):
+                with self.lock:
+                    job["resolved"] += 1
+                    job["current"] = track.clean_title()
+
+                yield track
+
+        from .sinks import FileSink
+
+        summary = download(
+            tracks(),
+            sink=FileSink(background=self.background),
+            deadline=job["deadline"],
+            item_deadline=self.item_deadline,
+            store=self.store,
+            jobs=self.jobs,
+            summary=job["summary"]
+        )
+
+        if job["deadline"].is_cancelled():
+            return "cancelled", None
+
+        if summary["failed"]:
+            return "failed", "{} tracks failed to download".format(summary["failed"])
+
+        if not summary["downloaded"] and not summary["skipped"]:
+            return "failed", "no tracks could be resolved"
+
+        return "done", None
+
+    def worker(self):
+        # Works on queued jobs until the service shuts down.
+        while not self.stopped.is_set():
+            try:
+                job = self.table[self.pending.get(timeout=1)]
+
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                # Jobs cancelled while queued are never started.
+                if job["state"] != "queued":
+                    continue
+
+                # Wait for running jobs which may write to the same files and
+                # leave the job to the next free worker. Jobs are compared by
+                # their folders as the folders of their tracks are only known
+                # once their pages are resolved.
+                if any(other["state"] == "running" and overlaps(other["output"], job["output"])
+                       for other in self.table.values()):
+                    self.pending.put(job["id"])
+                    self.finished.wait(1)
+                    continue
+
+                job["state"] = "running"
+                job["started"] = time.time()
+
+            try:
+                state, error = self.run_job(job)
+
+            except Exception as e:
+                state, error = "failed", "{}: {}".format(type(e).__name__, e)
+
+            with self.lock:
+                job["state"] = state
+                job["error"] = error
+                job["current"] = None
+                job["finished"] = time.time()
+
+                self.finished.notify_all()
+
+            if self.verbose:
+                safe_print("Job {} {}{}".format(job["id"], state, ": " + error if error else ""))
+
+    def subscribe(self, url, output=None, interval="24h"):
+        """
+        Subscribes to a page which is downloaded again in an interval.
+
+        Args:
+            url (str): Bandcamp URL such as an artist's discography page.
+            output (str): folder path to write to relative to the output
+                folder of the service.
+            interval (str, number): duration between syncs such as "12h".
+
+        Returns:
+            Dictionary describing the subscription.
+
+        Raises:
+            ValueError: if the URL, folder or interval is invalid.
+        """
+
+        if not valid_url(url):
+            raise ValueError("Invalid URL: {}".format(url))
+
+        self.folder(output)
+
+        seconds = parse_duration(interval)
+
+        if seconds <= 0:
+            raise ValueError("Invalid interval: {}".format(interval))
+
+        with self.lock:
+            subscription_id = max(self.subscriptions, default=0) + 1
+
+            subscription = {
+                "id": subscription_id,
+                "url": url,
+                "output": output,
+                "interval": seconds,
+                "synced": None
+            }
+
+            self.subscriptions[subscription_id] = subscription
+
+        self.save_subscriptions()
+        self.changed.set()
+
+        return dict(subscription)
+
+    def unsubscribe(self, subscription_id):
+        """
+        Removes a subscription.
+
+        Args:
+            subscription_id (number): identifier of the subscription.
+
+        Returns:
+            True if the subscription existed.
+        """
+
+        with self.lock:
+            removed = self.subscriptions.pop(subscription_id, None)
+
+        self.save_subscriptions()
+
+        return removed is not None
+
+    def list_subscriptions(self):
+        """
+        Describes all subscriptions.
+        """
+
+        with self.lock:
+            return [dict(self.subscriptions[key]) for key in sorted(self.subscriptions)]
+
+    def load_subscriptions(self):
+        # Restores the subscriptions of a previous run.
+        try:
+            with open(self.subscriptions_path, encoding="utf-8") as f:
+                for subscription in json.load(f):
+                    self.subscriptions[subscription["id"]] = subscription
+
+        except FileNotFoundError:
+            pass
+
+    def save_subscriptions(self):
+        # Replaces the subscriptions file in one step so it's never partial.
+        with self.lock:
+            data = json.dumps([self.subscriptions[key] for key in sorted(self.subscriptions)], indent=4)
+
+        temp = "{}.{}.tmp".format(self.subscriptions_path, os.getpid())
+
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(data)
+
+        os.replace(temp, self.subscriptions_path)
+
+    def resync(self):
+        # Queues subscriptions which are due until the service shuts down.
+        while not self.stopped.is_set():
+            now = time.time()
+            due = []
+            wait = 60.0
+
+            with self.lock:
+                active = set(job["subscription"] for job in self.table.values()
+                             if job["state"] in ("queued", "running"))
+
+                for subscription in self.subscriptions.values():
+                    if subscription["id"] in active:
+                        continue
+
+                    next_sync = (subscription["synced"] or 0) + subscription["interval"]
+
+                    if next_sync <= now:
+                        subscription["synced"] = now
+                        due.append(subscription)
+
+                    else:
+                        wait = min(wait, next_sync - now)
+
+            for subscription in due:
+                try:
+                    self.submit(subscription["url"], subscription["output"], subscription=subscription["id"])
+
+                except ConflictError:
+                    # The page is already being downloaded by another job.
+                    pass
+
+                except ValueError as e:
+                    # Subscriptions kept from before may point anywhere.
+                    if self.verbose:
+                        safe_print("Skipped subscription {}: {}".format(subscription["id"], e))
+
+            if due:
+                self.save_subscriptions()
+
+            self.changed.wait(wait)
+            self.changed.clear()
+
+    def start(self):
+        """
+        Starts the workers and the subscription thread.
+        """
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True, name="worker {}".format(i + 1))
+            thread.start()
+            self.threads.append(thread)
+
+        thread = threading.Thread(target=self.resync, daemon=True, name="resync")
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        """
+        Cancels all jobs and waits for the workers to stop.
+        """
+
+        with self.lock:
+            for job in self.table.values():
+                if job["state"] in ("queued", "running"):
+                    job["deadline"].cancel()
+
+        self.stopped.set()
+        self.changed.set()
+
+        for thread in self.threads:
+            thread.join()
+
+
+def handler(service):
+    """
+    Builds the request handler class of the HTTP API of a service.
+
+    Args:
+        service (Service): service the requests are passed on to.
+
+    Returns:
+        BaseHTTPRequestHandler subclass.
+    """
+
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        # Routes requests to the service and answers with JSON.
+        server_version = "campdown"
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, data):
+            body = json.dumps(data, indent=4).encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def payload(self):
+            length = int(self.headers.get("Content-Length") or 0)
+
+            try:
+                data = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+
+            except ValueError:
+                return None
+
+            return data if isinstance(data, dict) else None
+
+        def route(self):
+            # Splits the path into the collection and the optional identifier.
+            parts = [part for part in self.path.split("?")[0].split("/") if part]
+
+            if len(parts) == 2 and parts[1].isdigit():
+                return parts[0], int(parts[1])
+
+            if len(parts) == 1:
+                return parts[0], None
+
+            return None, None
+
+        def do_GET(self):
+            collection, identifier = self.route()
+
+            if collection == "status" and identifier is None:
+                return self.reply(200, service.status())
+
+            if collection == "jobs":
+                if identifier is None:
+                    return self.reply(200, service.list())
+
+                job = service.job(identifier)
+
+                if job:
+                    return self.reply(200, job)
+
+            if collection == "subscriptions" and identifier is None:
+                return self.reply(200, service.list_subscriptions())
+
+            self.reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            collection, identifier = self.route()
+
+            # Browsers only send JSON to other origins after a preflight
+            # request, which is never answered, so other sites can't queue jobs.
+            if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+                return self.reply(415, {"error": "expected Content-Type: application/json"})
+
+            data = self.payload()
+
+            if data is None or not data.get("url"):
+                return self.reply(400, {"error": "expected a JSON object with an url"})
+
+            try:
+                if collection == "jobs" and identifier is None:
+                    return self.reply(201, service.submit(data["url"], data.get("output")))
+
+                if collection == "subscriptions" and identifier is None:
+                    return self.reply(201, service.subscribe(data["url"], data.get("output"), data.get("interval", "24h")))
+
+            except ConflictError as e:
+                return self.reply(409, {"error": str(e)})
+
+            except ValueError as e:
+                return self.reply(400, {"error": str(e)})
+
+            self.reply(404, {"error": "not found"})
+
+        def do_DELETE(self):
+            collection, identifier = self.route()
+
+            if collection == "jobs" and identifier is not None:
+                job = service.cancel(identifier)
+
+                if job:
+                    return self.reply(200, job)
+
+            if collection == "subscriptions" and identifier is not None:
+                if service.unsubscribe(identifier):
+                    return self.reply(200, {"id": identifier})
+
+            self.reply(404, {"error": "not found"})
+
+    return Handler
+
+
+def serve(service, port=8420, host="127.0.0.1"):
+    """
+    Runs the HTTP API of a service until interrupted. The API only listens
+    on the local host by default as it has no authentication. Requests with
+    a body have to be sent as application/json.
+
+        POST   /jobs                 {"url": ..., "output": ...}
+        GET    /jobs, /jobs/<id>
+        DELETE /jobs/<id>            cancels the job
+        POST   /subscriptions        {"url": ..., "output": ..., "interval": "24h"}
+        GET    /subscriptions
+        DELETE /subscriptions/<id>
+        GET    /status
+
+    Args:
+        service (Service): service to run.
+        port (number): port to listen on.
+        host (str): address to listen on.
+    """
+
+    from http.server import ThreadingHTTPServer
+
+    httpd = ThreadingHTTPServer((host, port), handler(service))
+    httpd.daemon_threads = True
+
+    service.start()
+
+    try:
+        httpd.serve_forever()
+
+    finally:
+        httpd.server_close()
+        service.stop()
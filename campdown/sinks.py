@@ -0,0 +1,586 @@
+
+import os
+import queue
+import threading
+
+
+class FileSink:
+    """
+    Output sink writing each download to its own file inside the output
+    folder. This is the default sink used by Campdown. Files written to this
+    sink are tagged in place after their download completed.
+
+    Files are preallocated to their expected length and written through a
+    large buffer to keep fragmentation and the amount of write calls low.
+    They are written under a temporary name and only renamed once closed, so
+    an interrupted run never leaves a preallocated file which looks complete.
+
+    With background writing enabled the disk writes of each file are made by
+    a separate thread so a slow disk doesn't stall the network transfer.
+
+    Each folder is listed once with a single os.scandir call the first time
+    it is looked at. Skip decisions are answered from that listing and the
+    listing is kept up to date as files are written and removed, so network
+    mounts aren't hit with a stat call for every file. One sink should be
+    used for an entire run to benefit from this.
+    """
+
+    # Set if downloads end up as individual files which can be tagged and
+    # placed next to their artwork.
+    files = True
+
+    # Set if a failed transfer can be written again from the start.
+    retryable = True
+
+    # Set if downloads can be written at arbitrary offsets in several parts.
+    ranged = hasattr(os, "pwrite")
+
+    def __init__(self, buffer_size=1048576, background=False):
+        # Size of the write buffer of each opened file in bytes.
+        self.buffer_size = buffer_size
+
+        # Set if files are written by a background thread.
+        self.background = background
+
+        # Listing of each inspected folder. Maps filenames to their size or
+        # to their directory entry if the size hasn't been looked up yet.
+        self.index = {}
+
+        # Folders created or found to exist during the run.
+        self.folders = set()
+
+    def listing(self, path):
+        """
+        Returns the listing of a folder, scanning it if it wasn't yet.
+
+        Args:
+            path (str): absolute folder path to list.
+
+        Returns:
+            Dictionary of the folder's files. Empty if the folder is missing.
+        """
+
+        key = os.path.normpath(path)
+
+        if key not in self.index:
+            entries = {}
+
+            try:
+                for entry in os.scandir(key):
+                    entries[entry.name] = entry
+
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+
+            self.index[key] = entries
+
+        return self.index[key]
+
+    def makedirs(self, path):
+        """
+        Creates a folder and its parents if they don't already exist.
+
+        Args:
+            path (str): absolute folder path to create.
+        """
+
+        key = os.path.normpath(path)
+
+        # Folders which were listed while missing still have to be created.
+        if key not in self.folders:
+            os.makedirs(key, exist_ok=True)
+            self.folders.add(key)
+
+    def size(self, output, name):
+        """
+        Looks up the size of an already written file.
+
+        Args:
+            output (str): absolute folder path of the file.
+            name (str): filename with extension.
+
+        Returns:
+            Size of the file in bytes or None if it does not exist.
+        """
+
+        entries = self.listing(output)
+        entry = entries.get(name)
+
+        if entry is None:
+            return None
+
+        if isinstance(entry, int):
+            return entry
+
+        try:
+            if not entry.is_file():
+                return None
+
+            size = entry.stat().st_size
+
+        except FileNotFoundError:
+            del entries[name]
+            return None
+
+        # Remember the size so later lookups don't stat the file again.
+        entries[name] = size
+
+        return size
+
+    def open(self, output, name, header=None, length=None):
+        """
+        Opens a file for writing a download to.
+
+        Args:
+            output (str): absolute folder path to write to.
+            name (str): filename with extension to write to.
+            header (bytes): ignored as files are tagged in place.
+            length (number): expected length of the download in bytes. The
+                file is preallocated to this length if given.
+
+        Returns:
+            Writable binary file object.
+        """
+
+        f = FileWriter(os.path.join(output, name), self.buffer_size, length)
+
+        self.update(output, name)
+
+        if self.background:
+            return BackgroundWriter(f, self.buffer_size)
+
+        return f
+
+    def update(self, output, name):
+        """
+        Marks a file as changed so its size is looked up again when needed.
+
+        Args:
+            output (str): absolute folder path of the file.
+            name (str): filename with extension.
+        """
+
+        entries = self.listing(output)
+
+        # Fall back to a directory entry like object for the new file.
+        entries[name] = IndexEntry(os.path.join(output, name))
+
+    def remove(self, output, name):
+        """
+        Removes a partially written file.
+
+        Args:
+            output (str): absolute folder path of the file.
+            name (str): filename with extension.
+        """
+
+        entries = self.listing(output)
+
+        if name in entries:
+            try:
+                os.remove(os.path.join(output, name))
+
+            except FileNotFoundError:
+                pass
+
+            del entries[name]
+
+
+class FileWriter:
+    """
+    Buffered file writer used by the file sink. Preallocates the file to its
+    expected length and cuts it to the written length once closed. The data
+    is written to a ".part" file next to the path which replaces the path
+    when the writer is closed and is removed if writing raised an error.
+
+    Args:
+        path (str): absolute path of the file to write.
+        buffer_size (number): size of the write buffer in bytes.
+        length (number): optional expected length of the file in bytes.
+    """
+
+    def __init__(self, path, buffer_size=1048576, length=None):
+        self.name = path
+        self.temp = path + ".part"
+        self.file = open(self.temp, "wb", buffering=buffer_size)
+
+        # Amount of bytes written to the file.
+        self.written = 0
+
+        self.length = length
+
+        # Guards the written counter between threads writing at offsets.
+        self.lock = threading.Lock()
+
+        fd = self.file.fileno()
+
+        if length:
+            try:
+                # Reserve the blocks up front so the file is laid out in one piece.
+                os.posix_fallocate(fd, 0, length)
+
+            except (AttributeError, OSError):
+                # Not supported by the platform or filesystem.
+                os.ftruncate(fd, length)
+
+        try:
+            # Let the kernel know that the file is written sequentially.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        except (AttributeError, OSError):
+            pass
+
+    def write(self, data):
+        self.file.write(data)
+        self.written += len(data)
+
+    def write_at(self, data, offset):
+        """
+        Writes data at an offset of the file without moving the file position.
+        Can be called from several threads at once.
+
+        Args:
+            data (bytes): data to write.
+            offset (number): position in the file to write the data at.
+        """
+
+        fd = self.file.fileno()
+
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+
+            with self.lock:
+                self.written += written
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.file.flush()
+
+        # Drop preallocated space which wasn't written to.
+        if self.length and self.written != self.length:
+            self.file.truncate(self.written)
+
+        self.file.close()
+
+        os.replace(self.temp, self.name)
+
+    def discard(self):
+        """
+        Closes the file and removes it without replacing the path.
+        """
+
+        if not self.file.closed:
+            self.file.close()
+
+        try:
+            os.remove(self.temp)
+
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self.close()
+
+        else:
+            self.discard()
+
+
+class BackgroundWriter:
+    """
+    Passes writes on to another writer from a background thread so the
+    network and the disk are busy at the same time. Data is collected in one
+    buffer while the thread writes out the other. Once both buffers are full
+    further writes wait for the thread, which bounds the memory used and
+    slows the network transfer down to the speed of the disk.
+
+    Args:
+        writer (FileWriter, StreamWriter): writer to pass the data on to.
+        buffer_size (number): amount of bytes collected before they are
+            handed to the thread.
+        buffers (number): amount of buffers to alternate between.
+    """
+
+    def __init__(self, writer, buffer_size=1048576, buffers=2):
+        self.writer = writer
+        self.name = getattr(writer, "name", None)
+        self.buffer_size = buffer_size
+
+        # Buffers which are ready to be filled and buffers waiting to be written.
+        self.free = queue.Queue()
+        self.full = queue.Queue()
+
+        for i in range(buffers):
+            self.free.put(bytearray())
+
+        self.buffer = self.free.get()
+
+        # Error raised by the thread. Raised again by the next call.
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def written(self):
+        return self.writer.written
+
+    def run(self):
+        while True:
+            buffer = self.full.get()
+
+            if buffer is None:
+                self.full.task_done()
+                return
+
+            try:
+                if self.error is None:
+                    self.writer.write(buffer)
+
+            except Exception as e:
+                self.error = e
+
+            # Reuse the buffer once its content is written.
+            buffer.clear()
+            self.free.put(buffer)
+            self.full.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def hand_off(self):
+        # Queue the current buffer and continue with a free one.
+        self.full.put(self.buffer)
+        self.buffer = self.free.get()
+
+    def write(self, data):
+        self.check()
+
+        self.buffer += data
+
+        if len(self.buffer) >= self.buffer_size:
+            self.hand_off()
+
+    def write_at(self, data, offset):
+        # Writes at offsets don't pass through the buffers.
+        self.flush()
+        self.writer.write_at(data, offset)
+
+    def flush(self):
+        if self.buffer:
+            self.hand_off()
+
+        # Wait for the thread to write out everything queued so far.
+        self.full.join()
+        self.check()
+
+        self.writer.flush()
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+
+        try:
+            if self.buffer:
+                self.hand_off()
+
+            self.full.put(None)
+            self.thread.join()
+
+        finally:
+            self.writer.close()
+
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self.close()
+            return
+
+        # Stop the thread and let the writer handle the error itself.
+        if self.thread.is_alive():
+            self.full.put(None)
+            self.thread.join()
+
+        self.writer.__exit__(*args)
+
+
+class IndexEntry:
+    """
+    Minimal stand-in for an os.DirEntry of a file written during the run.
+
+    Args:
+        path (str): absolute path of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+class StreamSink:
+    """
+    Output sink streaming downloads straight into a binary file-like object
+    such as stdout, a pipe or a socket without touching the disk. Multiple
+    downloads are written back to back. Tags are built in memory and written
+    ahead of each file's audio data, replacing any ID3v2 tag it came with.
+
+    Args:
+        stream (file): binary file-like object to write downloads to.
+        background (bool): if True the stream is written by a background
+            thread so a slow consumer doesn't stall the network transfer.
+    """
+
+    files = False
+    retryable = False
+    ranged = False
+
+    def __init__(self, stream, background=False):
+        self.stream = stream
+        self.background = background
+
+    def makedirs(self, path):
+        pass
+
+    def size(self, output, name):
+        return None
+
+    def open(self, output, name, header=None, length=None):
+        """
+        Starts writing a new download to the stream.
+
+        Args:
+            output (str): ignored as nothing is written to disk.
+            name (str): ignored as nothing is written to disk.
+            header (bytes): optional ID3 tag to write ahead of the data. The
+                data's own ID3v2 tag is skipped if a header is supplied.
+            length (number): ignored as the stream can't be preallocated.
+
+        Returns:
+            Writable object passing data on to the stream.
+        """
+
+        writer = StreamWriter(self.stream, header)
+
+        if self.background:
+            return BackgroundWriter(writer)
+
+        return writer
+
+    def remove(self, output, name):
+        pass
+
+
+class StreamWriter:
+    """
+    Writable object used by the stream sink for a single download. Writes the
+    supplied header first and drops the leading ID3v2 tag of the written data
+    if a header was given.
+
+    Args:
+        stream (file): binary file-like object to write to.
+        header (bytes): optional data to write ahead of everything else.
+    """
+
+    def __init__(self, stream, header=None):
+        self.stream = stream
+        self.header = header
+
+        # Leading bytes kept back until it is known if they start a tag.
+        self.pending = b""
+
+        # Amount of bytes of the data's own tag left to skip.
+        self.skip = 0
+
+        # Set once the data is passed on without further inspection.
+        self.passing = not header
+
+        # Amount of bytes of the data passed on to the stream. Neither the
+        # header nor a skipped tag are counted.
+        self.written = 0
+
+        if header:
+            self.stream.write(header)
+
+    def write(self, data):
+        if self.passing:
+            self.stream.write(data)
+            self.written += len(data)
+            return
+
+        if self.skip:
+            skipped = min(self.skip, len(data))
+            self.skip -= skipped
+            data = data[skipped:]
+
+            if not self.skip:
+                self.passing = True
+
+            if data:
+                self.write(data)
+
+            return
+
+        self.pending += data
+
+        # An ID3v2 header is ten bytes long.
+        if len(self.pending) < 10:
+            return
+
+        data, self.pending = self.pending, b""
+
+        if data[:3] == b"ID3":
+            # The tag size is stored as a syncsafe integer excluding the header.
+            size = 10 + (
+                (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 |
+                (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+            )
+
+            # Account for the optional footer.
+            if data[5] & 0x10:
+                size += 10
+
+            self.skip = size
+
+        else:
+            self.passing = True
+
+        self.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        # Pass on data too short to hold a tag header.
+        if self.pending:
+            self.stream.write(self.pending)
+            self.written += len(self.pending)
+            self.pending = b""
+
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,232 @@
+
+import os
+import shutil
+import hashlib
+
+# ioctl request cloning the extents of another file on Linux (FICLONE).
+FICLONE = 0x40049409
+
+
+def file_hash(path, chunk_size=1048576):
+    """
+    Calculates the SHA-256 hash of a file.
+
+    Args:
+        path (str): absolute path of the file to hash.
+        chunk_size (number): amount of bytes read at once.
+
+    Returns:
+        Hexadecimal digest of the file's content.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def clone(source, destination):
+    """
+    Copies a file sharing its blocks with the source where the filesystem
+    supports reflinks (such as Btrfs or XFS). Other filesystems receive a
+    regular copy.
+
+    Args:
+        source (str): absolute path of the file to copy.
+        destination (str): absolute path of the copy.
+
+    Returns:
+        True if a reflink was made. False if the file was copied.
+    """
+
+    try:
+        import fcntl
+
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+        return True
+
+    except (ImportError, OSError):
+        shutil.copyfile(source, destination)
+
+        return False
+
+
+def link(source, destination):
+    """
+    Hardlinks a file, falling back to a reflink or copy if the destination is
+    on another filesystem or links are not supported.
+
+    Args:
+        source (str): absolute path of the existing file.
+        destination (str): absolute path of the link.
+
+    Returns:
+        True if both paths share their data afterwards through a hardlink or
+        a reflink. False if the file was copied.
+    """
+
+    try:
+        os.link(source, destination)
+
+        return True
+
+    except OSError:
+        return clone(source, destination)
+
+
+def unshare(path):
+    """
+    Gives a hardlinked file its own copy of the data so it can be modified
+    without changing the other links. Files which aren't hardlinked, such as
+    the reflinks and copies placed for tagging, are left as they are.
+
+    Args:
+        path (str): absolute path of the file.
+    """
+
+    if os.stat(path).st_nlink < 2:
+        return
+
+    temp = "{}.{}.tmp".format(path, os.getpid())
+
+    clone(path, temp)
+    os.replace(temp, path)
+
+
+class ObjectStore:
+    """
+    Content addressed store of downloaded audio payloads. Every payload is
+    stored once under its SHA-256 hash and Bandcamp track IDs point at the
+    payload they were downloaded as. A track appearing on a single, an album
+    and a compilation is then downloaded once and placed into each release
+    folder from the store.
+
+    The store always keeps the untagged payload. Untagged files are
+    hardlinked to it so they take no additional space. Tagged files need
+    their own tags and are reflinked where the filesystem supports it (such
+    as Btrfs or XFS), which shares the audio data on disk. On filesystems
+    without reflinks tagged files are full copies: the store then saves the
+    repeated download, not disk space, and the payload takes its size once
+    in the store and once in every release folder. The store should be on
+    the same filesystem as the output folders.
+
+    Args:
+        path (str): folder of the store. Created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+        os.makedirs(os.path.join(self.path, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "ids"), exist_ok=True)
+
+        # Counters of payloads stored and of files placed from the store.
+        self.stored = 0
+        self.reused = 0
+
+        # Amount of payloads and files which had to be copied as neither a
+        # hardlink nor a reflink was possible.
+        self.copied = 0
+
+    def object_path(self, digest):
+        """
+        Returns the path of the payload with the given hash.
+        """
+
+        return os.path.join(self.path, "objects", digest[:2], digest + ".mp3")
+
+    def lookup(self, track_id):
+        """
+        Finds the stored payload of a track.
+
+        Args:
+            track_id (str): Bandcamp ID of the track.
+
+        Returns:
+            Absolute path of the payload or None if it isn't stored.
+        """
+
+        if not track_id:
+            return None
+
+        try:
+            with open(os.path.join(self.path, "ids", str(track_id))) as f:
+                digest = f.read().strip()
+
+        except FileNotFoundError:
+            return None
+
+        path = self.object_path(digest)
+
+        return path if os.path.isfile(path) else None
+
+    def add(self, track_id, path, linked=True):
+        """
+        Adds a downloaded untagged payload to the store. A payload which is
+        already stored under the same hash is kept and shared instead.
+
+        Args:
+            track_id (str): Bandcamp ID of the track. May be None in which
+                case the payload is stored without an ID pointing at it.
+            path (str): absolute path of the downloaded payload.
+            linked (bool): if True the file at the path is replaced with a
+                hardlink to the stored payload. Must be False if the file is
+                modified afterwards such as by tagging.
+
+        Returns:
+            Absolute path of the stored payload.
+        """
+
+        digest = file_hash(path)
+        stored = self.object_path(digest)
+
+        if not os.path.isfile(stored):
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+
+            # Place the payload under a temporary name first so other workers
+            # never see a partial object.
+            temp = "{}.{}.tmp".format(stored, os.getpid())
+
+            if not (link(path, temp) if linked else clone(path, temp)):
+                self.copied += 1
+
+            os.replace(temp, stored)
+
+            self.stored += 1
+
+        elif linked:
+            # Share the payload which was stored before.
+            self.place(stored, path, linked=True)
+
+        if track_id:
+            temp = os.path.join(self.path, "ids", "{}.{}.tmp".format(track_id, os.getpid()))
+
+            with open(temp, "w") as f:
+                f.write(digest)
+
+            os.replace(temp, os.path.join(self.path, "ids", str(track_id)))
+
+        return stored
+
+    def place(self, stored, path, linked=True):
+        """
+        Places a stored payload at a path, replacing any file already there.
+
+        Args:
+            stored (str): absolute path of the stored payload.
+            path (str): absolute path to place the payload at.
+            linked (bool): if True the payload is hardlinked. Otherwise it is
+                reflinked or copied so the file can be modified.
+        """
+
+        temp = "{}.{}.tmp".format(path, os.getpid())
+
+        if not (link(stored, temp) if linked else clone(stored, temp)):
+            self.copied += 1
+
+        os.replace(temp, path)
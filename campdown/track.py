@@ -1,12 +1,70 @@
 
-import html
-import json
+import io
 
 from .helpers import *
+from .sinks import FileSink
+from .parsing import parse_track, inline
+from .profiling import phase, span
 
-import requests
-from mutagen.id3 import ID3NoHeaderError
-from mutagen.id3 import ID3, TIT2, TALB, TPE1, TPE2, COMM, TDRC, TRCK
+
+def fill_tags(tags, title, artist, album=None, album_artist=None, index=None, date=None, url=None):
+    """
+    Fills an ID3 tag object with track information the way Campdown tags
+    every downloaded track.
+
+    Args:
+        tags (ID3): mutagen ID3 instance to fill.
+        title (str): track title. Split into artist and title if it contains
+            the artist as well.
+        artist (str): track artist.
+        album (str): optional album the track belongs to.
+        album_artist (str): optional album artist. Defaults to the artist.
+        index (str): optional index of the track in its album.
+        date (str): optional release date of the track.
+        url (str): optional Bandcamp URL the track was downloaded from.
+
+    Returns:
+        The filled ID3 instance.
+    """
+
+    from mutagen.id3 import TIT2, TALB, TPE1, TPE2, COMM, TDRC, TRCK
+
+    # Title and artist tags. Split the title if it contains the artist tag.
+    if " - " in title:
+        split_title = str(title).split(" - ", 1)
+
+        tags["TPE1"] = TPE1(encoding=3, text=str(split_title[0]))
+        tags["TIT2"] = TIT2(encoding=3, text=str(split_title[1]))
+
+    else:
+        tags["TIT2"] = TIT2(encoding=3, text=str(title))
+
+        tags["TPE1"] = TPE1(encoding=3, text=str(artist))
+
+    # Album tag. Make sure we have it.
+    if album:
+        tags["TALB"] = TALB(encoding=3, text=str(album))
+
+    # Track index tag.
+    if index:
+        tags["TRCK"] = TRCK(encoding=3, text=str(index))
+
+    # Track date.
+    if date:
+        tags["TDRC"] = TDRC(encoding=3, text=str(date))
+
+    # Album artist
+    tags["TPE2"] = TPE2(encoding=3, text=str(album_artist or artist))
+
+    if url:
+        # Retrieve the base page URL.
+        base_url = "{}//{}".format(str(url).split("/")[
+            0], str(url).split("/")[2])
+
+        # Add the Bandcamp base comment in the ID3 comment tag.
+        tags["COMM"] = COMM(encoding=3, lang='XXX', desc=u'', text=u'Visit {}'.format(base_url))
+
+    return tags
 
 
 class Track:
@@ -25,6 +83,7 @@ class Track:
         album (str): optionally the album this track belongs to.
         album_artist (str): album artist index
         index (str): optionally the index this track has in the album.
+        cover_url (str): optionally the URL of the album cover this track shares.
         verbose (bool): sets if status messages and general information
             should be printed. Errors are still printed regardless of this.
         silent (bool): sets if error messages should be hidden.
@@ -33,9 +92,19 @@ class Track:
         art_enabled (bool): if True the Bandcamp page'status artwork will be
             downloaded and saved alongside each of the found tracks.
         id3_enabled (bool): if True tracks downloaded will receive new ID3 tags.
+        sink (FileSink, StreamSink): output sink to write the track to.
+            Defaults to writing files to the output folder.
+        parser (Parser): parser used for the track page. Defaults to parsing
+            in the current process.
+        segments (number): amount of byte ranges large files are fetched in
+            parallel with.
+        segment_threshold (number): size in bytes from which files are
+            fetched in segments.
+        store (ObjectStore): optional store the audio payload is shared
+            through with other releases containing the same track.
     """
 
-    def __init__(self, url, output, request=None, album=None, album_artist=None, index=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=False, id3_enabled=True):
+    def __init__(self, url, output, request=None, album=None, album_artist=None, index=None, cover_url=None, verbose=False, silent=False, short=False, sleep=30, art_enabled=False, id3_enabled=True, sink=None, parser=None, segments=1, segment_threshold=33554432, store=None):
         # Requests and other information can optionally be filled to remove unneccessary
         # operations such as making a request to a URL that has already been fetched
         # by another component.
@@ -56,12 +125,25 @@ class Track:
         self.album_artist = album_artist
         self.index = index
 
+        # Cover of the album this track belongs to. Only used for reference as
+        # the album itself takes care of downloading its cover.
+        self.cover_url = cover_url
+
         # Information about the track fetched from Bandcamp in JSON format.
         self.info = None
 
         self.art_url = None
         self.mp3_url = None
 
+        # Bandcamp ID of the track. Used to find the payload in a store.
+        self.track_id = None
+
+        # Expected size of the audio file in bytes if it is known in advance.
+        self.size = None
+
+        # Fixed filename without extension. Built from the title if not set.
+        self.filename = None
+
         # Store the track request object for later reference.
         self.request = request
         self.content = None
@@ -83,6 +165,19 @@ class Track:
 
         self.id3_enabled = id3_enabled
 
+        # Output sink the track is written to.
+        self.sink = sink
+
+        # Parser used to parse the track page.
+        self.parser = parser or inline
+
+        # Large files are split into this many parallel ranged requests.
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+
+        # Content addressed store shared between releases.
+        self.store = store
+
     def prepare(self):
         """
         Prepares the track by gathering information. If no previous request was
@@ -92,6 +187,21 @@ class Track:
             True if preparation is successful. False if an error occurred.
         """
 
+        with span("prepare", url=self.url, album=self.album, index=self.index):
+            if not self.load():
+                return False
+
+            return self.apply(self.parser.run(parse_track, self.content))
+
+    def load(self):
+        """
+        Requests the track page if no request was supplied and decodes its
+        content. This is the first half of the prepare method.
+
+        Returns:
+            True if the page content is available. False if an error occurred.
+        """
+
         if not valid_url(self.url):  # Validate the URL
             print("The supplied URL is not a valid URL.")
             return False
@@ -111,54 +221,44 @@ class Track:
         # Get the content from the request and decode it correctly.
         self.content = self.request.content.decode('utf-8')
 
+        return True
+
+    def apply(self, info):
+        """
+        Fills the track with the information parsed from its page. Values
+        which were supplied beforehand are kept. This is the second half of
+        the prepare method.
+
+        Args:
+            info (dict): page information as returned by parse_track.
+
+        Returns:
+            True if preparation is successful. False if no MP3 was found.
+        """
+
         # Verify that this is a track page.
-        if not page_type(self.content) == "track":
+        if not info["type"] == "track":
             if not self.silent:
                 print("The supplied URL is not a track page.")
 
-        # Get the metadata for the track.
-        meta = html.unescape(string_between(self.content, '<meta name="title" content="', '">')).strip()
-
         # Get the title of the track.
         if not self.title:
-            self.title = meta.split(", by ", 1)[0]
+            self.title = info["title"]
 
         # Get the main artist of the track.
         if not self.artist:
-            if not self.artist:
-                self.artist = meta.split(", by ", 1)[1]
-
-            if self.artist == "Various Artists":
-                self.artist = ""
-
-            if not self.artist:
-                self.artist = html.unescape(string_between(string_between(
-                    self.content, "var BandData = {", "}"), 'name : "', '",'))
-
-            if not self.artist:
-                self.artist = html.unescape(string_between(string_between(
-                    self.content, "var BandData = {", "}"), 'name: "', '",'))
+            self.artist = info["artist"]
 
             if not self.artist:
                 print("\nFailed to prepare the band/artist title")
 
         # Add the album to which this single track might belong to.
         if not self.album:
-            try:
-                self.album = html.unescape(string_between(
-                    self.content, '<span itemprop="name">', "</span>"))
-
-            except IndexError:
-                self.album = ""
+            self.album = info["album"]
 
         # prepare the date this track was released on.
         if not self.date:
-            try:
-                self.date = html.unescape(string_between(
-                    self.content, '<meta itemprop="datePublished" content="', '">'))[0:4]
-
-            except IndexError:
-                self.date = ""
+            self.date = info["date"]
 
         # Make the track name safe for file writing.
         self.title = safe_filename(self.title)
@@ -166,45 +266,73 @@ class Track:
         self.album = safe_filename(self.album)
 
         # prepare the track art URL.
-        self.art_url = string_between(
-            self.content, '<a class="popupImage" href="', '">')
+        self.art_url = info["art_url"]
 
         # Get the Bandcamp track MP3 URL and save it.
-        raw_info = "{{{data}}}".format(data=html.unescape(string_between(
-            self.content, "data-tralbum=\"{", "}\"")).replace("'", "\"")
-        )
+        self.mp3_url = info["mp3_url"]
+
+        self.track_id = info.get("track_id")
 
-        info = json.loads(raw_info)
+        return self.mp3_url is not None
 
-        if "trackinfo" in info:
-            self.mp3_url = info["trackinfo"][0]["file"]["mp3-128"]
+    @classmethod
+    def from_record(cls, record, verbose=False, silent=False, sleep=30, id3_enabled=True):
+        """
+        Creates an already prepared track from a record as returned by the
+        record method. No requests are made to the track's Bandcamp page.
 
-            try:
-                # Add in http for those times when Bandcamp is rude.
-                if self.mp3_url[:2] == "//":
-                    self.mp3_url = "http:" + self.mp3_url
+        Args:
+            record (dict): track record to restore the track from.
+            verbose (bool): sets if status messages should be printed.
+            silent (bool): sets if error messages should be hidden.
+            sleep (number): timeout duration between failed requests in seconds.
+            id3_enabled (bool): if True the track will receive new ID3 tags.
 
-            except TypeError:
-                return False
+        Returns:
+            Track instance ready to be downloaded.
+        """
 
-            return True
+        track = cls(
+            record["url"],
+            os.path.join(os.path.dirname(record["path"]), ""),
+            album=record.get("album"),
+            album_artist=record.get("album_artist"),
+            index=record.get("index"),
+            cover_url=(record.get("art_url") if record.get("cover") else None),
+            verbose=verbose,
+            silent=silent,
+            sleep=sleep,
+            art_enabled=bool(record.get("art_path")) and not record.get("cover"),
+            id3_enabled=id3_enabled
+        )
 
-        else:
-            return False
+        track.title = record.get("title")
+        track.artist = record.get("artist")
+        track.date = record.get("date")
+        track.mp3_url = record.get("mp3_url")
+        track.track_id = record.get("track_id")
+        track.size = record.get("size")
+        track.art_url = record.get("art_url")
+
+        # Keep the exact filename the record was planned with.
+        track.filename = os.path.splitext(os.path.basename(record["path"]))[0]
+
+        return track
 
-    def download(self):
+    def clean_title(self):
         """
-        Starts the download process for this track. Also writes the file and
-        applies ID3 tags if specified. Requires the track to have been prepared
-        by the prepare method beforehand.
+        Builds the formatted title used as the filename of this track. Requires
+        the track to have been prepared by the prepare method beforehand.
+
+        Returns:
+            Formatted title string without a file extension.
         """
 
-        if not self.album:
-            safe_print('\nWriting file to {}'.format(self.output))
+        if self.filename:
+            return self.filename
 
-        # Clean up the main title.
         if not self.short:
-            clean_title = format_information(
+            return format_information(
                 self.title,
                 self.artist,
                 self.album,
@@ -212,21 +340,183 @@ class Track:
             )
 
         else:
-            clean_title = short_information(
+            return short_information(
                 self.title,
                 self.index
             )
 
-        # Download the file.
-        status = download_file(
-            self.mp3_url,
-            self.output,
-            clean_title + ".mp3",
-            verbose=self.verbose,
-            silent=self.silent,
-            sleep=self.sleep
+    def record(self):
+        """
+        Describes the prepared track as a plain dictionary without downloading
+        anything. Used to emit download plans. Requires the track to have been
+        prepared by the prepare method beforehand.
+
+        Returns:
+            Dictionary containing the track's metadata, URLs and target paths.
+        """
+
+        clean_title = self.clean_title()
+
+        # Album tracks share the album cover instead of their own artwork.
+        if self.cover_url:
+            art_url = self.cover_url
+            art_path = os.path.join(self.output, "cover" + self.cover_url[-4:])
+
+        elif self.art_enabled and self.art_url:
+            art_url = self.art_url
+            art_path = os.path.join(self.output, clean_title + self.art_url[-4:])
+
+        else:
+            art_url = None
+            art_path = None
+
+        return {
+            "url": self.url,
+            "artist": self.artist,
+            "album": self.album,
+            "album_artist": self.album_artist or self.artist,
+            "index": self.index,
+            "title": self.title,
+            "date": self.date,
+            "mp3_url": self.mp3_url,
+            "track_id": self.track_id,
+            "art_url": art_url,
+            "path": os.path.join(self.output, safe_filename(clean_title + ".mp3")),
+            "art_path": art_path,
+            "cover": bool(self.cover_url)
+        }
+
+    def place(self, stored, sink):
+        """
+        Places the track's payload from the store instead of downloading it.
+
+        Args:
+            stored (str): absolute path of the stored payload.
+            sink (FileSink): sink the track is written to.
+
+        Returns:
+            1 if the payload was placed and 2 if the file already exists.
+        """
+
+        name = safe_filename(self.clean_title() + ".mp3")
+
+        local_length = sink.size(self.output, name)
+
+        if local_length is not None and calculate_confidence(local_length, os.path.getsize(stored), 0.01) >= 0:
+            if self.verbose:
+                print("\nFile already found. Skipping download.")
+
+            return 2
+
+        self.store.place(stored, os.path.join(self.output, name), linked=not self.id3_enabled)
+        self.store.reused += 1
+
+        sink.update(self.output, name)
+
+        if self.verbose:
+            safe_print("\nPlaced {} from the store.".format(name))
+
+        return 1
+
+    def fill_tags(self, tags):
+        """
+        Fills an ID3 tag object with the information of this track.
+
+        Args:
+            tags (ID3): mutagen ID3 instance to fill.
+
+        Returns:
+            The filled ID3 instance.
+        """
+
+        return fill_tags(
+            tags,
+            self.title,
+            self.artist,
+            album=self.album,
+            album_artist=self.album_artist,
+            index=self.index,
+            date=self.date,
+            url=self.url
         )
 
+    def tag_header(self):
+        """
+        Builds the ID3 tag of this track in memory so it can be written ahead
+        of the track's data without the file having to exist on disk.
+
+        Returns:
+            Bytes of the complete ID3v2 tag.
+        """
+
+        from mutagen.id3 import ID3
+
+        tags = self.fill_tags(ID3())
+
+        # Write the tag without padding as it can't be edited in place anyway.
+        data = io.BytesIO()
+        tags.save(data, padding=lambda info: 0)
+
+        return data.getvalue()
+
+    def download(self, deadline=None, art=True):
+        """
+        Starts the download process for this track. Also writes the file and
+        applies ID3 tags if specified. Requires the track to have been prepared
+        by the prepare method beforehand.
+
+        Args:
+            deadline (Deadline): optional deadline the track's files have to
+                be downloaded by.
+            art (bool): if False the track's artwork is left to be downloaded
+                separately with download_art.
+
+        Returns:
+            The download_file status of the track's audio file.
+        """
+
+        sink = self.sink or FileSink()
+
+        if not self.album and sink.files:
+            safe_print('\nWriting file to {}'.format(self.output))
+
+        # Make sure the output folder exists before writing to it.
+        sink.makedirs(self.output)
+
+        # Clean up the main title.
+        clean_title = self.clean_title()
+
+        # Sinks which don't write files receive the tags ahead of the data.
+        header = None
+
+        if self.id3_enabled and not sink.files:
+            with phase("tagging", album=self.album, track=self.title):
+                header = self.tag_header()
+
+        # Payloads can only be shared between releases written as files.
+        store = self.store if sink.files else None
+        stored = store.lookup(self.track_id) if store else None
+
+        with phase("transfer", url=self.mp3_url, album=self.album, track=self.title, stored=bool(stored)):
+            if stored:
+                status = self.place(stored, sink)
+
+            else:
+                # Download the file.
+                status = download_file(
+                    self.mp3_url,
+                    self.output,
+                    clean_title + ".mp3",
+                    verbose=self.verbose,
+                    silent=self.silent,
+                    sleep=self.sleep,
+                    sink=sink,
+                    header=header,
+                    segments=self.segments,
+                    segment_threshold=self.segment_threshold,
+                    deadline=deadline
+                )
+
         # Abort further processes if we receive an error status code.
         if not status or status > 2:
             if not self.silent:
@@ -234,68 +524,80 @@ class Track:
 
             return status
 
-        # Write ID3 tags if the id3_enabled is true.
-        if self.id3_enabled:
-            # Fix ID3 tags. Create ID3 tags if not present.
-            try:
-                tags = ID3(os.path.join(self.output, safe_filename(clean_title + ".mp3")))
+        if store and status == 1 and not stored:
+            # Untagged files share the stored payload. Tagged files keep their own.
+            store.add(self.track_id, os.path.join(self.output, safe_filename(clean_title + ".mp3")),
+                      linked=not self.id3_enabled)
 
-            except ID3NoHeaderError:
-                tags = ID3()
+        # Write ID3 tags to the written file if the id3_enabled is true.
+        if self.id3_enabled and sink.files:
+            with phase("tagging", album=self.album, track=self.title):
+                if store:
+                    from .store import unshare
 
-            # Title and artist tags. Split the title if it contains the artist tag.
-            if " - " in self.title:
-                split_title = str(self.title).split(" - ", 1)
+                    # Never tag a payload which is hardlinked to the store,
+                    # such as a file placed by an earlier untagged run.
+                    unshare(os.path.join(self.output, safe_filename(clean_title + ".mp3")))
 
-                tags["TPE1"] = TPE1(encoding=3, text=str(split_title[0]))
-                tags["TIT2"] = TIT2(encoding=3, text=str(split_title[1]))
+                # Mutagen is only imported once tagging is actually required.
+                from mutagen.id3 import ID3, ID3NoHeaderError
 
-            else:
-                tags["TIT2"] = TIT2(encoding=3, text=str(self.title))
+                # Fix ID3 tags. Create ID3 tags if not present.
+                try:
+                    tags = ID3(os.path.join(self.output, safe_filename(clean_title + ".mp3")))
+
+                except ID3NoHeaderError:
+                    tags = ID3()
+
+                self.fill_tags(tags)
+
+                # Save all tags to the track.
+                tags.save(os.path.join(self.output, safe_filename(clean_title + ".mp3")))
 
-                tags["TPE1"] = TPE1(encoding=3, text=str(self.artist))
+                # The tags changed the size of the file.
+                sink.update(self.output, safe_filename(clean_title + ".mp3"))
 
-            # Album tag. Make sure we have it.
-            if self.album:
-                tags["TALB"] = TALB(encoding=3, text=str(self.album))
+        if art:
+            self.download_art(deadline)
 
-            # Track index tag.
-            if self.index:
-                tags["TRCK"] = TRCK(encoding=3, text=str(self.index))
+        return status
 
-            # Track date.
-            if self.date:
-                tags["TDRC"] = TDRC(encoding=3, text=str(self.date))
+    def download_art(self, deadline=None):
+        """
+        Downloads the artwork of this track next to its audio file if artwork
+        is enabled and the track is written as a file.
+
+        Args:
+            deadline (Deadline): optional deadline the artwork has to be
+                downloaded by.
 
-            # Album artist
-            if not self.album_artist:
-                self.album_artist = self.artist
+        Returns:
+            The download_file status of the artwork or None if no artwork is
+            downloaded for this track.
+        """
 
-            tags["TPE2"] = TPE2(encoding=3, text=str(self.album_artist))
+        sink = self.sink or FileSink()
 
-            # Retrieve the base page URL.
-            base_url = "{}//{}".format(str(self.url).split("/")[
-                0], str(self.url).split("/")[2])
+        # Download artwork if it is enabled and can be placed next to the track.
+        if not (self.art_enabled and sink.files):
+            return None
 
-            # Add the Bandcamp base comment in the ID3 comment tag.
-            tags["COMM"] = COMM(encoding=3, lang='XXX', desc=u'', text=u'Visit {}'.format(base_url))
+        clean_title = self.clean_title()
 
-            # Save all tags to the track.
-            tags.save(os.path.join(self.output, safe_filename(clean_title + ".mp3")))
+        with phase("art", url=self.art_url, album=self.album, track=self.title):
+            art_status = download_file(self.art_url, self.output,
+                                       clean_title + self.art_url[-4:], sink=sink, deadline=deadline)
 
-        # Download artwork if it is enabled.
-        if self.art_enabled:
-            status = download_file(self.art_url, self.output,
-                                   clean_title + self.art_url[-4:])
+        if art_status == 1:
+            if self.verbose:
+                safe_print('\nSaved track art to {}{}{}'.format(
+                    self.output, clean_title, self.art_url[-4:]))
 
-            if status == 1:
-                if self.verbose:
-                    safe_print('\nSaved track art to {}{}{}'.format(
-                        self.output, clean_title, self.art_url[-4:]))
+        elif art_status == 2:
+            if self.verbose:
+                print('\nArtwork already found.')
 
-            elif status == 2:
-                if self.verbose:
-                    print('\nArtwork already found.')
+        elif not self.silent:
+            print('\nFailed to download the artwork. Error code {}'.format(art_status))
 
-            elif not self.silent:
-                print('\nFailed to download the artwork. Error code {}'.format(status))
+        return art_status
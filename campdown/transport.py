@@ -0,0 +1,694 @@
+
+import time
+import threading
+import collections
+
+# Headers sent along with every request made by Campdown.
+HEADERS = {
+    "User-Agent": "campdown/1.48 (+https://github.com/catlinman/campdown)",
+    "Accept-Encoding": ", ".join(("gzip", "deflate")),
+    "Accept": "*/*",
+    "Connection": "keep-alive",
+}
+
+# Default connect and read timeout of requests in seconds.
+TIMEOUT = (10, 30)
+
+
+class RequestsTransport:
+    """
+    Default transport of Campdown based on requests. Uses a single session so
+    connections to the same host are kept alive and reused between requests.
+    Requests are made over HTTP/1.1 with one request in flight per connection.
+
+    Args:
+        timeout (number, tuple): timeout in seconds or a tuple of the connect
+            and read timeout used by requests which don't supply their own.
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        import requests
+
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+
+        # Exceptions raised when a connection failed or timed out.
+        self.errors = (
+            requests.exceptions.ConnectTimeout,
+            requests.exceptions.ReadTimeout,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.StreamConsumedError
+        )
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        """
+        Makes a GET request.
+
+        Args:
+            url (str): URL to make the request to.
+            stream (bool): if True the body is only read when iterated.
+            timeout (number, tuple): timeout in seconds or a tuple of the
+                connect and read timeout. Defaults to the transport timeout.
+            headers (dict): optional additional request headers.
+
+        Returns:
+            Response with status_code, headers, content and iter_content.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return self.session.get(url, stream=stream, timeout=timeout, headers=headers)
+
+    def head(self, url, timeout=None, headers=None):
+        """
+        Makes a HEAD request following redirects.
+
+        Args:
+            url (str): URL to make the request to.
+            timeout (number, tuple): timeout in seconds or a tuple of the
+                connect and read timeout. Defaults to the transport timeout.
+            headers (dict): optional additional request headers.
+
+        Returns:
+            Response with status_code and headers.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return self.session.head(url, timeout=timeout, headers=headers, allow_redirects=True)
+
+    def close(self):
+        self.session.close()
+
+
+class HTTP2Transport:
+    """
+    Optional transport based on httpx which negotiates HTTP/2 where servers
+    support it. Many small page and artwork requests to the same host are
+    then multiplexed over one connection. Requires the "http2" extra which
+    installs httpx and h2.
+
+    Args:
+        http1 (bool): if False HTTP/2 is used with prior knowledge, even for
+            plain http URLs. Mostly useful for local stand-in servers.
+        timeout (number, tuple): timeout in seconds or a tuple of the connect
+            and read timeout used by requests which don't supply their own.
+    """
+
+    def __init__(self, http1=True, timeout=TIMEOUT):
+        import httpx
+
+        self.timeout = timeout
+
+        self.client = httpx.Client(
+            http1=http1,
+            http2=True,
+            headers=HEADERS,
+            follow_redirects=True,
+            timeout=None,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=20)
+        )
+
+        self.errors = (httpx.TransportError, httpx.StreamError)
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        request = self.client.build_request("GET", url, headers=headers, timeout=self.convert(timeout))
+
+        return HTTP2Response(self.client.send(request, stream=stream))
+
+    def head(self, url, timeout=None, headers=None):
+        return HTTP2Response(self.client.head(url, headers=headers, timeout=self.convert(timeout)))
+
+    def convert(self, timeout):
+        """
+        Converts a requests style timeout into a httpx timeout.
+
+        Args:
+            timeout (number, tuple): timeout in seconds or a tuple of the
+                connect and read timeout. Defaults to the transport timeout.
+
+        Returns:
+            httpx.Timeout instance.
+        """
+
+        import httpx
+
+        if timeout is None:
+            timeout = self.timeout
+
+        if isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+
+        return httpx.Timeout(timeout)
+
+    def close(self):
+        self.client.close()
+
+
+class HTTP2Response:
+    """
+    Wraps a httpx response so it can be used like a requests response.
+
+    Args:
+        response (httpx.Response): response to wrap.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def content(self):
+        return self.response.read()
+
+    def iter_content(self, chunk_size=65536):
+        return self.response.iter_bytes(chunk_size=chunk_size)
+
+    def close(self):
+        self.response.close()
+
+
+class FailedResponse:
+    """
+    Stand-in response for a request which could not be completed because the
+    connection failed or timed out. Its status code of 0 is treated like any
+    other error status by the callers.
+
+    Args:
+        url (str): URL of the failed request.
+        error (Exception): error raised by the transport.
+    """
+
+    status_code = 0
+
+    def __init__(self, url, error):
+        self.url = url
+        self.error = error
+        self.headers = {}
+        self.content = b""
+
+    def iter_content(self, chunk_size=65536):
+        return iter(())
+
+    def close(self):
+        pass
+
+
+class HedgingTransport:
+    """
+    Wraps another transport and hedges page requests. If a page hasn't
+    arrived within the 95th percentile of the recently observed page
+    latencies a second identical request is made and whichever response
+    arrives first is used. A few slow responses then no longer dominate the
+    resolution of long discographies. Streamed downloads are passed on as
+    they are since they aren't worth duplicating.
+
+    Args:
+        transport (RequestsTransport, HTTP2Transport): transport to wrap.
+        max_ratio (number): share of page requests which may be hedged at
+            most. Caps the extra load put on the servers.
+        delay (number): seconds to wait before hedging while too few
+            latencies have been observed to estimate the percentile.
+        samples (number): amount of recent latencies the percentile is
+            estimated from.
+    """
+
+    def __init__(self, transport, max_ratio=0.1, delay=1.0, samples=200):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.transport = transport
+        self.max_ratio = max_ratio
+        self.delay = delay
+
+        self.errors = transport.errors
+        self.timeout = transport.timeout
+
+        # Latencies of recent page requests in seconds.
+        self.latencies = collections.deque(maxlen=samples)
+
+        # Counters of page requests, hedges made and hedges which won.
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+    def threshold(self):
+        """
+        Returns the seconds after which a page request is hedged.
+        """
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+        if len(latencies) < 20:
+            return self.delay
+
+        return latencies[int(len(latencies) * 0.95)]
+
+    def fetch(self, url, timeout, headers):
+        # Runs a single page request and measures its latency.
+        start = time.monotonic()
+        response = self.transport.get(url, timeout=timeout, headers=headers)
+
+        with self.lock:
+            self.latencies.append(time.monotonic() - start)
+
+        return response
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        if stream:
+            return self.transport.get(url, stream=stream, timeout=timeout, headers=headers)
+
+        with self.lock:
+            self.requests += 1
+
+        first = self.pool.submit(self.fetch, url, timeout, headers)
+
+        if wait([first], timeout=self.threshold()).done:
+            return first.result()
+
+        with self.lock:
+            # Keep the share of hedged requests below the cap.
+            allowed = self.hedged + 1 <= self.max_ratio * self.requests
+
+            if allowed:
+                self.hedged += 1
+
+        if not allowed:
+            return first.result()
+
+        second = self.pool.submit(self.fetch, url, timeout, headers)
+        pending = {first, second}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is not None:
+                    continue
+
+                if future is second:
+                    with self.lock:
+                        self.won += 1
+
+                # Release the connection of the slower request once it arrives.
+                for other in pending:
+                    other.add_done_callback(release)
+
+                return future.result()
+
+        # Both requests failed. Raise the error of the original request.
+        return first.result()
+
+    def head(self, url, timeout=None, headers=None):
+        return self.transport.head(url, timeout=timeout, headers=headers)
+
+    def stats(self):
+        """
+        Returns the counters of the hedged page requests.
+
+        Returns:
+            Dictionary of the amount of page requests, hedges made and hedges
+            which arrived before the original request.
+        """
+
+        with self.lock:
+            return {"requests": self.requests, "hedged": self.hedged, "won": self.won}
+
+    def close(self):
+        self.pool.shutdown()
+        self.transport.close()
+
+
+class AdaptiveTransport:
+    """
+    Wraps another transport and adapts the amount of concurrent media
+    transfers to what the server currently handles well. Streamed requests
+    wait for one of a limited amount of transfers to become free. The limit
+    is raised by one transfer whenever the aggregate throughput of a fully
+    used measurement interval improved and halved whenever the server
+    throttles (429 or 503), a request times out or fails, or a transfer ends
+    short of its length which makes download_file retry it. Page requests
+    are passed on as they are.
+
+    Args:
+        transport (RequestsTransport, HTTP2Transport): transport to wrap.
+        maximum (number): upper bound of concurrent transfers. Usually the
+            amount of download slots.
+        minimum (number): lower bound of concurrent transfers. Also the
+            limit a run starts with.
+        interval (number): seconds the throughput is measured over before
+            each decision.
+        gain (number): relative improvement of the throughput over the last
+            increase needed to raise the limit again.
+        probe (number): amount of intervals without improvement after which
+            the limit is raised anyway to find out if conditions changed.
+    """
+
+    def __init__(self, transport, maximum, minimum=1, interval=2.0, gain=0.05, probe=5):
+        self.transport = transport
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.interval = interval
+        self.gain = gain
+        self.probe = probe
+
+        self.errors = transport.errors
+        self.timeout = transport.timeout
+
+        # Current limit and amount of transfers in progress.
+        self.limit = minimum
+        self.active = 0
+
+        # Bytes received in the current interval and if all transfers were
+        # in use at some point of it.
+        self.received = 0
+        self.saturated = False
+        self.window = time.monotonic()
+
+        # Throughput measured after the last increase and the amount of
+        # intervals which didn't improve on it.
+        self.reference = None
+        self.held = 0
+
+        # Time of the last decrease. Signals arriving within an interval of
+        # it belong to the same congestion.
+        self.backed_off = None
+
+        # Counters of the transfers, the decisions and of the congestion
+        # signals by reason.
+        self.transfers = 0
+        self.increases = 0
+        self.decreases = 0
+        self.signals = collections.Counter()
+
+        # Decisions as tuples of the seconds into the run, the previous and
+        # the new limit and the reason.
+        self.decisions = []
+        self.started = time.monotonic()
+
+        # Guards the state and wakes up requests waiting for a transfer.
+        self.condition = threading.Condition()
+
+    def decide(self, limit, reason):
+        # Changes the limit and records the decision. Requires the lock.
+        self.decisions.append((time.monotonic() - self.started, self.limit, limit, reason))
+        self.limit = limit
+
+        self.condition.notify_all()
+
+    def evaluate(self):
+        # Raises the limit at the end of an interval if the throughput
+        # improved. Requires the lock.
+        now = time.monotonic()
+        elapsed = now - self.window
+
+        if elapsed < self.interval:
+            return
+
+        throughput = self.received / elapsed
+        saturated = self.saturated
+
+        self.received = 0
+        self.saturated = False
+        self.window = now
+
+        # Idle transfers show that more of them wouldn't help.
+        if not saturated or self.limit >= self.maximum:
+            return
+
+        if self.reference is None or throughput >= self.reference * (1 + self.gain) or self.held >= self.probe:
+            self.decide(self.limit + 1, "throughput {:.1f} MB/s".format(throughput / 1048576))
+
+            self.reference = throughput
+            self.held = 0
+            self.increases += 1
+
+        else:
+            self.held += 1
+
+    def acquire(self):
+        """
+        Waits until a transfer is free and takes it.
+        """
+
+        with self.condition:
+            while self.active >= self.limit:
+                self.saturated = True
+
+                self.condition.wait(self.interval)
+                self.evaluate()
+
+            self.active += 1
+            self.transfers += 1
+
+            if self.active >= self.limit:
+                self.saturated = True
+
+            self.evaluate()
+
+    def release(self):
+        """
+        Frees a transfer once its response was read or closed.
+        """
+
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def count(self, amount):
+        """
+        Counts received bytes towards the throughput of the current interval.
+
+        Args:
+            amount (number): amount of bytes received.
+        """
+
+        with self.condition:
+            self.received += amount
+            self.evaluate()
+
+    def congestion(self, reason):
+        """
+        Halves the limit after the server throttled or a transfer failed.
+
+        Args:
+            reason (str): "throttled", "timeout" or "incomplete".
+        """
+
+        with self.condition:
+            self.signals[reason] += 1
+
+            now = time.monotonic()
+
+            if self.backed_off is not None and now - self.backed_off < self.interval:
+                return
+
+            self.backed_off = now
+
+            if self.limit > self.minimum:
+                self.decide(max(self.minimum, self.limit // 2), reason)
+                self.decreases += 1
+
+            # Start measuring anew at the lower limit.
+            self.received = 0
+            self.saturated = False
+            self.window = now
+            self.reference = None
+            self.held = 0
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        if not stream:
+            return self.transport.get(url, stream=stream, timeout=timeout, headers=headers)
+
+        self.acquire()
+
+        try:
+            response = self.transport.get(url, stream=stream, timeout=timeout, headers=headers)
+
+        except self.errors:
+            self.release()
+            self.congestion("timeout")
+
+            raise
+
+        except BaseException:
+            self.release()
+
+            raise
+
+        if response.status_code in (429, 503):
+            self.congestion("throttled")
+
+        return AdaptiveResponse(self, response)
+
+    def head(self, url, timeout=None, headers=None):
+        return self.transport.head(url, timeout=timeout, headers=headers)
+
+    def stats(self):
+        """
+        Returns the limit and the decisions made so far.
+
+        Returns:
+            Dictionary of the current, lowest and highest limit, the amount
+            of transfers, increases and decreases, the congestion signals by
+            reason and the list of decisions.
+        """
+
+        with self.condition:
+            return {
+                "transfers": self.transfers,
+                "limit": self.limit,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "signals": dict(self.signals),
+                "decisions": list(self.decisions)
+            }
+
+    def close(self):
+        self.transport.close()
+
+
+class AdaptiveResponse:
+    """
+    Streamed response holding one of the transfers of an adaptive transport
+    until it is read entirely or closed.
+
+    Args:
+        adaptive (AdaptiveTransport): transport the transfer was taken from.
+        response (Response): response to wrap.
+    """
+
+    def __init__(self, adaptive, response):
+        self.adaptive = adaptive
+        self.response = response
+
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = getattr(response, "url", None)
+
+        self.released = False
+
+    def release(self):
+        # Frees the transfer once.
+        if not self.released:
+            self.released = True
+            self.adaptive.release()
+
+    @property
+    def content(self):
+        try:
+            return self.response.content
+
+        finally:
+            self.release()
+
+    def iter_content(self, chunk_size=65536):
+        received = 0
+
+        try:
+            for chunk in self.response.iter_content(chunk_size=chunk_size):
+                received += len(chunk)
+                self.adaptive.count(len(chunk))
+
+                yield chunk
+
+        except self.adaptive.errors:
+            self.adaptive.congestion("timeout")
+
+            raise
+
+        finally:
+            # Transfers abandoned by the reader free their slot as well.
+            self.release()
+
+        length = self.headers.get("content-length")
+
+        # Bodies ending early are fetched again by download_file.
+        if length and not self.headers.get("content-encoding") and received < int(length):
+            self.adaptive.congestion("incomplete")
+
+    def close(self):
+        self.release()
+        self.response.close()
+
+
+def release(future):
+    # Closes the response of a request which lost against its hedge.
+    if future.exception() is None:
+        future.result().close()
+
+
+def http2_available():
+    """
+    Checks if the optional HTTP/2 dependencies are installed.
+
+    Returns:
+        True if the HTTP/2 transport can be used.
+    """
+
+    try:
+        import httpx
+        import h2
+
+    except ImportError:
+        return False
+
+    return True
+
+
+# Transport used by all requests. Created when it is first needed.
+transport = None
+transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the transport used for all requests, creating the default
+    requests based transport if none was set.
+
+    Returns:
+        The current transport.
+    """
+
+    global transport
+
+    if transport is None:
+        with transport_lock:
+            if transport is None:
+                transport = RequestsTransport()
+
+    return transport
+
+
+def set_transport(new_transport):
+    """
+    Replaces the transport used for all requests.
+
+    Args:
+        new_transport (RequestsTransport, HTTP2Transport): transport to use.
+            None restores the default transport.
+
+    Returns:
+        The previous transport.
+    """
+
+    global transport
+
+    with transport_lock:
+        previous, transport = transport, new_transport
+
+    return previous
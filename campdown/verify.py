@@ -0,0 +1,260 @@
+
+import os
+import mmap
+
+# Bitrates in kbit/s by MPEG version group and layer. Index 0 is the free
+# format which can't be walked and index 15 is invalid.
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates in Hz by the version bits of the frame header.
+SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG 1
+    2: (22050, 24000, 16000),  # MPEG 2
+    0: (11025, 12000, 8000),  # MPEG 2.5
+}
+
+
+def frame_lengths():
+    """
+    Builds a table of MPEG audio frame lengths indexed by the second and
+    third byte of a frame header. Looking lengths up in the table keeps the
+    frame walk cheap enough to scan large libraries.
+
+    Returns:
+        List of 65536 frame lengths in bytes. Invalid headers have length 0.
+    """
+
+    table = [0] * 65536
+
+    for second in range(0xe0, 0x100):
+        version = (second >> 3) & 3
+        layer = 4 - ((second >> 1) & 3)
+
+        # Version 1 is reserved and layer bits 00 are reserved.
+        if version == 1 or layer == 4:
+            continue
+
+        bitrates = BITRATES[(1 if version == 3 else 2, layer)]
+
+        for third in range(256):
+            bitrate_index = third >> 4
+            rate_index = (third >> 2) & 3
+            padding = (third >> 1) & 1
+
+            if bitrate_index in (0, 15) or rate_index == 3:
+                continue
+
+            bitrate = bitrates[bitrate_index] * 1000
+            rate = SAMPLE_RATES[version][rate_index]
+
+            if layer == 1:
+                length = (12 * bitrate // rate + padding) * 4
+
+            elif layer == 3 and version != 3:
+                length = 72 * bitrate // rate + padding
+
+            else:
+                length = 144 * bitrate // rate + padding
+
+            table[second << 8 | third] = length
+
+    return table
+
+
+LENGTHS = frame_lengths()
+
+
+def id3_size(data):
+    """
+    Returns the length of the ID3v2 tag at the start of the data including
+    its header and optional footer. 0 if the data doesn't start with a tag.
+    """
+
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+
+    # The tag size is stored as a syncsafe integer excluding the header.
+    size = 10 + (
+        (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 |
+        (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+    )
+
+    # Account for the optional footer.
+    if data[5] & 0x10:
+        size += 10
+
+    return size
+
+
+def trailer(data, position):
+    """
+    Checks if the data following the last frame is a known trailing tag.
+
+    Args:
+        data (mmap): content of the file.
+        position (number): offset following the last frame.
+
+    Returns:
+        True if the rest of the file is an ID3v1, APE or Lyrics3 tag.
+    """
+
+    remaining = len(data) - position
+
+    if remaining == 128 and data[position:position + 3] == b"TAG":
+        return True
+
+    return data[position:position + 8] == b"APETAGEX" or data[position:position + 11] == b"LYRICSBEGIN"
+
+
+def scan(path):
+    """
+    Walks the MPEG frames of an MP3 file to detect truncation or corruption.
+    The file is memory mapped so only the frame headers are read from disk.
+
+    Args:
+        path (str): absolute path of the file to scan.
+
+    Returns:
+        Tuple of the path and a description of the problem found or None if
+        the file is intact.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+
+            if not size:
+                return path, "empty file"
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return path, walk(data, size)
+
+    except (OSError, ValueError) as e:
+        return path, "unreadable: {}".format(e)
+
+
+def walk(data, size):
+    """
+    Walks the frames of memory mapped MP3 data.
+
+    Args:
+        data (mmap): content of the file.
+        size (number): length of the content in bytes.
+
+    Returns:
+        Description of the problem found or None if the data is intact.
+    """
+
+    position = id3_size(data[:10])
+
+    if position > size:
+        return "truncated inside the ID3 tag"
+
+    # Tolerate padding between the tag and the first frame but require two
+    # consecutive frames to rule out false syncs.
+    start = data.find(b"\xff", position, position + 65536)
+
+    while start != -1:
+        length = LENGTHS[data[start + 1] << 8 | data[start + 2]] if start + 3 < size else 0
+
+        if length and (start + length == size or (
+                start + length + 3 < size and data[start + length] == 0xff and
+                LENGTHS[data[start + length + 1] << 8 | data[start + length + 2]])):
+            break
+
+        start = data.find(b"\xff", start + 1, position + 65536)
+
+    if start == -1:
+        return "no MPEG frames found"
+
+    position = start
+    frames = 0
+    lengths = LENGTHS
+
+    while position + 4 <= size:
+        if data[position] != 0xff:
+            break
+
+        length = lengths[data[position + 1] << 8 | data[position + 2]]
+
+        if not length:
+            break
+
+        if position + length > size:
+            return "truncated in frame {} at byte {}".format(frames + 1, position)
+
+        position += length
+        frames += 1
+
+    if position == size or trailer(data, position):
+        return None
+
+    if not data[position:].strip(b"\x00"):
+        return "truncated after {} frames, zero filled from byte {}".format(frames, position)
+
+    return "lost sync after {} frames at byte {}".format(frames, position)
+
+
+def find_mp3s(directory):
+    """
+    Recursively finds the MP3 files of a folder.
+
+    Args:
+        directory (str): folder to search.
+
+    Yields:
+        Absolute paths of the MP3 files.
+    """
+
+    stack = [os.path.abspath(directory)]
+
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+
+            elif entry.name.lower().endswith(".mp3") and entry.is_file():
+                yield entry.path
+
+
+def verify(directory, processes=None):
+    """
+    Scans every MP3 file of a library for truncation or corruption without
+    any network access. Files are scanned in a pool of worker processes.
+
+    Args:
+        directory (str): folder of the library.
+        processes (number): amount of worker processes. Defaults to the
+            amount of CPUs. Zero scans in the current process.
+
+    Yields:
+        Tuples of the path and the problem description of each scanned file.
+        The description is None for intact files.
+    """
+
+    paths = find_mp3s(directory)
+
+    if processes == 0:
+        for path in paths:
+            yield scan(path)
+
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for result in pool.map(scan, paths, chunksize=32):
+            yield result
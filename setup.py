@@ -17,6 +17,9 @@ setup(
         "mutagen >= 1.42.0",
         "docopt >= 0.6.2"
     ],
+    extras_require={
+        "http2": ["httpx[http2] >= 0.18.0"]
+    },
     classifiers=[
         "Environment :: Console",
         "Intended Audience :: Developers",
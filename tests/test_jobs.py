@@ -0,0 +1,92 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from campdown.jobs import JobQueue, work
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.folder, "jobs.db"), lease=0.3, max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.folder)
+
+    def test_expired_lease_is_taken_over(self):
+        self.queue.put("track", "https://a.bandcamp.com/track/x", "/music")
+
+        job = self.queue.take("first")
+        self.assertEqual(job["attempts"], 1)
+
+        # The lease is held until it runs out.
+        self.assertIsNone(self.queue.take("second"))
+
+        time.sleep(0.35)
+
+        taken = self.queue.take("second")
+        self.assertEqual(taken["id"], job["id"])
+        self.assertEqual(taken["attempts"], 2)
+
+        # The first worker can neither renew nor finish the job anymore.
+        self.assertFalse(self.queue.heartbeat(job, "first"))
+
+        self.queue.finish(job, "first", "failed")
+        self.assertEqual(self.queue.counts(), {"leased": 1})
+
+        self.queue.finish(taken, "second")
+        self.assertEqual(self.queue.counts(), {"done": 1})
+
+    def test_lost_lease_stops_the_download(self):
+        self.queue.put("track", "https://a.bandcamp.com/track/x", "/music")
+
+        stopped = threading.Event()
+
+        def download(tracks, deadline=None, **kwargs):
+            # Works on the job until its deadline is cancelled.
+            started = time.monotonic()
+
+            while not deadline.expired():
+                if time.monotonic() - started > 5:
+                    return {"expired": False, "unfinished": 0, "failed": 0, "downloaded": 1, "skipped": 0}
+
+                time.sleep(0.01)
+
+            stopped.set()
+
+            return {"expired": True, "unfinished": 0, "failed": 0, "downloaded": 0, "skipped": 0}
+
+        def take_over():
+            # Another worker takes the job as if the lease ran out.
+            while not self.queue.counts().get("leased"):
+                time.sleep(0.01)
+
+            with self.queue.lock:
+                self.queue.connection.execute("UPDATE jobs SET expires = 0")
+
+            taken = self.queue.take("second")
+
+            # The first worker has to stop while the second one holds the lease.
+            if stopped.wait(5):
+                self.queue.finish(taken, "second")
+
+        thread = threading.Thread(target=take_over)
+        thread.start()
+
+        with mock.patch("campdown.jobs.download", download), mock.patch("campdown.jobs.iter_tracks"):
+            finished = work(self.queue, worker="first", silent=True)
+
+        thread.join()
+
+        self.assertTrue(stopped.is_set())
+        self.assertEqual(finished, 0)
+        self.assertEqual(self.queue.counts(), {"done": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
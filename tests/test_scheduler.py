@@ -0,0 +1,87 @@
+import threading
+import unittest
+from unittest import mock
+
+from campdown.scheduler import Scheduler
+
+
+class Sink:
+    files = True
+
+
+class FakeTrack:
+    def __init__(self, index, read):
+        self.index = index
+        self.read = read
+        self.size = 1000 * (index + 1)
+        self.sink = Sink()
+        self.verbose = True
+        self.art_enabled = False
+        self.art_url = None
+        self.cover_url = None
+        self.output = "/music/"
+
+    def download(self, deadline=None, art=False):
+        # Records how many tracks were read before this one started.
+        self.started = len(self.read)
+
+        return 1
+
+
+class SchedulerTest(unittest.TestCase):
+    def summary(self):
+        return {"expired": False, "unfinished": 0, "failed": 0, "downloaded": 0, "skipped": 0}
+
+    def test_tracks_are_read_in_windows(self):
+        read = []
+        tracks = []
+
+        def generate():
+            for i in range(50):
+                track = FakeTrack(i, read)
+                read.append(track)
+                tracks.append(track)
+
+                yield track
+
+        summary = Scheduler(jobs=2, window=8).run(generate(), self.summary(), None)
+
+        self.assertEqual(summary["downloaded"], 50)
+
+        # Downloads start before the later tracks are read.
+        self.assertLessEqual(min(track.started for track in tracks), 8)
+        self.assertLessEqual(tracks[0].started, 16)
+
+    def test_covers_once_across_windows(self):
+        covers = []
+        lock = threading.Lock()
+
+        def cover(track, deadline):
+            with lock:
+                covers.append(track.output)
+
+            return 1
+
+        tracks = [FakeTrack(i, []) for i in range(10)]
+
+        for track in tracks:
+            track.cover_url = "https://f4.bcbits.com/img/a1_10.jpg"
+
+        with mock.patch("campdown.scheduler.download_cover", cover):
+            Scheduler(jobs=2, window=3).run(tracks, self.summary(), None)
+
+        self.assertEqual(covers, ["/music/"])
+
+    def test_utilization_of_each_run(self):
+        scheduler = Scheduler(jobs=2, window=4)
+
+        scheduler.run([FakeTrack(i, []) for i in range(4)], self.summary(), None)
+        scheduler.busy = 1e6
+
+        summary = scheduler.run([FakeTrack(i, []) for i in range(4)], self.summary(), None)
+
+        self.assertLessEqual(summary["utilization"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
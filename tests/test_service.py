@@ -0,0 +1,85 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+from campdown.service import Service, handler, overlaps
+
+URL = "https://artist.bandcamp.com/music"
+
+
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.service = Service(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_folders_stay_inside_the_output(self):
+        root = os.path.join(os.path.realpath(self.folder), "")
+
+        self.assertEqual(self.service.submit(URL)["output"], root)
+        self.assertEqual(self.service.folder("a/../b"), os.path.join(root, "b", ""))
+
+        for output in ("/tmp", "..", "a/../../b", os.path.join(self.folder, "a"), 5):
+            self.assertRaises(ValueError, self.service.folder, output)
+
+        self.assertRaises(ValueError, self.service.subscribe, URL, "../elsewhere")
+
+    def test_overlaps(self):
+        root = os.path.join(os.path.realpath(self.folder), "")
+
+        self.assertTrue(overlaps(root, self.service.folder("Artist")))
+        self.assertTrue(overlaps(self.service.folder("Artist/Album"), self.service.folder("Artist")))
+        self.assertFalse(overlaps(self.service.folder("Artist"), self.service.folder("Artist 2")))
+
+
+class HandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.service = Service(self.folder)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler(self.service))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.folder)
+
+    def post(self, data, content_type="application/json"):
+        request = urllib.request.Request(
+            "http://127.0.0.1:{}/jobs".format(self.httpd.server_port),
+            data=json.dumps(data).encode("utf-8"),
+            headers={"Content-Type": content_type}
+        )
+
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+
+        except urllib.error.HTTPError as e:
+            e.close()
+
+            return e.code
+
+    def test_only_json_is_accepted(self):
+        # Forms of other sites can post plain text without a preflight request.
+        self.assertEqual(self.post({"url": URL}, "text/plain"), 415)
+        self.assertEqual(self.post({"url": URL}, "application/json; charset=utf-8"), 201)
+
+    def test_outside_folders_are_refused(self):
+        self.assertEqual(self.post({"url": URL, "output": "/etc"}), 400)
+        self.assertEqual(self.post({"url": URL, "output": "../x"}), 400)
+        self.assertEqual(self.service.list(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+import unittest
+
+# Budget of the cumulative import time of the package in microseconds.
+BUDGET = 30000
+
+# Dependencies which are only imported once they are needed.
+DEFERRED = ("requests", "mutagen", "docopt")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times():
+    """
+    Imports the package in a new interpreter with -X importtime.
+
+    Returns:
+        Dictionary of the cumulative import time in microseconds by module.
+    """
+
+    env = dict(os.environ)
+
+    # Compiling the modules on every import would exceed the budget.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import campdown"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+
+    times = {}
+
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        fields = line[len("import time:"):].split("|")
+
+        if fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+
+    return times
+
+
+class StartupTest(unittest.TestCase):
+    def test_deferred_imports(self):
+        for module in import_times():
+            self.assertNotIn(module.split(".")[0], DEFERRED)
+
+    def test_import_budget(self):
+        # The first run may still have to write the bytecode caches.
+        best = min(import_times()["campdown"] for i in range(3))
+
+        self.assertLess(best, BUDGET, "importing campdown took {} us".format(best))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from campdown.store import ObjectStore, unshare
+
+
+class ObjectStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = ObjectStore(os.path.join(self.folder, "store"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return path
+
+    def test_lookup_unknown(self):
+        self.assertIsNone(self.store.lookup(None))
+        self.assertIsNone(self.store.lookup("123"))
+
+    def test_payload_is_stored_once(self):
+        single = self.write("single.mp3", b"audio" * 1000)
+        album = self.write("album.mp3", b"audio" * 1000)
+
+        stored = self.store.add("1", single)
+        self.assertEqual(self.store.add("2", album), stored)
+        self.assertEqual(self.store.stored, 1)
+
+        # Both IDs point at the payload and untagged files share it.
+        self.assertEqual(self.store.lookup("1"), stored)
+        self.assertEqual(self.store.lookup("2"), stored)
+        self.assertEqual(os.stat(stored).st_ino, os.stat(single).st_ino)
+        self.assertEqual(os.stat(stored).st_ino, os.stat(album).st_ino)
+
+    def test_place(self):
+        stored = self.store.add("1", self.write("single.mp3", b"audio" * 1000))
+
+        linked = os.path.join(self.folder, "linked.mp3")
+        self.store.place(stored, linked)
+        self.assertEqual(os.stat(linked).st_ino, os.stat(stored).st_ino)
+
+        # Files which are tagged afterwards never share the stored inode.
+        tagged = self.write("tagged.mp3", b"old")
+        self.store.place(stored, tagged, linked=False)
+        self.assertNotEqual(os.stat(tagged).st_ino, os.stat(stored).st_ino)
+
+        with open(tagged, "rb") as f:
+            self.assertEqual(f.read(), b"audio" * 1000)
+
+    def test_unshare_keeps_the_stored_payload(self):
+        stored = self.store.add("1", self.write("single.mp3", b"audio" * 1000))
+
+        linked = os.path.join(self.folder, "linked.mp3")
+        self.store.place(stored, linked)
+
+        unshare(linked)
+
+        with open(linked, "ab") as f:
+            f.write(b"tag")
+
+        self.assertNotEqual(os.stat(linked).st_ino, os.stat(stored).st_ino)
+        self.assertEqual(os.path.getsize(stored), 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
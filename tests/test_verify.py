@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from campdown.verify import LENGTHS, id3_size, scan, verify
+
+# MPEG 1 Layer III frame at 128 kbit/s and 44.1 kHz without padding.
+FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+
+
+def id3_tag(padding):
+    # ID3v2.3 tag holding a title frame followed by padding.
+    frame = b"TIT2" + (6).to_bytes(4, "big") + b"\x00\x00" + b"\x00Title"
+    body = frame + b"\x00" * padding
+    size = len(body)
+
+    syncsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f])
+
+    return b"ID3\x03\x00\x00" + syncsafe + body
+
+
+class FrameLengthTest(unittest.TestCase):
+    def test_mpeg1_layer3(self):
+        self.assertEqual(LENGTHS[0xfb90], 417)
+
+        # The padding bit adds one byte.
+        self.assertEqual(LENGTHS[0xfb92], 418)
+
+    def test_mpeg2_and_mpeg25_layer3(self):
+        # 64 kbit/s at 22.05 kHz and at 11.025 kHz use 576 samples per frame.
+        self.assertEqual(LENGTHS[0xf380], 208)
+        self.assertEqual(LENGTHS[0xe380], 417)
+
+    def test_invalid_headers(self):
+        # Reserved version, reserved layer, free and invalid bitrates and the
+        # reserved sample rate.
+        for key in (0xeb90, 0xf990, 0xfb00, 0xfbf0, 0xfb9c):
+            self.assertEqual(LENGTHS[key], 0)
+
+    def test_id3_size(self):
+        self.assertEqual(id3_size(FRAME), 0)
+        self.assertEqual(id3_size(id3_tag(100)), len(id3_tag(100)))
+
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def scan(self, data):
+        path = os.path.join(self.folder, "track.mp3")
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return scan(path)[1]
+
+    def test_intact(self):
+        self.assertIsNone(self.scan(FRAME * 50))
+
+    def test_truncated_mid_frame(self):
+        data = FRAME * 50
+
+        self.assertEqual(self.scan(data[:-200]), "truncated in frame 50 at byte {}".format(49 * len(FRAME)))
+
+    def test_zero_filled(self):
+        # A preallocated file whose transfer stopped after 20 frames.
+        data = FRAME * 20 + b"\x00" * len(FRAME) * 30
+
+        self.assertEqual(self.scan(data), "truncated after 20 frames, zero filled from byte {}".format(20 * len(FRAME)))
+
+    def test_id3v2_tag_with_padding(self):
+        # Padding inside the tag and stray bytes between the tag and the audio.
+        self.assertIsNone(self.scan(id3_tag(1024) + b"\x00" * 7 + FRAME * 50))
+
+    def test_truncated_inside_id3v2_tag(self):
+        self.assertEqual(self.scan(id3_tag(1024)[:500]), "truncated inside the ID3 tag")
+
+    def test_id3v1_trailer(self):
+        self.assertIsNone(self.scan(FRAME * 50 + b"TAG" + b"\x00" * 125))
+
+    def test_ape_trailer(self):
+        self.assertIsNone(self.scan(FRAME * 50 + b"APETAGEX" + b"\x00" * 24))
+
+    def test_lost_sync(self):
+        data = FRAME * 20 + b"garbage" * 100 + FRAME * 20
+
+        self.assertEqual(self.scan(data), "lost sync after 20 frames at byte {}".format(20 * len(FRAME)))
+
+    def test_no_frames(self):
+        self.assertEqual(self.scan(b"not an mp3 file" * 100), "no MPEG frames found")
+        self.assertEqual(self.scan(b""), "empty file")
+
+    def test_verify_library(self):
+        os.makedirs(os.path.join(self.folder, "album"))
+
+        with open(os.path.join(self.folder, "album", "intact.mp3"), "wb") as f:
+            f.write(FRAME * 10)
+
+        with open(os.path.join(self.folder, "album", "cut.MP3"), "wb") as f:
+            f.write((FRAME * 10)[:-1])
+
+        with open(os.path.join(self.folder, "cover.jpg"), "wb") as f:
+            f.write(b"\xff\xd8")
+
+        results = dict((os.path.basename(path), problem) for path, problem in verify(self.folder, processes=0))
+
+        self.assertEqual(sorted(results), ["cut.MP3", "intact.mp3"])
+        self.assertIsNone(results["intact.mp3"])
+        self.assertTrue(results["cut.MP3"].startswith("truncated in frame 10"))
+
+
+if __name__ == "__main__":
+    unittest.main()